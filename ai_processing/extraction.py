@@ -0,0 +1,58 @@
+"""
+PDF text extraction with a persistent cache.
+
+Pages are parsed lazily and extraction stops as soon as the caller has enough text.
+Results are stored in ExtractedText keyed by the hash of the PDF's bytes, so retries,
+re-generation and other consumers (search, tagging) don't parse the same file twice.
+"""
+import hashlib
+
+import PyPDF2
+
+from .models import ExtractedText
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(field_file):
+    """Returns the SHA-256 hex digest of a stored file, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_page_text(reader, start=0):
+    """Yields the text of each page of a PdfReader from `start` on, parsing one page at a time."""
+    for index in range(start, len(reader.pages)):
+        yield reader.pages[index].extract_text() or ""
+
+
+def extract_text(field_file, max_chars=None, digest=None):
+    """
+    Returns the ExtractedText for a stored PDF, holding at least `max_chars` characters
+    (or every page when max_chars is None). Only pages that are not cached yet are parsed.
+    """
+    digest = digest or content_hash(field_file)
+    entry, created = ExtractedText.objects.get_or_create(content_hash=digest)
+    if entry.complete or (max_chars is not None and entry.char_count >= max_chars):
+        return entry
+
+    pages = list(entry.pages)
+    char_count = entry.char_count
+    with field_file.open('rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        page_count = len(reader.pages)
+        for text in iter_page_text(reader, start=len(pages)):
+            pages.append(text)
+            char_count += len(text)
+            if max_chars is not None and char_count >= max_chars:
+                break
+
+    entry.pages = pages
+    entry.page_count = page_count
+    entry.char_count = char_count
+    entry.complete = len(pages) >= page_count
+    entry.save()
+    return entry
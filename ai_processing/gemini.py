@@ -0,0 +1,230 @@
+"""
+Shared client for the Gemini generateContent API.
+
+One client per process (see get_client) reuses pooled HTTP connections, applies
+per-call timeouts, retries 429/5xx responses and connection errors with jittered
+exponential backoff (honouring Retry-After), and limits both the request rate
+(token bucket) and the number of calls in flight (semaphore). Call counts,
+retries, errors and latencies are kept in `client.metrics`.
+"""
+import email.utils
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque, namedtuple
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+GeminiResponse = namedtuple("GeminiResponse", ["data", "usage"])
+
+
+class GeminiError(Exception):
+    """Raised when a Gemini call fails for good (non-retryable or out of retries)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `capacity` saved up."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Stops handing out tokens for a while, e.g. after the server asked us to back off."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ClientMetrics:
+    """Thread-safe call counters and a rolling window of latencies."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.counters = Counter()
+
+    def record(self, outcome, latency=None, status=None):
+        with self._lock:
+            self.counters[outcome] += 1
+            if status is not None:
+                self.counters[f"status_{status}"] += 1
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def snapshot(self):
+        """Returns the counters plus p50/p95/max latency (seconds) of recent calls."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self.counters)
+        summary = {"counters": counters, "samples": len(latencies)}
+        if latencies:
+            summary.update({
+                "p50": latencies[len(latencies) // 2],
+                "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                "max": latencies[-1],
+            })
+        return summary
+
+
+def _retry_after_seconds(response):
+    """Parses a Retry-After header given either as seconds or as an HTTP date; None if it is neither."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+class GeminiClient:
+    """A pooled, rate-limited and retrying client for generateContent."""
+
+    def __init__(self, api_key=None, api_base=None, model=None, timeout=None, max_retries=None,
+                 backoff_base=None, backoff_max=None, rate_per_second=None, burst=None, max_concurrency=None):
+        self.api_key = api_key if api_key is not None else getattr(settings, "GEMINI_API_KEY", "")
+        self.api_base = (api_base or getattr(settings, "GEMINI_API_BASE", DEFAULT_API_BASE)).rstrip("/")
+        self.model = model or getattr(settings, "GEMINI_MODEL", DEFAULT_MODEL)
+        # (connect, read) seconds
+        self.timeout = timeout or getattr(settings, "GEMINI_TIMEOUT", (5, 120))
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, "GEMINI_MAX_RETRIES", 4)
+        self.backoff_base = backoff_base if backoff_base is not None else getattr(settings, "GEMINI_BACKOFF_BASE", 1.0)
+        self.backoff_max = backoff_max if backoff_max is not None else getattr(settings, "GEMINI_BACKOFF_MAX", 60.0)
+        max_concurrency = max_concurrency or getattr(settings, "GEMINI_MAX_CONCURRENCY", 4)
+        rate_per_second = rate_per_second if rate_per_second is not None else getattr(settings, "GEMINI_RATE_PER_SECOND", 1.0)
+        # by default as many calls as may be in flight can start at once, so a summary's chunks go out together
+        burst = burst or getattr(settings, "GEMINI_RATE_BURST", None) or max(max_concurrency, int(rate_per_second))
+
+        self.bucket = TokenBucket(rate_per_second, burst) if rate_per_second else None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.metrics = ClientMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    @property
+    def url(self):
+        return f"{self.api_base}/models/{self.model}:generateContent"
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def post(self, payload):
+        """POSTs a generateContent payload and returns the decoded JSON body."""
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if self.bucket:
+                self.bucket.acquire()
+            with self._slots:
+                started = time.monotonic()
+                error = None
+                try:
+                    response = self.session.post(
+                        self.url, params={"key": self.api_key}, json=payload, timeout=self.timeout
+                    )
+                except (requests.ConnectionError, requests.Timeout) as exc:
+                    error = exc
+                latency = time.monotonic() - started
+
+            # retries back off outside the concurrency slot, so a waiting call doesn't hold one
+            if error is not None:
+                self.metrics.record("network_error", latency)
+                if last_attempt:
+                    raise GeminiError(f"Gemini request failed: {error}") from error
+                delay = self._backoff(attempt)
+                logger.warning("Gemini request failed (%s), retrying in %.1fs", error, delay)
+                self.metrics.record("retry")
+                time.sleep(delay)
+                continue
+
+            if response.status_code < 400:
+                self.metrics.record("success", latency, response.status_code)
+                return response.json()
+
+            self.metrics.record("http_error", latency, response.status_code)
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                raise GeminiError(
+                    f"Gemini returned HTTP {response.status_code}: {response.text[:500]}",
+                    status=response.status_code,
+                )
+
+            retry_after = _retry_after_seconds(response)
+            delay = min(retry_after, self.backoff_max) if retry_after is not None else self._backoff(attempt)
+            if retry_after is not None and self.bucket:
+                # the limit is shared by every caller in this process
+                self.bucket.pause(delay)
+            logger.warning("Gemini returned HTTP %s, retrying in %.1fs", response.status_code, delay)
+            self.metrics.record("retry")
+            time.sleep(delay)
+
+    def generate_json(self, prompt, response_schema):
+        """Asks for a JSON response matching `response_schema`; returns a GeminiResponse."""
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"responseMimeType": "application/json", "responseSchema": response_schema},
+        }
+        result = self.post(payload)
+        try:
+            text = result["candidates"][0]["content"]["parts"][0]["text"]
+            data = json.loads(text)
+        except (KeyError, IndexError, TypeError, ValueError) as exc:
+            raise GeminiError(f"Unexpected Gemini response: {exc}") from exc
+        return GeminiResponse(data=data, usage=result.get("usageMetadata", {}))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the process-wide GeminiClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient()
+    return _client
@@ -0,0 +1,347 @@
+"""
+Progress and timing records for the background pipelines.
+
+A ProcessingJob is created (queued) when a paper's article generation or
+thumbnail rendering is scheduled. The task runs inside `track(...)`, which marks
+the job running, counts the attempt and closes the job as succeeded or failed.
+`tracker.stage(name)` times one stage of it. The current stage is written as it
+starts so the progress endpoint can show it, and the timings are written when
+the stage ends. stage_stats() aggregates recent jobs into per-stage latency
+percentiles and failure rates, and queue_stats() reports queue depths and how
+long jobs wait before they start.
+
+Runs are idempotent per (paper, pipeline, pipeline version). The database
+allows only one queued or running job per run (the job_one_in_flight
+constraint), so two submit() calls racing each other, from any process, end up
+with the same job and only one task is sent. A task that starts anyway (a
+manual retry sent straight to Celery, a redelivered message) can't mark its job
+running while another run is, and gives up with AlreadyRunning in track()
+before doing any work. A job still running PIPELINE_LOCK_TIMEOUT after it
+started lost its worker, and one still queued PIPELINE_QUEUE_TIMEOUT after it
+was scheduled lost its task message (the broker was down when it was sent, or
+the queue was purged); either is marked failed so it stops blocking new runs.
+"""
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+from . import queues
+from .models import ProcessingJob
+
+# Jobs looked at by stage_stats() and queue_stats(), newest first.
+STATS_WINDOW = timedelta(days=1)
+STATS_MAX_JOBS = 5000
+
+# Bump a pipeline's version when its output changes, so papers can be re-run
+# without waiting for (or being collapsed into) runs of the old version.
+PIPELINE_VERSIONS = {ProcessingJob.ARTICLE: 1, ProcessingJob.THUMBNAILS: 1}
+# A job still "running" this long (seconds) after it started lost its worker and no longer blocks new runs.
+PIPELINE_LOCK_TIMEOUT = getattr(settings, "PIPELINE_LOCK_TIMEOUT", 30 * 60)
+# A job still "queued" this long (seconds) after it was scheduled lost its task message. Keep it
+# above the longest wait a queue backs up to, including the countdowns import_papers spreads tasks over.
+PIPELINE_QUEUE_TIMEOUT = getattr(settings, "PIPELINE_QUEUE_TIMEOUT", 6 * 60 * 60)
+
+
+class AlreadyRunning(Exception):
+    """Raised by track() when another run of the same pipeline for the paper is queued or running."""
+
+
+def _already_running(paper_id, kind):
+    return AlreadyRunning(f"Paper {paper_id}'s {kind} pipeline is already running.")
+
+
+def _live():
+    """Matches the jobs that hold their run: queued or running, and not stale."""
+    now = timezone.now()
+    return (
+        Q(state=ProcessingJob.QUEUED, created_at__gte=now - timedelta(seconds=PIPELINE_QUEUE_TIMEOUT))
+        | Q(state=ProcessingJob.RUNNING, started_at__gte=now - timedelta(seconds=PIPELINE_LOCK_TIMEOUT))
+    )
+
+
+def _fail_stale(paper_ids, kind):
+    """Marks the papers' jobs that lost their task message or their worker failed, so they stop holding the run."""
+    now = timezone.now()
+    ProcessingJob.objects.filter(
+        Q(state=ProcessingJob.QUEUED, created_at__lt=now - timedelta(seconds=PIPELINE_QUEUE_TIMEOUT))
+        | Q(state=ProcessingJob.RUNNING, started_at__lt=now - timedelta(seconds=PIPELINE_LOCK_TIMEOUT)),
+        paper_id__in=paper_ids, kind=kind,
+    ).update(
+        state=ProcessingJob.FAILED, finished_at=now,
+        error=Case(
+            When(state=ProcessingJob.QUEUED, then=Value("No worker picked this job up.")),
+            default=Value("The worker running this job was lost."),
+        ),
+    )
+
+
+def enqueue(paper, kind, queue=""):
+    """Records that a pipeline run was scheduled for a paper; pass the job's id to the task."""
+    return ProcessingJob.objects.create(
+        paper_id=getattr(paper, "pk", paper), kind=kind, pipeline_version=PIPELINE_VERSIONS[kind], queue=queue
+    )
+
+
+def enqueue_many(paper_ids, kind, queue=""):
+    """
+    Bulk version of enqueue(); returns {paper_id: job_id} for the jobs it created.
+    Papers that already have a run queued or running are left out.
+    """
+    version = PIPELINE_VERSIONS[kind]
+    busy = set(ProcessingJob.objects.filter(
+        _live(), paper_id__in=paper_ids, kind=kind, pipeline_version=version,
+    ).values_list("paper_id", flat=True))
+    _fail_stale([pk for pk in paper_ids if pk not in busy], kind)
+    new = [
+        ProcessingJob(paper_id=pk, kind=kind, pipeline_version=version, queue=queue)
+        for pk in paper_ids if pk not in busy
+    ]
+    try:
+        with transaction.atomic():
+            jobs = ProcessingJob.objects.bulk_create(new)
+    except IntegrityError:
+        # a run was scheduled concurrently; insert one by one and skip the papers that have one
+        jobs = []
+        for job in new:
+            try:
+                with transaction.atomic():
+                    job.save()
+            except IntegrityError:
+                continue
+            jobs.append(job)
+    if jobs and jobs[0].pk is None:
+        # backends that don't return ids from bulk inserts
+        jobs = ProcessingJob.objects.filter(
+            paper_id__in=[job.paper_id for job in jobs], kind=kind, pipeline_version=version,
+            state=ProcessingJob.QUEUED,
+        )
+    return {job.paper_id: job.pk for job in jobs}
+
+
+def in_flight(paper_id, kind):
+    """The paper's (recently) queued or running job of the current pipeline version, if any."""
+    return ProcessingJob.objects.filter(
+        _live(), paper_id=paper_id, kind=kind, pipeline_version=PIPELINE_VERSIONS[kind],
+    ).order_by("-created_at").first()
+
+
+def submit(task, paper, kind, args, kwargs=None, bulk=False, **options):
+    """
+    Schedules `task` for a paper's pipeline on its queue (see queues.py) once the
+    current transaction commits, passing it the new job's id. Returns (job, created).
+    When a run is already queued or running, that job is returned and nothing is sent.
+    """
+    paper_id = getattr(paper, "pk", paper)
+    job = in_flight(paper_id, kind)
+    if job is not None:
+        return job, False
+    _fail_stale([paper_id], kind)
+    queue, priority = queues.route(task, bulk)
+    try:
+        with transaction.atomic():
+            job = enqueue(paper_id, kind, queue)
+    except IntegrityError:
+        # another request scheduled the run between the check and the insert
+        job = in_flight(paper_id, kind)
+        if job is None:
+            raise
+        return job, False
+    transaction.on_commit(
+        lambda: queues.dispatch(task, args, {**(kwargs or {}), "job_id": job.pk}, bulk=bulk, **options)
+    )
+    return job, True
+
+
+class Tracker:
+    """Times the stages of one job and collects its counters."""
+
+    COUNTERS = ("pages", "bytes_processed", "llm_calls", "cached_llm_calls", "prompt_tokens", "output_tokens")
+
+    def __init__(self, job):
+        self.job = job
+
+    @contextmanager
+    def stage(self, name):
+        ProcessingJob.objects.filter(pk=self.job.pk).update(stage=name)
+        self.job.stage = name
+        started = time.perf_counter()
+        yield
+        self.job.timings[name] = round(self.job.timings.get(name, 0) + time.perf_counter() - started, 4)
+        ProcessingJob.objects.filter(pk=self.job.pk).update(timings=self.job.timings)
+
+    def count(self, **counters):
+        for name, value in counters.items():
+            if name not in self.COUNTERS:
+                raise ValueError(f"Unknown job counter '{name}'.")
+            setattr(self.job, name, getattr(self.job, name) + value)
+
+    def record_usage(self, usage):
+        """Adds a summarize() usage tally (calls, cached calls and token counts)."""
+        self.count(
+            llm_calls=usage.get("calls", 0), cached_llm_calls=usage.get("cached", 0),
+            prompt_tokens=usage.get("promptTokenCount", 0), output_tokens=usage.get("candidatesTokenCount", 0),
+        )
+
+
+@contextmanager
+def track(paper_id, kind, job_id=None):
+    """
+    Runs the body as an attempt of job `job_id` (or of a new job, when the task was
+    scheduled without one) and yields its Tracker. An exception marks the job failed,
+    with the stage it happened in, and is re-raised. Raises AlreadyRunning when
+    another run of the pipeline for the paper is queued or running.
+    """
+    job = _claim(paper_id, kind, job_id)
+    tracker = Tracker(job)
+    try:
+        yield tracker
+    except Exception as e:
+        job.state = ProcessingJob.FAILED
+        job.error = str(e)[:2000]
+        raise
+    else:
+        job.state = ProcessingJob.SUCCEEDED
+        job.stage = ""
+    finally:
+        job.finished_at = timezone.now()
+        job.save()
+
+
+def _claim(paper_id, kind, job_id):
+    """Marks job `job_id` (or a new job) running; the constraint refuses it while another run is in flight."""
+    _fail_stale([paper_id], kind)
+    reset = {
+        "state": ProcessingJob.RUNNING, "error": "", "stage": "", "timings": {},
+        "started_at": timezone.now(), "finished_at": None, **{name: 0 for name in Tracker.COUNTERS},
+    }
+    try:
+        with transaction.atomic():
+            if job_id:
+                # a conditional update, so a redelivered task can't claim a job that is running already
+                if ProcessingJob.objects.filter(pk=job_id).exclude(state=ProcessingJob.RUNNING).update(
+                    attempts=F("attempts") + 1, **reset
+                ):
+                    return ProcessingJob.objects.get(pk=job_id)
+                if ProcessingJob.objects.filter(pk=job_id).exists():
+                    raise _already_running(paper_id, kind)
+            return ProcessingJob.objects.create(
+                paper_id=paper_id, kind=kind, pipeline_version=PIPELINE_VERSIONS[kind], attempts=1, **reset
+            )
+    except IntegrityError:
+        raise _already_running(paper_id, kind)
+
+
+def fail(job_id, error):
+    """Marks a queued job failed without running it (e.g. its paper disappeared)."""
+    ProcessingJob.objects.filter(pk=job_id).update(
+        state=ProcessingJob.FAILED, error=error, attempts=F("attempts") + 1, finished_at=timezone.now()
+    )
+
+
+def latest_jobs(paper_id):
+    """{kind: the paper's most recent job of that kind}."""
+    latest = {}
+    for job in ProcessingJob.objects.filter(paper_id=paper_id).order_by("-created_at")[:10]:
+        latest.setdefault(job.kind, job)
+    return latest
+
+
+def progress(paper, user=None):
+    """
+    The JSON-ready state of a paper's latest jobs, for the progress endpoint.
+    Failure messages are raw exception text, so only the paper's uploader (`user`) gets them.
+    """
+    show_errors = user is not None and user.pk == paper.uploader_id
+    jobs = latest_jobs(paper.pk)
+    return {
+        "active": any(job.active for job in jobs.values()),
+        "jobs": {
+            kind: {
+                "state": job.state, "stage": job.stage, "attempts": job.attempts,
+                "timings": job.timings, "error": job.error if show_errors and job.state == ProcessingJob.FAILED else "",
+                "pages": job.pages, "created_at": job.created_at.isoformat(),
+                "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+            }
+            for kind, job in jobs.items()
+        },
+    }
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def stage_stats(window=STATS_WINDOW, max_jobs=STATS_MAX_JOBS):
+    """
+    Per pipeline kind over the finished jobs of the last `window`: job counts, the
+    failure rate, p50/p95 total duration and p50/p95 for each stage (seconds).
+    """
+    jobs = (
+        ProcessingJob.objects.filter(finished_at__gte=timezone.now() - window)
+        .order_by("-finished_at")
+        .values("kind", "state", "timings", "started_at", "finished_at", "prompt_tokens", "output_tokens")[:max_jobs]
+    )
+    grouped = {}
+    for job in jobs:
+        grouped.setdefault(job["kind"], []).append(job)
+
+    stats = {}
+    for kind, rows in grouped.items():
+        failed = sum(1 for row in rows if row["state"] == ProcessingJob.FAILED)
+        durations = sorted(
+            (row["finished_at"] - row["started_at"]).total_seconds() for row in rows if row["started_at"]
+        )
+        stages = {}
+        for row in rows:
+            for stage, seconds in row["timings"].items():
+                stages.setdefault(stage, []).append(seconds)
+        stats[kind] = {
+            "jobs": len(rows),
+            "failed": failed,
+            "failure_rate": round(failed / len(rows), 4),
+            "prompt_tokens": sum(row["prompt_tokens"] for row in rows),
+            "output_tokens": sum(row["output_tokens"] for row in rows),
+            "duration": {"p50": _percentile(durations, 0.5), "p95": _percentile(durations, 0.95)} if durations else {},
+            "stages": {
+                stage: {"count": len(values), "p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95)}
+                for stage, values in ((stage, sorted(values)) for stage, values in stages.items())
+            },
+        }
+    return stats
+
+
+def queue_stats(window=STATS_WINDOW, max_jobs=STATS_MAX_JOBS):
+    """
+    Per queue: the jobs waiting in it now, the messages the broker reports (None
+    when it can't tell), and p50/p95 of how long the jobs started in the last
+    `window` waited between being scheduled and starting (seconds, including any
+    countdown they were sent with).
+    """
+    waiting = dict(
+        ProcessingJob.objects.filter(state=ProcessingJob.QUEUED).values("queue")
+        .annotate(n=Count("pk")).values_list("queue", "n")
+    )
+    waits = {}
+    started = (
+        ProcessingJob.objects.filter(started_at__gte=timezone.now() - window)
+        .order_by("-started_at").values_list("queue", "created_at", "started_at")[:max_jobs]
+    )
+    for queue, created_at, started_at in started:
+        waits.setdefault(queue, []).append((started_at - created_at).total_seconds())
+    broker = queues.broker_depths()
+
+    stats = {}
+    for queue in sorted(set(queues.queue_names()) | set(waiting) | set(waits)):
+        values = sorted(waits.get(queue, []))
+        stats[queue or "default"] = {
+            "queued_jobs": waiting.get(queue, 0),
+            "broker_messages": broker.get(queue),
+            "started": len(values),
+            "wait": {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95)} if values else {},
+        }
+    return stats
@@ -0,0 +1,82 @@
+"""
+Cache for LLM responses.
+
+Identical requests (same model, prompt and response schema) are answered from
+the LLMResponse table instead of calling the API again: duplicate uploads,
+manual re-runs and retries after a failure further down the task. Entries
+expire after LLM_CACHE_TTL seconds and the least recently used ones are evicted
+once there are more than LLM_CACHE_MAX_ENTRIES.
+"""
+import hashlib
+import itertools
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .gemini import GeminiResponse
+from .models import LLMResponse
+
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 10000
+# Run the (relatively expensive) size check once every this many writes per process.
+EVICT_EVERY = 100
+
+_writes = itertools.count(1)
+
+
+def cache_key(model, prompt, response_schema):
+    """SHA-256 over the model name, prompt text and a canonical form of the schema."""
+    digest = hashlib.sha256()
+    for part in (model, prompt, json.dumps(response_schema, sort_keys=True, separators=(",", ":"))):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, "LLM_CACHE_TTL", DEFAULT_TTL))
+
+
+def evict(max_entries=None):
+    """Deletes expired entries, then the least recently used ones beyond max_entries."""
+    max_entries = max_entries or getattr(settings, "LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+    expired, _ = LLMResponse.objects.filter(created_at__lt=timezone.now() - _ttl()).delete()
+    cutoff = (
+        LLMResponse.objects.order_by("-last_used_at")
+        .values_list("last_used_at", flat=True)[max_entries:max_entries + 1]
+        .first()
+    )
+    overflow = 0
+    if cutoff is not None:
+        overflow, _ = LLMResponse.objects.filter(last_used_at__lte=cutoff).delete()
+    return expired + overflow
+
+
+def lookup(model, prompt, response_schema):
+    """The cached GeminiResponse for a request, or None."""
+    now = timezone.now()
+    entry = LLMResponse.objects.filter(
+        key=cache_key(model, prompt, response_schema), created_at__gte=now - _ttl()
+    ).first()
+    if entry is None:
+        return None
+    LLMResponse.objects.filter(pk=entry.pk).update(last_used_at=now, hit_count=F("hit_count") + 1)
+    return GeminiResponse(data=entry.data, usage=entry.usage)
+
+
+def store(model, prompt, response_schema, response):
+    """Caches a fresh GeminiResponse, replacing any earlier entry for the same request."""
+    now = timezone.now()
+    LLMResponse.objects.update_or_create(
+        key=cache_key(model, prompt, response_schema),
+        defaults={
+            "model": model, "data": response.data, "usage": response.usage,
+            "created_at": now, "last_used_at": now,
+        },
+    )
+    if next(_writes) % EVICT_EVERY == 0:
+        evict()
+
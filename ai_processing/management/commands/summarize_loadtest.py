@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ai_processing.gemini import GeminiClient
+from ai_processing.mock_gemini import MockGeminiServer
+from ai_processing.summarize import SUMMARY_CHUNK_CHARS, SUMMARY_MAX_CHUNKS, chunk_pages, summarize
+
+
+def synthetic_pages(count, chars):
+    """Pages of filler text with paragraph breaks, `chars` characters each."""
+    paragraph = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8).strip()
+    text = "\n\n".join([paragraph] * (chars // len(paragraph) + 1))
+    return [f"Page {number}.\n{text}"[:chars] for number in range(1, count + 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarizes a synthetic long document against a local mock Gemini server, once per "
+        "concurrency level, to compare map-reduce wall-clock time with sequential calls."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=200, help="Pages in the synthetic document.")
+        parser.add_argument("--page-chars", type=int, default=3000, help="Characters per page.")
+        parser.add_argument("--latency", type=float, default=0.5, help="Mock server latency per call (s).")
+        parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated pool sizes to compare.")
+        parser.add_argument("--chunk-chars", type=int, default=SUMMARY_CHUNK_CHARS)
+        parser.add_argument("--max-chunks", type=int, default=SUMMARY_MAX_CHUNKS)
+
+    def handle(self, *args, **options):
+        pages = synthetic_pages(options["pages"], options["page_chars"])
+        chunks = chunk_pages(pages, options["chunk_chars"], options["max_chunks"])
+        self.stdout.write(f"{len(pages)} pages, {sum(map(len, pages))} characters -> {len(chunks)} chunks")
+
+        for concurrency in (int(level) for level in options["concurrency"].split(",")):
+            with MockGeminiServer(latency=options["latency"]) as server:
+                client = GeminiClient(
+                    api_key="test", api_base=server.api_base, rate_per_second=0, max_concurrency=concurrency,
+                )
+                started = time.monotonic()
+                result = summarize(
+                    client, pages, bypass=True, chunk_chars=options["chunk_chars"],
+                    max_chunks=options["max_chunks"], concurrency=concurrency,
+                )
+                elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"concurrency {concurrency:>3}: {elapsed:6.2f}s, {server.stats['ok']} calls, "
+                f"{len(result.get('tags', []))} tags"
+            )
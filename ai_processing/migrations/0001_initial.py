@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('pages', models.JSONField(default=list)),
+                ('page_count', models.PositiveIntegerField(default=0)),
+                ('char_count', models.PositiveIntegerField(default=0)),
+                ('complete', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_processing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('model', models.CharField(max_length=100)),
+                ('data', models.JSONField()),
+                ('usage', models.JSONField(blank=True, default=dict)),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_processing', '0002_llm_response'),
+        ('papers', '0014_related_papers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('article', 'Article generation'), ('thumbnails', 'Thumbnail rendering')], max_length=20)),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('stage', models.CharField(blank=True, default='', max_length=20)),
+                ('timings', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('pages', models.PositiveIntegerField(default=0)),
+                ('bytes_processed', models.PositiveBigIntegerField(default=0)),
+                ('llm_calls', models.PositiveIntegerField(default=0)),
+                ('cached_llm_calls', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('output_tokens', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='processing_jobs', to='papers.paper')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['paper', '-created_at'], name='job_paper_recent_idx'), models.Index(fields=['kind', '-finished_at'], name='job_kind_finished_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_processing', '0003_processing_job'),
+        ('papers', '0016_text_signatures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='pipeline_version',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='processingjob',
+            name='queue',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='processingjob',
+            index=models.Index(fields=['state', 'queue'], name='job_state_queue_idx'),
+        ),
+    ]
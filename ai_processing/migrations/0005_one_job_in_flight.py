@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:34
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    """Leaves only the newest queued or running job of each pipeline run, so the constraint can be added."""
+    ProcessingJob = apps.get_model('ai_processing', 'ProcessingJob')
+    seen = set()
+    duplicates = []
+    active = ProcessingJob.objects.filter(state__in=['queued', 'running']).order_by('-created_at', '-pk')
+    for pk, paper_id, kind, version in active.values_list('pk', 'paper_id', 'kind', 'pipeline_version'):
+        if (paper_id, kind, version) in seen:
+            duplicates.append(pk)
+        seen.add((paper_id, kind, version))
+    ProcessingJob.objects.filter(pk__in=duplicates).update(
+        state='failed', error='Superseded by a newer run.', finished_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_processing', '0004_job_queue'),
+        ('papers', '0017_upload_session'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='processingjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('state__in', ['queued', 'running'])), fields=('paper', 'kind', 'pipeline_version'), name='job_one_in_flight'),
+        ),
+    ]
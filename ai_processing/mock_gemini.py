@@ -0,0 +1,129 @@
+"""
+A local HTTP stand-in for the Gemini generateContent endpoint.
+
+Used to exercise GeminiClient offline: it can add latency, throttle with 429 +
+Retry-After above a request rate, and fail a fraction of calls with 503.
+
+    with MockGeminiServer(latency=0.05, rate_limit=20) as server:
+        client = GeminiClient(api_base=server.api_base, api_key="test")
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_responder(prompt):
+    """Returns a canned report/summary/tags object for a prompt."""
+    words = prompt.split()
+    return {
+        "report": f"This document contains {len(words)} words.\n\nIt was summarized by the mock Gemini server.",
+        "summary": f"A part of {len(words)} words, summarized by the mock Gemini server.",
+        "tags": ["mock", "testing", "offline"],
+    }
+
+
+class MockGeminiServer:
+    """Runs a threaded HTTP server on localhost in a background thread."""
+
+    def __init__(self, latency=0.0, rate_limit=None, retry_after=1, error_rate=0.0, responder=None,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.responder = responder or default_responder
+        self.stats = Counter()
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_base(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _throttled(self):
+        """True when the request rate over the last second is above rate_limit."""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                return True
+            self._recent.append(now)
+            return False
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.stats["requests"] += 1
+
+                if server._throttled():
+                    with server._lock:
+                        server.stats["throttled"] += 1
+                    return self._reply(429, {"error": {"code": 429, "message": "Resource exhausted"}},
+                                       {"Retry-After": str(server.retry_after)})
+                if server.error_rate and random.random() < server.error_rate:
+                    with server._lock:
+                        server.stats["errors"] += 1
+                    return self._reply(503, {"error": {"code": 503, "message": "Unavailable"}})
+
+                if server.latency:
+                    time.sleep(server.latency)
+                prompt = "".join(
+                    part.get("text", "")
+                    for content in payload.get("contents", [])
+                    for part in content.get("parts", [])
+                )
+                data = server.responder(prompt)
+                with server._lock:
+                    server.stats["ok"] += 1
+                self._reply(200, {
+                    "candidates": [{"content": {"parts": [{"text": json.dumps(data)}], "role": "model"}}],
+                    "usageMetadata": {
+                        "promptTokenCount": len(prompt) // 4,
+                        "candidatesTokenCount": len(json.dumps(data)) // 4,
+                    },
+                })
+
+        return Handler
@@ -1,3 +1,114 @@
 from django.db import models
 
-# Create your models here.
+
+class ExtractedText(models.Model):
+    """
+    Text extracted from a PDF, stored per page and keyed by the SHA-256 of the file's bytes.
+    Extraction may stop early once enough text has been read, in which case `complete` is False
+    and a later consumer that needs more text continues from the last extracted page.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    pages = models.JSONField(default=list)
+    page_count = models.PositiveIntegerField(default=0)
+    char_count = models.PositiveIntegerField(default=0)
+    complete = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Text of {self.content_hash[:12]} ({len(self.pages)}/{self.page_count} pages)"
+
+    def text(self, max_chars=None):
+        """Joins the extracted pages, stopping once max_chars characters are collected."""
+        if max_chars is None:
+            return "\n".join(self.pages)
+        parts, remaining = [], max_chars
+        for page in self.pages:
+            if remaining <= 0:
+                break
+            parts.append(page[:remaining])
+            remaining -= len(page) + 1
+        return "\n".join(parts)
+
+
+class LLMResponse(models.Model):
+    """
+    A cached model response, keyed by a hash of (model, prompt, response schema).
+    Entries expire after a TTL and the least recently used ones are evicted beyond a size cap.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=100)
+    data = models.JSONField()
+    usage = models.JSONField(default=dict, blank=True)
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.model} response {self.key[:12]} ({self.hit_count} hits)"
+
+
+class ProcessingJob(models.Model):
+    """
+    One run of a background pipeline for a paper (generating its article, rendering its
+    thumbnails): its state, how many times it was attempted, how long each stage took
+    and how much it processed. See jobs.py.
+    """
+    ARTICLE = "article"
+    THUMBNAILS = "thumbnails"
+    KIND_CHOICES = [(ARTICLE, "Article generation"), (THUMBNAILS, "Thumbnail rendering")]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATE_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCEEDED, "Succeeded"), (FAILED, "Failed")]
+
+    paper = models.ForeignKey("papers.Paper", on_delete=models.CASCADE, related_name="processing_jobs")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # runs of the same pipeline version for the same paper collapse into one (see jobs.submit)
+    pipeline_version = models.PositiveSmallIntegerField(default=1)
+    # the Celery queue the task was sent to (see queues.py)
+    queue = models.CharField(max_length=40, blank=True, default="")
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # the stage running now (or the one that failed), and {stage: seconds} for the finished ones
+    stage = models.CharField(max_length=20, blank=True, default="")
+    timings = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default="")
+    pages = models.PositiveIntegerField(default=0)
+    bytes_processed = models.PositiveBigIntegerField(default=0)
+    llm_calls = models.PositiveIntegerField(default=0)
+    cached_llm_calls = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["paper", "-created_at"], name="job_paper_recent_idx"),
+            models.Index(fields=["kind", "-finished_at"], name="job_kind_finished_idx"),
+            models.Index(fields=["state", "queue"], name="job_state_queue_idx"),
+        ]
+        constraints = [
+            # at most one queued or running job per pipeline run; this is what collapses duplicate submits
+            models.UniqueConstraint(
+                fields=["paper", "kind", "pipeline_version"],
+                condition=models.Q(state__in=["queued", "running"]),
+                name="job_one_in_flight",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for paper {self.paper_id}: {self.state}"
+
+    @property
+    def active(self):
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    @property
+    def duration(self):
+        if self.started_at and self.finished_at:
+            return (self.finished_at - self.started_at).total_seconds()
+        return None
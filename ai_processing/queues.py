@@ -0,0 +1,83 @@
+"""
+Which Celery queue each background pipeline task goes to.
+
+Work is split two ways. Interactive work has someone waiting on the page (an
+upload); bulk work has nobody waiting (imports, backfills, regenerate commands).
+CPU-bound tasks (text extraction, thumbnail rendering) are also kept apart from
+network-bound ones (Gemini calls). Each of the four lanes has its own queue, so
+a backfill never sits in front of an upload and a worker blocked on a slow LLM
+response never holds a slot a PDF render could use. (Message priorities alone
+can't do this: Redis ignores them unless the broker is configured with
+priority_steps, and even then a worker's prefetched bulk tasks run first.)
+
+Every queue needs a worker, or its tasks never run. In production, for example:
+
+    celery -A citeright worker -Q celery,interactive.llm --pool=threads -c 16
+    celery -A citeright worker -Q interactive.cpu,bulk.cpu -c 4
+    celery -A citeright worker -Q bulk.llm --pool=threads -c 4
+
+A single development worker can consume all of them:
+
+    celery -A citeright worker -Q celery,interactive.cpu,interactive.llm,bulk.cpu,bulk.llm
+
+AI_TASK_QUEUES renames lanes or merges them (map several to one queue name).
+Interactive tasks are also sent with a higher priority, which matters where
+lanes share a queue. Small bookkeeping tasks (feed fan-out, index updates) stay
+on the default queue ("celery").
+"""
+from django.conf import settings
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+CPU = "cpu"
+LLM = "llm"
+
+AI_TASK_QUEUES = {
+    f"{lane}.{resource}": f"{lane}.{resource}" for lane in (INTERACTIVE, BULK) for resource in (CPU, LLM)
+} | getattr(settings, "AI_TASK_QUEUES", {})
+# Redis numbers priorities 0 (first) to 9 (last); swap these for RabbitMQ, where higher runs first.
+AI_TASK_PRIORITIES = getattr(settings, "AI_TASK_PRIORITIES", {INTERACTIVE: 0, BULK: 9})
+
+# What each pipeline task mostly waits on; tasks not listed are CPU-bound.
+TASK_RESOURCES = {
+    "ai_processing.tasks.generate_article_task": LLM,
+}
+
+
+def route(task, bulk=False):
+    """(queue name, priority) for a task in the interactive or bulk lane."""
+    lane = BULK if bulk else INTERACTIVE
+    resource = TASK_RESOURCES.get(task.name, CPU)
+    return AI_TASK_QUEUES[f"{lane}.{resource}"], AI_TASK_PRIORITIES[lane]
+
+
+def dispatch(task, args=(), kwargs=None, bulk=False, **options):
+    """Sends a task to its queue with its lane's priority; `options` go to apply_async (countdown, ...)."""
+    queue, priority = route(task, bulk)
+    return task.apply_async(args, kwargs or {}, queue=queue, priority=priority, **options)
+
+
+def queue_names():
+    return sorted(set(AI_TASK_QUEUES.values()))
+
+
+def broker_depths(names=None):
+    """{queue: messages waiting} as the broker reports them; queues it can't report on are left out."""
+    from celery import current_app
+
+    depths = {}
+    try:
+        with current_app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=0)
+            for name in names or queue_names():
+                # a passive declare of a missing queue closes the channel, so each gets its own
+                channel = connection.channel()
+                try:
+                    depths[name] = channel.queue_declare(name, passive=True).message_count
+                except Exception:
+                    pass
+                finally:
+                    channel.close()
+    except Exception:
+        pass
+    return depths
@@ -0,0 +1,176 @@
+"""
+Map-reduce summarization for documents too long for one prompt.
+
+The extracted pages are packed into chunks of at most SUMMARY_CHUNK_CHARS
+characters. A page only ends up split when it is larger than a chunk on its own,
+and then on paragraph breaks. The chunks are summarized concurrently on a
+thread pool of SUMMARY_CONCURRENCY workers, so a long document takes about as
+long as its slowest chunk. That holds as long as the Gemini client lets the
+calls go out together: GEMINI_MAX_CONCURRENCY and GEMINI_RATE_BURST (which
+defaults to it) should be at least SUMMARY_CONCURRENCY. Beyond the burst, calls
+start at GEMINI_RATE_PER_SECOND, so documents with more chunks than that are
+paced by the rate limit. A reduce pass then writes the report and tags from
+the partial summaries, first combining them in groups if together they are still
+longer than a chunk.
+
+Documents that fit in one chunk are summarized in a single call, as before. Only
+the first SUMMARY_MAX_CHUNKS chunks of a document are read.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+from . import llm_cache
+
+SUMMARY_CHUNK_CHARS = getattr(settings, "SUMMARY_CHUNK_CHARS", 12000)
+SUMMARY_MAX_CHUNKS = getattr(settings, "SUMMARY_MAX_CHUNKS", 24)
+SUMMARY_CONCURRENCY = getattr(settings, "SUMMARY_CONCURRENCY", 4)
+
+REPORT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"report": {"type": "STRING"}, "tags": {"type": "ARRAY", "items": {"type": "STRING"}}},
+}
+PART_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"summary": {"type": "STRING"}, "tags": {"type": "ARRAY", "items": {"type": "STRING"}}},
+}
+
+REPORT_INSTRUCTIONS = """
+        1. Generate a formal report consisting of simple text paragraphs. The report should cover an introduction, the key findings, and a conclusion. Ensure there is a new line after each paragraph. Do NOT use markdown headings, numbered lists, or bullet points.
+        2. Identify 5 to 7 of the most relevant keywords or topics as tags.
+
+        Return the result as a single JSON object with two keys: "report" and "tags".
+"""
+
+
+def report_prompt(text):
+    """The single-pass prompt: the report and tags straight from the document's text."""
+    return f"""
+        Analyze the following text from a research document. Your task is to:{REPORT_INSTRUCTIONS}
+        ---
+        EXTRACTED TEXT:
+        {text}
+        ---
+        """
+
+
+def part_prompt(text, index, total):
+    return f"""
+        The following is part {index} of {total} of a research document. Summarize it in a few plain paragraphs,
+        keeping its methods, results and any numbers needed to understand them, and list up to 7 keywords or
+        topics it covers.
+
+        Return the result as a single JSON object with two keys: "summary" and "tags".
+
+        ---
+        PART {index} OF {total}:
+        {text}
+        ---
+        """
+
+
+def reduce_prompt(summaries, tags):
+    parts = "\n\n".join(f"PART {index}:\n{summary}" for index, summary in enumerate(summaries, 1))
+    return f"""
+        The following are summaries of consecutive parts of one research document, in order. Your task is to
+        write a report on the whole document from them:{REPORT_INSTRUCTIONS}
+        Keywords found in the parts: {", ".join(tags)}
+
+        ---
+        {parts}
+        ---
+        """
+
+
+def _split_long(text, size):
+    """Splits text longer than `size` on paragraph breaks, or hard at `size` when a paragraph is too long."""
+    pieces = []
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > size:
+            pieces.append(paragraph[:size])
+            paragraph = paragraph[size:]
+        pieces.append(paragraph)
+    return pieces
+
+
+def chunk_pages(pages, chunk_chars=SUMMARY_CHUNK_CHARS, max_chunks=SUMMARY_MAX_CHUNKS):
+    """Packs consecutive pages (or pieces of oversized pages) into at most max_chunks chunks of text."""
+    chunks, current, size = [], [], 0
+    for page in pages:
+        for piece in _split_long(page, chunk_chars) if len(page) > chunk_chars else [page]:
+            if current and size + len(piece) + 1 > chunk_chars:
+                chunks.append("\n".join(current))
+                if len(chunks) >= max_chunks:
+                    return chunks
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current and any(part.strip() for part in current):
+        chunks.append("\n".join(current))
+    return chunks[:max_chunks]
+
+
+def _map(client, prompts, schema, bypass, concurrency, usage):
+    """
+    Answers the prompts, calling the API for those not cached concurrently. Results come
+    back in prompt order and the first failure is raised. Each answer is cached as soon
+    as it arrives, so a retry after a failure only asks for the parts still missing. The
+    cache is only read and written from this thread; the pool threads just make HTTP calls.
+    """
+    results = [None if bypass else llm_cache.lookup(client.model, prompt, schema) for prompt in prompts]
+    missing = [index for index, result in enumerate(results) if result is None]
+    usage["cached"] += len(prompts) - len(missing)
+
+    def record(index, response):
+        results[index] = response
+        llm_cache.store(client.model, prompts[index], schema, response)
+        usage["calls"] += 1
+        for name, value in response.usage.items():
+            if isinstance(value, int):
+                usage[name] += value
+
+    if len(missing) == 1:
+        record(missing[0], client.generate_json(prompts[missing[0]], schema))
+    elif missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(missing)))) as pool:
+            futures = {pool.submit(client.generate_json, prompts[index], schema): index for index in missing}
+            try:
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+    return [result.data for result in results]
+
+
+def summarize(client, pages, bypass=False, chunk_chars=SUMMARY_CHUNK_CHARS, max_chunks=SUMMARY_MAX_CHUNKS,
+              concurrency=SUMMARY_CONCURRENCY, usage=None):
+    """
+    Returns {"report": ..., "tags": [...]} for a document given as a list of page texts,
+    in one call when it fits in a chunk and by map-reduce otherwise. API calls, cached
+    answers and the token counts the API reports are added to the `usage` Counter.
+    """
+    usage = usage if usage is not None else Counter()
+    chunks = chunk_pages(pages, chunk_chars, max_chunks)
+    if len(chunks) <= 1:
+        return _map(client, [report_prompt(chunks[0] if chunks else "")], REPORT_SCHEMA, bypass, 1, usage)[0]
+
+    total = len(chunks)
+    parts = _map(client, [part_prompt(chunk, i, total) for i, chunk in enumerate(chunks, 1)], PART_SCHEMA, bypass, concurrency, usage)
+    summaries = [part.get("summary", "") for part in parts]
+    tags = list(dict.fromkeys(tag.strip().lower() for part in parts for tag in part.get("tags", []) if tag.strip()))
+
+    # very long documents: combine neighbouring summaries until they fit in one prompt
+    while sum(len(summary) for summary in summaries) > chunk_chars and len(summaries) > 1:
+        groups = chunk_pages(summaries, chunk_chars, max_chunks)
+        if len(groups) >= len(summaries):
+            break
+        combined = _map(
+            client, [part_prompt(group, i, len(groups)) for i, group in enumerate(groups, 1)], PART_SCHEMA, bypass,
+            concurrency, usage,
+        )
+        summaries = [part.get("summary", "") for part in combined]
+
+    return _map(client, [reduce_prompt(summaries, tags)], REPORT_SCHEMA, bypass, 1, usage)[0]
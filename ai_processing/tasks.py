@@ -1,81 +1,93 @@
+from collections import Counter
+
 from celery import shared_task
-from papers.models import Paper, Tag
-import PyPDF2
-import requests
-import json
-# Import Django's settings to securely access the API key
-from django.conf import settings
+from papers.duplicates import DUPLICATE_TEXT_CHARS, register as register_text, reusable_article
+from papers.models import Paper, PdfBlob, Tag
+from papers.tasks import fold_in_related_task, index_text_task
+from . import jobs, queues
+from .extraction import extract_text
+from .gemini import get_client
+from .llm_cache import evict
+from .models import ProcessingJob
+from .summarize import SUMMARY_CHUNK_CHARS, SUMMARY_MAX_CHUNKS, summarize
 
-# The API URL is now built using the key from your settings file
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={settings.GEMINI_API_KEY}"
+# Only this much of the document's text is read; longer texts are summarized chunk by chunk.
+MAX_PROMPT_CHARS = SUMMARY_CHUNK_CHARS * SUMMARY_MAX_CHUNKS
 
 @shared_task
-def generate_article_task(paper_id):
+def generate_article_task(paper_id, force=False, job_id=None):
     """
     A Celery task to generate a full technical article and relevant tags from a PDF using the Gemini API.
+    A near-duplicate of an earlier paper reuses that paper's article and tags (see duplicates.py).
+    The reference list is parsed afterwards by index_text_task, whatever the article's outcome.
+    Long documents are summarized in parallel chunks and then combined (see summarize.py).
+    Identical prompts are answered from the LLM response cache unless `force` is set.
+    Progress, stage timings and failures are recorded on the ProcessingJob `job_id`.
     """
     try:
-        paper = Paper.objects.get(id=paper_id)
+        paper = Paper.objects.select_related("blob").get(id=paper_id)
     except Paper.DoesNotExist:
+        if job_id:
+            jobs.fail(job_id, "Paper not found.")
         return "Paper not found."
 
     try:
-        full_text = ""
-        with paper.pdf_file.open('rb') as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            for page in pdf_reader.pages:
-                full_text += page.extract_text() or ""
-        
-        truncated_text = full_text[:12000]
-
-        if not truncated_text.strip():
-            paper.article_content = "Could not extract text from the PDF to generate an article."
-            paper.save()
-            return "No text extracted from PDF."
-
-        prompt = f"""
-        Analyze the following text from a research document. Your task is to:
-        1. Generate a formal report consisting of simple text paragraphs. The report should cover an introduction, the key findings, and a conclusion. Ensure there is a new line after each paragraph. Do NOT use markdown headings, numbered lists, or bullet points.
-        2. Identify 5 to 7 of the most relevant keywords or topics as tags.
-
-        Return the result as a single JSON object with two keys: "report" and "tags".
+        with jobs.track(paper.pk, ProcessingJob.ARTICLE, job_id) as job:
+            with job.stage("extract"):
+                digest = paper.blob.content_hash if paper.blob_id else None
+                extracted = extract_text(paper.pdf_file, max_chars=MAX_PROMPT_CHARS, digest=digest)
+                job.count(pages=len(extracted.pages), bytes_processed=paper.blob.size if paper.blob_id else 0)
+                if not extracted.text(MAX_PROMPT_CHARS).strip():
+                    raise ValueError("Could not extract text from the PDF to generate an article.")
 
-        ---
-        EXTRACTED TEXT:
-        {truncated_text}
-        ---
-        """
+            with job.stage("dedupe"):
+                # a near-duplicate of an earlier paper shares its article instead of calling Gemini again
+                original = register_text(paper, extracted.text(DUPLICATE_TEXT_CHARS))
+                shared = reusable_article(original) if original and not force else None
 
-        response_schema = {
-            "type": "OBJECT",
-            "properties": { "report": {"type": "STRING"}, "tags": { "type": "ARRAY", "items": {"type": "STRING"} } }
-        }
+            if shared:
+                response_data = {"report": shared[0], "tags": shared[1]}
+            else:
+                with job.stage("llm"):
+                    # The shared client pools connections, rate-limits and retries throttled calls.
+                    usage = Counter()
+                    try:
+                        response_data = summarize(get_client(), extracted.pages, bypass=force, usage=usage)
+                    finally:
+                        job.record_usage(usage)
 
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": { "responseMimeType": "application/json", "responseSchema": response_schema }
-        }
-        
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(API_URL, json=payload, headers=headers)
-        response.raise_for_status()
+            with job.stage("tags"):
+                paper.article_content = response_data.get("report", "AI failed to generate a report.")
+                paper.save()
 
-        result = response.json()
-        response_data = result['candidates'][0]['content']['parts'][0]['text']
+                generated_tags = response_data.get("tags", [])
+                tags = []
+                for tag_name in generated_tags:
+                    tag, created = Tag.objects.get_or_create(name=tag_name.strip().lower())
+                    tags.append(tag)
+                # a single add keeps it to one m2m_changed signal (and one search re-index)
+                paper.tags.add(*tags)
 
-        paper.article_content = response_data.get("report", "AI failed to generate a report.")
-        paper.save()
-
-        generated_tags = response_data.get("tags", [])
-        for tag_name in generated_tags:
-            tag, created = Tag.objects.get_or_create(name=tag_name.strip().lower())
-            paper.tags.add(tag)
+                # Remember the result on the shared blob so re-uploads of the same file reuse it.
+                if paper.blob_id:
+                    PdfBlob.objects.filter(pk=paper.blob_id).update(
+                        ai_article=paper.article_content, ai_tags=[tag.name for tag in tags]
+                    )
+    except jobs.AlreadyRunning as e:
+        return str(e)
+    except Exception as e:
+        result = f"Failed to generate article: {str(e)}"
+    else:
+        fold_in_related_task.delay(paper.id)
+        result = f"Successfully generated article and tags for paper {paper.id}"
 
-        return f"Successfully generated article and tags for paper {paper.id}"
+    # The references are at the end, so parsing them reads the whole document; that
+    # runs on its own, after the article, and its failures don't touch the article job.
+    queues.dispatch(index_text_task, (paper.id,), {"duplicates": False}, bulk=True)
+    return result
 
-    except Exception as e:
-        error_message = f"Failed to generate article: {str(e)}"
-        paper.article_content = error_message
-        paper.save()
-        return error_message
 
+@shared_task
+def evict_llm_cache_task():
+    """Periodic task: drops expired and least recently used cached LLM responses."""
+    return f"Evicted {evict()} cached LLM responses."
@@ -1,3 +1,165 @@
+import time
+from collections import Counter
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
+
+from papers.models import Paper
+from papers.tasks import generate_thumbnails_task
+from . import jobs, queues
+from .gemini import GeminiClient, GeminiError, GeminiResponse, _retry_after_seconds
+from .mock_gemini import MockGeminiServer
+from .models import LLMResponse, ProcessingJob
+from .summarize import PART_SCHEMA, SUMMARY_CONCURRENCY, _map, part_prompt
+from .tasks import generate_article_task
+
+
+class SummarizeConcurrencyTests(TestCase):
+    """The map phase of a long summary runs in parallel with the default client limits."""
+
+    LATENCY = 0.3
+
+    def test_default_limits_run_chunks_in_parallel(self):
+        prompts = [part_prompt(f"Chunk {i}. " + "word " * 500, i, SUMMARY_CONCURRENCY)
+                   for i in range(1, SUMMARY_CONCURRENCY + 1)]
+        with MockGeminiServer(latency=self.LATENCY) as server:
+            # only the endpoint is overridden; rate, burst and concurrency are the defaults
+            client = GeminiClient(api_key="test", api_base=server.api_base)
+            started = time.monotonic()
+            parts = _map(client, prompts, PART_SCHEMA, True, SUMMARY_CONCURRENCY, Counter())
+            elapsed = time.monotonic() - started
+        self.assertEqual(server.stats["ok"], SUMMARY_CONCURRENCY)
+        self.assertTrue(all(part["summary"] for part in parts))
+        # one round trip for all the chunks, not one per chunk (or one per rate-limit token)
+        self.assertLess(elapsed, self.LATENCY * 2)
+
+    def test_burst_covers_concurrency(self):
+        client = GeminiClient(api_key="test")
+        self.assertGreaterEqual(client.bucket.capacity, SUMMARY_CONCURRENCY)
+
+    def test_failed_map_keeps_finished_parts(self):
+        prompts = [part_prompt(f"Chunk {i}.", i, 4) for i in range(1, 5)]
+        calls = []
+
+        def generate_json(prompt, schema):
+            calls.append(prompt)
+            if "Chunk 4." in prompt and failing:
+                time.sleep(0.1)
+                raise GeminiError("Gemini API error 500")
+            return GeminiResponse(data={"summary": prompt, "tags": []}, usage={})
+
+        client = SimpleNamespace(model="test-model", generate_json=generate_json)
+        failing = True
+        with self.assertRaises(GeminiError):
+            _map(client, prompts, PART_SCHEMA, False, 4, Counter())
+        self.assertEqual(LLMResponse.objects.count(), 3)
+
+        failing, calls[:] = False, []
+        usage = Counter()
+        parts = _map(client, prompts, PART_SCHEMA, False, 4, usage)
+        self.assertEqual([part["summary"] for part in parts], prompts)
+        self.assertEqual(calls, [prompts[3]])
+        self.assertEqual(usage["cached"], 3)
+
+
+class SubmitTests(TestCase):
+    """Runs collapse into the job in flight, but a job that lost its task message stops holding the run."""
+
+    def setUp(self):
+        uploader = User.objects.create(username="uploader")
+        self.paper = Paper.objects.create(uploader=uploader, title="A paper", pdf_file="papers/a.pdf")
+
+    def submit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            job, created = jobs.submit(generate_article_task, self.paper, ProcessingJob.ARTICLE, (self.paper.pk,))
+        return job, created, callbacks
+
+    def test_queued_job_collapses_submits(self):
+        first, created, callbacks = self.submit()
+        self.assertTrue(created)
+        self.assertEqual(len(callbacks), 1)
+        second, created, callbacks = self.submit()
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(callbacks, [])
+
+    def test_stale_queued_job_does_not_block(self):
+        lost, created, callbacks = self.submit()
+        ProcessingJob.objects.filter(pk=lost.pk).update(
+            created_at=timezone.now() - timedelta(seconds=jobs.PIPELINE_QUEUE_TIMEOUT + 60)
+        )
+        job, created, callbacks = self.submit()
+        self.assertTrue(created)
+        self.assertNotEqual(job.pk, lost.pk)
+        self.assertEqual(len(callbacks), 1)
+        lost.refresh_from_db()
+        self.assertEqual(lost.state, ProcessingJob.FAILED)
+
+    def test_stale_queued_job_does_not_block_bulk(self):
+        lost, created, callbacks = self.submit()
+        ProcessingJob.objects.filter(pk=lost.pk).update(
+            created_at=timezone.now() - timedelta(seconds=jobs.PIPELINE_QUEUE_TIMEOUT + 60)
+        )
+        job_ids = jobs.enqueue_many([self.paper.pk], ProcessingJob.ARTICLE)
+        self.assertIn(self.paper.pk, job_ids)
+        self.assertNotEqual(job_ids[self.paper.pk], lost.pk)
+
+
+class QueueRoutingTests(TestCase):
+    """Bulk work can't hold up interactive work: the lanes are separate queues, not just priorities."""
+
+    def test_lanes_have_their_own_queues(self):
+        for task in (generate_article_task, generate_thumbnails_task):
+            with self.subTest(task=task.name):
+                interactive, interactive_priority = queues.route(task)
+                bulk, bulk_priority = queues.route(task, bulk=True)
+                self.assertNotEqual(interactive, bulk)
+                self.assertLess(interactive_priority, bulk_priority)
+
+    def test_llm_and_cpu_work_are_apart(self):
+        self.assertNotEqual(queues.route(generate_article_task)[0], queues.route(generate_thumbnails_task)[0])
+
+
+class GeminiRetryTests(TestCase):
+    """Throttled and failed calls back off and retry without holding a concurrency slot."""
+
+    def test_retry_after_header_forms(self):
+        def retry_after(value):
+            return _retry_after_seconds(SimpleNamespace(headers={"Retry-After": value} if value else {}))
+
+        self.assertEqual(retry_after("3"), 3.0)
+        self.assertEqual(retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(retry_after("soon"))
+        self.assertIsNone(retry_after(None))
+
+    def test_malformed_retry_after_backs_off(self):
+        real_sleep = time.sleep
+        with MockGeminiServer(rate_limit=1, retry_after="soon") as server:
+            client = GeminiClient(api_key="test", api_base=server.api_base, rate_per_second=0, backoff_base=0.01)
+            client.generate_json("first", PART_SCHEMA)
+            # outlast the mock's one-second window whatever backoff was computed
+            with mock.patch("ai_processing.gemini.time.sleep", lambda seconds: real_sleep(1.05)):
+                client.generate_json("second", PART_SCHEMA)
+        self.assertEqual(server.stats["throttled"], 1)
+        self.assertEqual(server.stats["ok"], 2)
+
+    def test_network_retry_sleeps_without_a_slot(self):
+        client = GeminiClient(
+            api_key="test", api_base="http://127.0.0.1:9/v1beta", max_retries=1, max_concurrency=1,
+            rate_per_second=0, timeout=(0.5, 0.5),
+        )
+        slot_free = []
+
+        def sleep(seconds):
+            acquired = client._slots.acquire(blocking=False)
+            slot_free.append(acquired)
+            if acquired:
+                client._slots.release()
 
-# Create your tests here.
+        with mock.patch("ai_processing.gemini.time.sleep", sleep), self.assertRaises(GeminiError):
+            client.post({})
+        self.assertEqual(slot_free, [True])
@@ -1,6 +1,26 @@
+import hashlib
+import threading
+
 import markdown
 from django.utils.safestring import mark_safe
 
+MARKDOWN_EXTENSIONS = ["extra", "toc", "fenced_code", "tables"]
+
+# Bump when the extensions or their configuration change, so that stored HTML
+# (Paper.article_html) is treated as stale and rendered again.
+RENDERER_VERSION = "1"
+
+_local = threading.local()
+
+
+def _renderer():
+    """One Markdown instance per thread, reused between conversions."""
+    renderer = getattr(_local, "markdown", None)
+    if renderer is None:
+        renderer = _local.markdown = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return renderer
+
+
 def markdown_to_html(markdown_text: str) -> str:
     """
     Convert Markdown text to safe HTML for rendering in Django templates.
@@ -8,8 +28,15 @@ def markdown_to_html(markdown_text: str) -> str:
     if not markdown_text:
         return ""
     
-    html = markdown.markdown(
-        markdown_text,
-        extensions=["extra", "toc", "fenced_code", "tables"]
-    )
+    html = _renderer().reset().convert(markdown_text)
     return mark_safe(html)  # prevent auto-escaping in templates
+
+
+def markdown_fingerprint(markdown_text: str) -> str:
+    """
+    Identifies a rendering of markdown_text: changes when the text or the renderer changes.
+    """
+    digest = hashlib.sha256(RENDERER_VERSION.encode())
+    digest.update(b"\0")
+    digest.update((markdown_text or "").encode())
+    return digest.hexdigest()
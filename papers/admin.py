@@ -1,8 +1,10 @@
 from django.contrib import admin
-from .models import Author, Tag, Paper, Comment
+from .models import Author, Tag, Paper, Comment, Reference, UploadSession
 
 # Register your models here.
 admin.site.register(Author)
 admin.site.register(Tag)
 admin.site.register(Paper)
 admin.site.register(Comment)
+admin.site.register(Reference)
+admin.site.register(UploadSession)
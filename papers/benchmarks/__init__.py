@@ -0,0 +1,11 @@
+"""
+Performance benchmarks for the main pages and the article pipeline.
+
+corpus.py fills a database with a seeded synthetic corpus: users, papers with
+tiny generated PDFs, authors, tags, follows, bookmarks and threaded comments.
+scenarios.py drives the views through the test client, and the article task
+against the mock Gemini server. It records the wall time and the SQL query
+count of each. report.py writes the results as JSON and compares them with a
+baseline report. The run_benchmarks command runs the whole suite in a
+throwaway test database.
+"""
@@ -0,0 +1,150 @@
+"""
+A seeded synthetic corpus for the benchmarks.
+
+The same seed and sizes always produce the same users, titles, texts, tags,
+authors, follows, bookmarks and comment threads. Papers go through
+ingest.write_batch, like import_papers, so blobs, extracted text, thumbnails,
+the search index, timelines and every denormalized counter are in the state
+that real uploads leave them in.
+"""
+import os
+import random
+from functools import lru_cache
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from ai_processing.tasks import MAX_PROMPT_CHARS
+from profiles import counters
+from profiles.models import UserProfile
+from papers import bookmarks, feed
+from papers.ingest import prepare_pdf, write_batch
+from papers.models import Comment, Paper
+
+VOCABULARY = (
+    "adaptive attention bayesian benchmark causal citation cluster compression convex corpus dataset diffusion "
+    "embedding ensemble entropy estimation federated gradient graph heuristic inference kernel latent learning "
+    "lattice manifold markov memory metric model network neural optimal parallel posterior protein quantum "
+    "random ranking recurrent regression retrieval robust sampling scalable semantic sparse spectral stochastic "
+    "structure synthesis temporal tensor theory transfer transformer uncertainty variational vision"
+).split()
+FIRST_NAMES = "Ada Alan Barbara Claude Donald Edsger Frances Grace John Katherine Leslie Margaret Niklaus Radia Tim".split()
+LAST_NAMES = "Allen Backus Dijkstra Hamilton Hopper Johnson Knuth Lamport Liskov Lovelace Perlman Shannon Turing Wirth".split()
+
+
+def tiny_pdf(lines):
+    """A valid one-page PDF showing `lines` of text, a few hundred bytes long."""
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    text = " T* ".join(f"({escape(line)}) Tj" for line in lines)
+    stream = f"BT /F1 11 Tf 72 720 Td 14 TL {text} ET".encode("latin-1", "replace")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+@lru_cache(maxsize=None)
+def _zipf_cum_weights(n):
+    return list(accumulate(1 / rank for rank in range(1, n + 1)))
+
+
+def _zipf_choice(rng, items):
+    """Picks from `items` with weight 1/rank, so a few are popular and most are not."""
+    return rng.choices(items, cum_weights=_zipf_cum_weights(len(items)))[0]
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+
+def generate(workdir, users=50, papers=500, authors=200, tags=60, follows=10, bookmarks_per_user=20,
+             comments=1000, seed=0, batch_size=100):
+    """
+    Creates the corpus in the current database, writing the PDFs under `workdir`.
+    Returns a dict of handles for the scenarios (ids and names of representative rows).
+    """
+    rng = random.Random(seed)
+    cache.clear()
+
+    people = [User.objects.create(username=f"bench{index:04d}") for index in range(users)]
+    tag_names = [f"{word}-{index}" if index >= len(VOCABULARY) else word
+                 for index, word in enumerate(VOCABULARY * (tags // len(VOCABULARY) + 1))][:tags]
+    author_names = sorted({f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {index}" for index in range(authors)})
+
+    # papers, uploaded in batches per uploader
+    by_uploader = {}
+    for index in range(papers):
+        lines = [_sentence(rng) for _ in range(rng.randint(5, 30))]
+        path = os.path.join(workdir, f"paper-{index:06d}.pdf")
+        with open(path, "wb") as f:
+            f.write(tiny_pdf([f"Synthetic paper {index}"] + lines))
+        item = {
+            "path": path,
+            "title": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 9))).title(),
+            "publication_year": rng.randint(1990, 2025),
+            "authors": rng.sample(author_names, rng.randint(1, min(4, len(author_names)))),
+            "tags": list({_zipf_choice(rng, tag_names) for _ in range(rng.randint(1, 5))}),
+            "article_content": "\n\n".join(" ".join(_sentence(rng) for _ in range(4)) for _ in range(3)),
+        }
+        by_uploader.setdefault(_zipf_choice(rng, people), []).append(item)
+    for uploader, items in by_uploader.items():
+        for start in range(0, len(items), batch_size):
+            prepared = [prepare_pdf(item, MAX_PROMPT_CHARS) for item in items[start:start + batch_size]]
+            write_batch(prepared, uploader, generate_ai=False)
+
+    # follows, then the timelines and counters that follow() would have maintained
+    profile_ids = dict(UserProfile.objects.values_list("user_id", "id"))
+    UserProfile.following.through.objects.bulk_create([
+        UserProfile.following.through(userprofile_id=profile_ids[user.pk], user_id=followed.pk)
+        for user in people
+        for followed in rng.sample([other for other in people if other != user], min(follows, len(people) - 1))
+    ])
+
+    # bookmarks, weighted towards popular papers
+    paper_ids = list(Paper.objects.order_by("pk").values_list("pk", flat=True))
+    Paper.bookmarks.through.objects.bulk_create([
+        Paper.bookmarks.through(user_id=user.pk, paper_id=paper_id)
+        for user in people
+        for paper_id in {_zipf_choice(rng, paper_ids) for _ in range(bookmarks_per_user)}
+    ])
+    bookmarks.recount()
+    counters.recount()
+    for user in User.objects.select_related("profile"):
+        feed.rebuild(user)
+
+    # comment threads, concentrated on a few papers
+    threads = {}
+    for _ in range(comments):
+        paper_id = _zipf_choice(rng, paper_ids)
+        existing = threads.setdefault(paper_id, [])
+        candidates = [comment for comment in existing if comment.depth < Comment.MAX_DEPTH]
+        parent = rng.choice(candidates) if candidates and rng.random() < 0.5 else None
+        comment = Comment(paper_id=paper_id, user=rng.choice(people), content=_sentence(rng, 20), parent=parent)
+        comment.save()
+        existing.append(comment)
+
+    cache.clear()
+    return {
+        "viewer": people[0].username,
+        "busiest_uploader": max(by_uploader, key=lambda user: len(by_uploader[user])).username,
+        "hot_paper": max(threads, key=lambda paper_id: len(threads[paper_id])) if threads else paper_ids[0],
+        "paper_ids": paper_ids,
+        "tag": tag_names[0],
+        "search_term": VOCABULARY[len(VOCABULARY) // 2],
+    }
@@ -0,0 +1,70 @@
+"""
+Benchmark reports: JSON files holding the run's parameters and per-scenario
+results, and the comparison of a run against a baseline report.
+"""
+import json
+import platform
+import sys
+
+import django
+from django.db import connection
+from django.utils import timezone
+
+REPORT_VERSION = 1
+
+
+def build(results, parameters):
+    return {
+        "version": REPORT_VERSION,
+        "created_at": timezone.now().isoformat(),
+        "environment": {
+            "python": sys.version.split()[0],
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "machine": platform.machine(),
+        },
+        "parameters": parameters,
+        "results": results,
+    }
+
+
+def write(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    if report.get("version") != REPORT_VERSION:
+        raise ValueError(f"{path} is a version {report.get('version')} report; expected {REPORT_VERSION}.")
+    return report
+
+
+def compare(report, baseline, time_tolerance=0.25, min_time_delta_ms=2.0, query_tolerance=0):
+    """
+    Returns (rows, regressions). Each row compares one scenario with the baseline. A
+    scenario regresses when its median time exceeds the baseline's by more than
+    `time_tolerance` (a fraction) and by at least `min_time_delta_ms`, or when it runs
+    more than `query_tolerance` extra queries. Scenarios missing from either report
+    are listed but not judged.
+    """
+    rows, regressions = [], []
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        row = {"name": name, "result": result, "baseline": before, "problems": []}
+        if before is not None:
+            limit = before["median_ms"] * (1 + time_tolerance)
+            if result["median_ms"] > limit and result["median_ms"] - before["median_ms"] >= min_time_delta_ms:
+                row["problems"].append(
+                    f"median {result['median_ms']:.1f}ms vs {before['median_ms']:.1f}ms (limit {limit:.1f}ms)"
+                )
+            if result["queries"] > before["queries"] + query_tolerance:
+                row["problems"].append(f"{result['queries']} queries vs {before['queries']}")
+            if result["status"] != before["status"]:
+                row["problems"].append(f"status {result['status']} vs {before['status']}")
+        if row["problems"]:
+            regressions.append(row)
+        rows.append(row)
+    return rows, regressions
@@ -0,0 +1,128 @@
+"""
+The benchmarked operations and how they are measured.
+
+Each scenario is one request through the test client (logged in as the corpus'
+viewer), or one run of the article task. Each is run once to warm the caches.
+It is then run `repeat` times, recording the wall time of every run and the SQL
+queries of the last one. Views run with their query budgets enforced. Background
+tasks that views schedule are only queued, not run (the command points Celery at
+an in-memory broker), so the numbers are what the request itself costs.
+"""
+import statistics
+import time
+from collections import namedtuple
+from itertools import count
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from ai_processing import gemini
+from ai_processing.mock_gemini import MockGeminiServer
+from ai_processing.tasks import generate_article_task
+from .corpus import tiny_pdf
+from papers.profiling import QueryBudgetExceeded
+
+Scenario = namedtuple("Scenario", ["name", "run"])
+
+
+def build_scenarios(corpus, client=None):
+    """The list of Scenarios for a corpus returned by corpus.generate()."""
+    from django.contrib.auth.models import User
+
+    client = client or Client()
+    client.force_login(User.objects.get(username=corpus["viewer"]))
+    paper_list = reverse("papers:paper_list")
+    uploads = count()
+
+    def get(url, **params):
+        return lambda: client.get(url, params)
+
+    def toggle_bookmark():
+        return client.post(reverse("papers:toggle_bookmark", args=[corpus["paper_ids"][0]]))
+
+    def upload():
+        number = next(uploads)
+        pdf = tiny_pdf([f"Benchmark upload {number}", "A short synthetic paper used to time the upload view."])
+        return client.post(reverse("papers:upload_paper"), {
+            "title": f"Benchmark upload {number}", "publication_year": 2024, "article_choice": "manual",
+            "user_article": "Written by hand for the benchmark.", "new_authors": "Benchmark Author",
+            "pdf_file": SimpleUploadedFile(f"upload-{number}.pdf", pdf, content_type="application/pdf"),
+        })
+
+    def article_task():
+        # force skips the LLM response cache so every run reaches the (mock) API
+        return generate_article_task(corpus["hot_paper"], force=True)
+
+    return [
+        Scenario("paper_list.all", get(paper_list, tab="all")),
+        Scenario("paper_list.following", get(paper_list, tab="following")),
+        Scenario("paper_list.search", get(paper_list, q=corpus["search_term"])),
+        Scenario("paper_list.tag", get(paper_list, tag=corpus["tag"])),
+        Scenario("paper_detail", get(reverse("papers:paper_detail", args=[corpus["hot_paper"]]))),
+        Scenario("profile_view", get(reverse("profiles:profile_view", args=[corpus["busiest_uploader"]]))),
+        Scenario("toggle_bookmark", toggle_bookmark),
+        Scenario("upload_paper", upload),
+        Scenario("generate_article_task", article_task),
+    ]
+
+
+def _status(result):
+    """A response's status code, or "ok"/"failed" for a task's return message."""
+    if hasattr(result, "status_code"):
+        return result.status_code
+    return "failed" if str(result).startswith("Failed") else "ok"
+
+
+def _timing_summary(timings):
+    timings = sorted(timings)
+    if not timings:
+        return {"median_ms": 0.0, "p95_ms": 0.0, "min_ms": 0.0}
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "min_ms": round(timings[0], 3),
+    }
+
+
+def measure(scenario, repeat):
+    """
+    Warms up, then times `repeat` runs; returns the scenario's result dict (times in ms).
+    A view that exceeds its query budget, in the warm-up or any timed run, gets the status
+    "over_budget" with the timings of the runs before it.
+    """
+    timings = []
+    queries = None
+    try:
+        scenario.run()
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                result = scenario.run()
+                timings.append((time.perf_counter() - started) * 1000)
+    except QueryBudgetExceeded as e:
+        # e.g. a later run that misses a cache the earlier ones hit
+        return {**_timing_summary(timings), "queries": len(queries) if queries is not None else 0,
+                "status": "over_budget", "error": str(e), "runs": len(timings)}
+    return {**_timing_summary(timings), "queries": len(queries), "status": _status(result), "runs": repeat}
+
+
+def run(scenarios, repeat=5, only=None, llm_latency=0.0):
+    """Measures the scenarios (those named in `only`, if given); returns {name: result}."""
+    results = {}
+    with MockGeminiServer(latency=llm_latency) as server, override_settings(
+        GEMINI_API_BASE=server.api_base, GEMINI_API_KEY="benchmark", GEMINI_RATE_PER_SECOND=0,
+        QUERY_BUDGET_MODE="raise",
+    ):
+        # the shared client was configured from settings; make one for the mock server
+        gemini._client = None
+        try:
+            for scenario in scenarios:
+                if only and scenario.name not in only:
+                    continue
+                results[scenario.name] = measure(scenario, repeat)
+        finally:
+            gemini._client = None
+    return results
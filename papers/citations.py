@@ -0,0 +1,261 @@
+"""
+The citation graph.
+
+After a paper's text is extracted, its references section is parsed into
+Reference rows (one per entry, with a best-guess title). Each reference is
+resolved against the titles of the papers on CiteRight using MinHash/LSH keys
+of their character trigrams (see minhash.py). A paper's title is stored as
+TitleKey rows, so a lookup is one indexed `key IN (...)` query however large
+the corpus grows. The candidates it returns are confirmed by the exact Jaccard
+similarity of the trigram sets.
+
+References that match nothing keep their keys as ReferenceKey rows. When a
+paper is uploaded later, its title keys are looked up there, so the references
+that were waiting for it are linked without rescanning anyone's reference list.
+
+Paper.citation_count ("cited by") is adjusted with F() updates whenever a
+reference is linked or unlinked, so pages never count the citation table.
+"""
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+from . import minhash
+from .models import Paper, Reference, ReferenceKey, TitleKey
+
+# Titles must be at least this similar (Jaccard over character trigrams) to link.
+CITATION_MATCH_THRESHOLD = getattr(settings, "CITATION_MATCH_THRESHOLD", 0.6)
+# Shorter (normalised) titles are too generic to resolve ("Introduction", "Notes").
+CITATION_MIN_TITLE_CHARS = getattr(settings, "CITATION_MIN_TITLE_CHARS", 12)
+MAX_REFERENCES = 300
+# "Cited by" papers shown on the detail page.
+CITED_BY_LIMIT = 20
+
+_HEADING = re.compile(
+    r"^[ \t]*(?:\d{1,2}\.?[ \t]*)?(references|bibliography|works cited|literature cited|cited works)[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_SECTION_END = re.compile(r"^[ \t]*(?:appendix|appendices|supplementary material)\b", re.IGNORECASE | re.MULTILINE)
+_NUMBERED = re.compile(r"^[ \t]*(?:\[\d{1,3}\]|\(\d{1,3}\)|\d{1,3}\.)[ \t]+", re.MULTILINE)
+# "Surname, A." or "Surname, Firstname" at the start of a line begins an unnumbered entry
+_AUTHOR_START = re.compile(r"^[A-Z][\w'’-]+(?: [A-Z][\w'’-]+)?,[ \t]+[A-Z]")
+_QUOTED = re.compile(r"[“\"]([^”\"]{10,300})[”\"]")
+# sentence breaks, but not after initials ("A. Smith")
+_SENTENCE = re.compile(r"(?<!\b[A-Z])\.\s+")
+_YEAR = re.compile(r"^\(?\d{4}[a-z]?\)?[.,:]?$")
+
+
+def references_section(pages):
+    """The text after the last "References" heading, up to an appendix if there is one."""
+    text = "\n".join(pages)
+    headings = list(_HEADING.finditer(text))
+    if not headings:
+        return ""
+    section = text[headings[-1].end():]
+    end = _SECTION_END.search(section)
+    return section[:end.start()] if end else section
+
+
+def split_entries(section):
+    """Splits a references section into entries, one line of text each."""
+    section = re.sub(r"-\n(?=[a-z])", "", section)  # words hyphenated across lines
+    markers = list(_NUMBERED.finditer(section))
+    if len(markers) >= 2:
+        bounds = [marker.start() for marker in markers[1:]] + [len(section)]
+        entries = [section[marker.end():end] for marker, end in zip(markers, bounds)]
+    else:
+        entries, current = [], []
+        for line in section.splitlines():
+            if (not line.strip() or _AUTHOR_START.match(line)) and current:
+                entries.append(" ".join(current))
+                current = []
+            if line.strip():
+                current.append(line)
+        entries.append(" ".join(current))
+    entries = [" ".join(entry.split()) for entry in entries]
+    return [entry for entry in entries if len(entry) >= 20][:MAX_REFERENCES]
+
+
+def reference_title(entry):
+    """
+    A best guess at the cited title: a quoted title if there is one, otherwise the
+    first sentence after the authors (skipping a bare year).
+    """
+    quoted = _QUOTED.search(entry)
+    if quoted:
+        return quoted.group(1).strip(" ,.")[:300]
+    sentences = [sentence.strip() for sentence in _SENTENCE.split(entry) if sentence.strip()]
+    for sentence in sentences[1:]:
+        if not _YEAR.match(sentence) and len(sentence.split()) >= 2:
+            return sentence.strip(" ,.")[:300]
+    return sentences[0][:300] if sentences else ""
+
+
+def parse_references(pages):
+    """[(entry text, title), ...] for the references section of a document's pages."""
+    return [(entry, reference_title(entry)) for entry in split_entries(references_section(pages))]
+
+
+def _resolvable(grams):
+    return len(grams) >= CITATION_MIN_TITLE_CHARS
+
+
+def _adjust(counts, sign):
+    """Adds sign * n to the citation_count of each {paper_id: n}, one update per distinct n."""
+    by_amount = {}
+    for paper_id, n in counts.items():
+        by_amount.setdefault(n, []).append(paper_id)
+    for n, paper_ids in by_amount.items():
+        Paper.objects.filter(pk__in=paper_ids).update(citation_count=F("citation_count") + sign * n)
+
+
+def _match(titles, exclude_paper_id):
+    """
+    For each {index: (grams, keys)}, the best matching (paper_id, score) or None.
+    All candidates come from one TitleKey query.
+    """
+    keys = {key for grams, key_list in titles.values() for key in key_list}
+    if not keys:
+        return {}
+    candidates = {}
+    for paper_id, key in TitleKey.objects.filter(key__in=keys).exclude(paper_id=exclude_paper_id).values_list(
+        "paper_id", "key"
+    ):
+        candidates.setdefault(key, set()).add(paper_id)
+    paper_ids = set().union(*candidates.values()) if candidates else set()
+    paper_grams = {
+        paper_id: minhash.ngrams(title)
+        for paper_id, title in Paper.objects.filter(pk__in=paper_ids).values_list("pk", "title")
+    }
+
+    matches = {}
+    for index, (grams, key_list) in titles.items():
+        best = None
+        for paper_id in set().union(*(candidates.get(key, ()) for key in key_list)):
+            score = minhash.jaccard(grams, paper_grams.get(paper_id))
+            # the earliest upload wins ties (later ones are usually duplicates)
+            if score >= CITATION_MATCH_THRESHOLD and (best is None or (score, -paper_id) > (best[1], -best[0])):
+                best = (paper_id, score)
+        matches[index] = best
+    return matches
+
+
+def store_references(paper, pages):
+    """
+    Replaces a paper's references with those parsed from its pages and links each to
+    the paper it cites, if that is on CiteRight. Returns (references, resolved).
+    """
+    parsed = parse_references(pages)
+    titles = {}
+    for index, (entry, title) in enumerate(parsed):
+        grams, keys = minhash.text_keys(title)
+        if _resolvable(grams):
+            titles[index] = (grams, keys)
+    matches = _match(titles, paper.pk)
+
+    with transaction.atomic():
+        _unlink_references(paper)
+        references = Reference.objects.bulk_create([
+            Reference(
+                paper=paper, position=index, text=entry[:2000], title=title,
+                cited_id=matches[index][0] if matches.get(index) else None,
+                score=round(matches[index][1], 4) if matches.get(index) else 0,
+            )
+            for index, (entry, title) in enumerate(parsed)
+        ])
+        ReferenceKey.objects.bulk_create([
+            ReferenceKey(reference=reference, key=key)
+            for reference in references if reference.cited_id is None and reference.position in titles
+            for key in titles[reference.position][1]
+        ])
+        _adjust(Counter(reference.cited_id for reference in references if reference.cited_id), 1)
+    return len(references), sum(1 for reference in references if reference.cited_id)
+
+
+def _unlink_references(paper):
+    """Deletes a paper's references, taking them out of the counts of the papers they cite."""
+    counts = dict(
+        Reference.objects.filter(paper=paper, cited__isnull=False)
+        .values("cited").annotate(n=Count("pk")).values_list("cited", "n")
+    )
+    _adjust(counts, -1)
+    Reference.objects.filter(paper=paper).delete()
+
+
+def index_titles(papers):
+    """
+    Stores the title keys of new papers and links the dangling references that
+    match them. Returns the number of references linked.
+    """
+    keys_by_paper = {paper.pk: minhash.text_keys(paper.title) for paper in papers}
+    TitleKey.objects.filter(paper__in=keys_by_paper).delete()
+    TitleKey.objects.bulk_create([
+        TitleKey(paper_id=paper_id, key=key)
+        for paper_id, (grams, keys) in keys_by_paper.items() if _resolvable(grams)
+        for key in keys
+    ])
+
+    waiting = {}
+    for reference_id, key in ReferenceKey.objects.filter(
+        key__in={key for grams, keys in keys_by_paper.values() for key in keys}
+    ).values_list("reference_id", "key"):
+        waiting.setdefault(reference_id, set()).add(key)
+    if not waiting:
+        return 0
+
+    linked = 0
+    with transaction.atomic():
+        references = Reference.objects.select_for_update().filter(pk__in=waiting, cited__isnull=True)
+        changed = []
+        for reference in references:
+            grams = minhash.ngrams(reference.title)
+            best = None
+            for paper_id, (title_grams, keys) in keys_by_paper.items():
+                if paper_id == reference.paper_id or not waiting[reference.pk] & set(keys):
+                    continue
+                score = minhash.jaccard(grams, title_grams)
+                if score >= CITATION_MATCH_THRESHOLD and (best is None or score > best[1]):
+                    best = (paper_id, score)
+            if best:
+                reference.cited_id, reference.score = best[0], round(best[1], 4)
+                changed.append(reference)
+        Reference.objects.bulk_update(changed, ["cited", "score"])
+        ReferenceKey.objects.filter(reference__in=changed).delete()
+        _adjust(Counter(reference.cited_id for reference in changed), 1)
+        linked = len(changed)
+    return linked
+
+
+def release_paper(paper):
+    """
+    For a paper about to be deleted: takes its references out of the counts of the
+    papers they cite, and turns the references that cite it back into dangling ones.
+    """
+    _unlink_references(paper)
+    citing = list(Reference.objects.filter(cited=paper).only("pk", "title"))
+    ReferenceKey.objects.bulk_create([
+        ReferenceKey(reference=reference, key=key)
+        for reference in citing
+        for key in minhash.text_keys(reference.title)[1]
+    ])
+
+
+def schedule_index_title(paper_id):
+    """Indexes a new paper's title and links the references waiting for it, in the background."""
+    from .tasks import index_title_task
+    transaction.on_commit(lambda: index_title_task.delay(paper_id))
+
+
+def paper_citations(paper, limit=CITED_BY_LIMIT):
+    """(references, citing papers) for the detail page, read from the stored graph."""
+    references = list(Reference.objects.filter(paper=paper).select_related("cited").only(
+        "position", "text", "title", "cited__id", "cited__title",
+    ))
+    citing = list(
+        Paper.objects.filter(references__cited=paper).distinct()
+        .only("id", "title", "publication_year").order_by("-citation_count", "-id")[:limit]
+    ) if paper.citation_count else []
+    return references, citing
@@ -0,0 +1,60 @@
+"""
+Comment threads for paper_detail.
+
+Top-level comments are paginated newest first with the same keyset cursor as
+paper listings. The replies under a page of threads come from one query on the
+materialized path (every descendant's path starts with its root's), with the
+authors joined in, and are assembled into trees in Python.
+"""
+from functools import reduce
+from operator import or_
+
+from django.apps import apps
+from django.db.models import Q
+
+from .models import Comment
+from .pagination import Page, paginate
+
+COMMENTS_PAGE_SIZE = 20
+
+COMMENT_FRAGMENT_TEMPLATE = "papers/partials/_comment.html"
+COMMENT_PAGE_TEMPLATE = "papers/partials/_comment_page.html"
+
+
+def with_authors(queryset):
+    """Loads each comment's user (and, with allauth, their avatar) alongside it."""
+    queryset = queryset.select_related("user")
+    if apps.is_installed("allauth.socialaccount"):
+        queryset = queryset.prefetch_related("user__socialaccount_set")
+    return queryset
+
+
+def subtree_filter(roots):
+    return reduce(or_, (Q(path__startswith=root.path) for root in roots))
+
+
+def build_threads(roots, descendants):
+    """Attaches `children` lists to every comment; descendants must be ordered by path."""
+    by_id = {comment.pk: comment for comment in roots}
+    for comment in by_id.values():
+        comment.children = []
+    for comment in descendants:
+        comment.children = []
+        by_id[comment.pk] = comment
+        parent = by_id.get(comment.parent_id)
+        if parent is not None:
+            parent.children.append(comment)
+    return roots
+
+
+def thread_page(request, paper):
+    """A Page of top-level comments (newest first), each with its full reply tree."""
+    top_level = with_authors(Comment.objects.filter(paper=paper, parent__isnull=True))
+    page = paginate(request, top_level, COMMENTS_PAGE_SIZE, field="created_at")
+    if not page.items:
+        return page
+    descendants = with_authors(
+        Comment.objects.filter(paper=paper, depth__gt=0).filter(subtree_filter(page.items)).order_by("path")
+    )
+    return Page(build_threads(page.items, descendants), page.next_url)
+
@@ -0,0 +1,176 @@
+"""
+Near-duplicate papers: the same text re-exported, watermarked or slightly revised.
+
+Byte hashing (storage.py) only catches identical files. Here a paper's extracted
+text is cut into word shingles, and their MinHash signature is stored in
+TextSignature, with its LSH band keys in TextKey (see minhash.py). A new paper's
+candidates are the papers sharing at least one key, found with one indexed
+query, and they are confirmed by comparing signatures. A paper whose similarity
+to an earlier one reaches DUPLICATE_THRESHOLD is marked a duplicate of it
+(of the earliest paper of the group). The article task then reuses that paper's
+AI article and tags instead of calling Gemini again, and the detail page tells
+the uploader.
+
+The cluster_duplicates command signs the papers that have no signature yet and
+regroups the whole corpus.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from ai_processing.models import ExtractedText
+from . import minhash
+from .models import Paper, TextKey, TextSignature
+
+# Estimated Jaccard similarity of two texts' shingles at which they count as the same paper.
+DUPLICATE_THRESHOLD = getattr(settings, "DUPLICATE_THRESHOLD", 0.8)
+# Characters of extracted text that are signed; the start of a paper is enough to tell.
+DUPLICATE_TEXT_CHARS = getattr(settings, "DUPLICATE_TEXT_CHARS", 50000)
+# Texts with fewer shingles (scans without a text layer, stubs) aren't compared.
+DUPLICATE_MIN_SHINGLES = 50
+
+
+def sign(text):
+    """The MinHash signature (a uint64 array) of a text, or None if it is too short to compare."""
+    shingles = minhash.shingles(text[:DUPLICATE_TEXT_CHARS])
+    if len(shingles) < DUPLICATE_MIN_SHINGLES:
+        return None
+    return minhash.signature(shingles)
+
+
+def _array(values):
+    return np.asarray(values, dtype=np.uint64)
+
+
+def candidates(sig, exclude_paper_id=None):
+    """[(paper_id, similarity), ...] of the papers at or above DUPLICATE_THRESHOLD, most similar first."""
+    keys = minhash.band_keys(sig)
+    paper_ids = set(TextKey.objects.filter(key__in=keys).values_list("paper_id", flat=True))
+    paper_ids.discard(exclude_paper_id)
+    matches = []
+    for paper_id, other in TextSignature.objects.filter(paper_id__in=paper_ids).values_list("paper_id", "minhash"):
+        score = minhash.similarity(sig, _array(other))
+        if score >= DUPLICATE_THRESHOLD:
+            matches.append((paper_id, score))
+    matches.sort(key=lambda match: (-match[1], match[0]))
+    return matches
+
+
+def _store(paper_id, sig, duplicate_of=None, similarity=0.0):
+    TextSignature.objects.update_or_create(paper_id=paper_id, defaults={
+        "minhash": [int(value) for value in sig], "duplicate_of_id": duplicate_of, "similarity": round(similarity, 4),
+    })
+    TextKey.objects.filter(paper_id=paper_id).delete()
+    TextKey.objects.bulk_create([TextKey(paper_id=paper_id, key=key) for key in minhash.band_keys(sig)])
+
+
+def register(paper, text):
+    """
+    Signs a paper's text and marks it a duplicate of the earliest matching paper
+    (following that paper to the original of its own group). Returns the id of
+    that original, or None.
+    """
+    sig = sign(text)
+    if sig is None:
+        TextSignature.objects.filter(paper_id=paper.pk).delete()
+        TextKey.objects.filter(paper_id=paper.pk).delete()
+        return None
+    matches = [(paper_id, score) for paper_id, score in candidates(sig, paper.pk) if paper_id < paper.pk]
+    original, similarity = None, 0.0
+    if matches:
+        paper_id, similarity = min(matches, key=lambda match: match[0])
+        root = TextSignature.objects.filter(paper_id=paper_id).values_list("duplicate_of", flat=True).first()
+        original = root or paper_id
+    with transaction.atomic():
+        _store(paper.pk, sig, original, similarity)
+    return original
+
+
+def reusable_article(paper_id):
+    """(article, tag names) generated for a paper's PDF, or None if it has no AI article to share."""
+    paper = Paper.objects.select_related("blob").filter(pk=paper_id).only(
+        "id", "blob__ai_article", "blob__ai_tags"
+    ).first()
+    if paper is None or not paper.blob_id or not paper.blob.ai_article:
+        return None
+    return paper.blob.ai_article, list(paper.blob.ai_tags)
+
+
+def original_of(paper):
+    """(original paper, similarity) if `paper` is a near-duplicate of another, else None."""
+    row = TextSignature.objects.filter(paper=paper, duplicate_of__isnull=False).select_related(
+        "duplicate_of"
+    ).only("similarity", "duplicate_of__id", "duplicate_of__title").first()
+    return (row.duplicate_of, row.similarity) if row else None
+
+
+def sign_missing(chunk_size=500):
+    """Signs the papers that have extracted text but no signature yet. Returns how many were signed."""
+    papers = Paper.objects.filter(text_signature__isnull=True, blob__isnull=False).values_list(
+        "pk", "blob__content_hash"
+    ).order_by("pk")
+    signed = 0
+    chunk = list(papers[:chunk_size])
+    while chunk:
+        texts = {text.content_hash: text for text in ExtractedText.objects.filter(
+            content_hash__in={digest for paper_id, digest in chunk}
+        )}
+        with transaction.atomic():
+            for paper_id, digest in chunk:
+                sig = sign(texts[digest].text(DUPLICATE_TEXT_CHARS)) if digest in texts else None
+                if sig is not None:
+                    _store(paper_id, sig)
+                    signed += 1
+        chunk = list(papers.filter(pk__gt=chunk[-1][0])[:chunk_size])
+    return signed
+
+
+def cluster():
+    """
+    Groups every signed paper with the papers it shares an LSH bucket with and is
+    similar enough to, and marks each group's later papers as duplicates of its
+    earliest. Returns {original id: [duplicate ids]}.
+    """
+    signatures = {
+        paper_id: _array(values)
+        for paper_id, values in TextSignature.objects.values_list("paper_id", "minhash").iterator(chunk_size=5000)
+    }
+    parent = {paper_id: paper_id for paper_id in signatures}
+
+    def find(paper_id):
+        while parent[paper_id] != paper_id:
+            parent[paper_id] = parent[parent[paper_id]]
+            paper_id = parent[paper_id]
+        return paper_id
+
+    buckets = {}
+    for paper_id, key in TextKey.objects.values_list("paper_id", "key").iterator(chunk_size=5000):
+        buckets.setdefault(key, []).append(paper_id)
+    for members in buckets.values():
+        members = sorted(m for m in members if m in signatures)
+        if len(members) < 2:
+            continue
+        matrix = np.stack([signatures[m] for m in members])
+        for i, paper_id in enumerate(members[:-1]):
+            scores = (matrix[i + 1:] == matrix[i]).mean(axis=1)
+            for j in np.nonzero(scores >= DUPLICATE_THRESHOLD)[0]:
+                a, b = find(paper_id), find(members[i + 1 + j])
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+
+    groups = {}
+    for paper_id in signatures:
+        root = find(paper_id)
+        if root != paper_id:
+            groups.setdefault(root, []).append(paper_id)
+
+    changed = []
+    for row in TextSignature.objects.only("paper", "duplicate_of", "similarity").iterator(chunk_size=5000):
+        root = find(row.paper_id)
+        original = root if root != row.paper_id else None
+        similarity = round(minhash.similarity(signatures[row.paper_id], signatures[root]), 4) if original else 0
+        if (row.duplicate_of_id, row.similarity) != (original, similarity):
+            row.duplicate_of_id, row.similarity = original, similarity
+            changed.append(row)
+    TextSignature.objects.bulk_update(changed, ["duplicate_of", "similarity"], batch_size=1000)
+    return groups
@@ -0,0 +1,346 @@
+"""
+Materialized "following" timelines.
+
+When a paper is uploaded it is pushed (fanned out) to the timeline of every
+follower, so reading the following tab is a range scan over the reader's own
+timeline instead of a join over everyone they follow. Following a user backfills
+their recent papers, unfollowing removes them, and timelines are capped at
+FEED_MAX_LENGTH entries. Every fan-out trims the timelines it pushed past the
+cap; the database backend keeps each timeline's length on its owner's
+UserProfile (feed_length) so it can find those without counting entries, and
+trim_feeds_task recounts the lengths and catches anything left over.
+
+Uploaders with more than FEED_FANOUT_LIMIT followers are not fanned out; their
+papers are merged in when a follower reads the timeline (hybrid push/pull).
+
+The store is pluggable through settings.FEED_BACKEND. DatabaseFeedBackend
+(FeedEntry rows) is the default; InMemoryFeedBackend keeps timelines in the
+process, for tests and local development.
+"""
+import bisect
+import heapq
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils.module_loading import import_string
+
+from profiles.models import UserProfile
+from .models import FeedEntry, Paper
+from .pagination import Page, decode_cursor, encode_cursor, page_url, paper_cards
+
+FEED_MAX_LENGTH = getattr(settings, "FEED_MAX_LENGTH", 1000)
+FEED_FANOUT_LIMIT = getattr(settings, "FEED_FANOUT_LIMIT", 5000)
+# How many of a user's most recent papers are copied into a new follower's timeline.
+FEED_BACKFILL_LENGTH = getattr(settings, "FEED_BACKFILL_LENGTH", 200)
+# Timelines counted and trimmed per query.
+FEED_TRIM_BATCH = 500
+
+HIGH_FANOUT_CACHE_KEY = "papers:feed:high_fanout_user_ids"
+
+Follow = UserProfile.following.through
+
+
+class DatabaseFeedBackend:
+    """
+    Timelines stored as FeedEntry rows, with each timeline's length in UserProfile.feed_length.
+    Entries that go with a deleted paper aren't subtracted until recount() (trim_feeds_task),
+    so a length can run high, which only makes the next fan-out trim one entry early.
+    """
+
+    def add(self, user_ids, paper):
+        user_ids = list(user_ids)
+        FeedEntry.objects.bulk_create([
+            FeedEntry(user_id=user_id, paper_id=paper.pk, uploader_id=paper.uploader_id, uploaded_at=paper.uploaded_at)
+            for user_id in user_ids
+        ], batch_size=1000, ignore_conflicts=True)
+        for start in range(0, len(user_ids), FEED_TRIM_BATCH):
+            batch = user_ids[start:start + FEED_TRIM_BATCH]
+            UserProfile.objects.filter(user_id__in=batch).update(feed_length=F("feed_length") + 1)
+            self._trim_overflow(batch, FEED_MAX_LENGTH)
+
+    def _trim_overflow(self, user_ids, max_length):
+        """
+        Trims the timelines among `user_ids` that went past max_length. One past it (a
+        full timeline that just got a paper) loses its oldest entry, found with an index
+        seek per timeline; anything further over is trimmed in full.
+        """
+        oldest = FeedEntry.objects.filter(user_id=OuterRef("user_id")).order_by("uploaded_at", "paper_id")
+        over = (
+            UserProfile.objects.filter(user_id__in=user_ids, feed_length__gt=max_length)
+            .annotate(oldest_id=Subquery(oldest.values("pk")[:1]))
+            .values_list("user_id", "feed_length", "oldest_id")
+        )
+        one_over, far_over = {}, []
+        for user_id, length, oldest_id in over:
+            if length == max_length + 1 and oldest_id is not None:
+                one_over[user_id] = oldest_id
+            else:
+                far_over.append(user_id)
+        if one_over:
+            FeedEntry.objects.filter(pk__in=one_over.values()).delete()
+            UserProfile.objects.filter(user_id__in=one_over).update(feed_length=max_length)
+        for user_id in far_over:
+            self.trim(user_id, max_length)
+
+    def backfill(self, user_id, papers):
+        self.add_many(user_id, papers)
+        self.trim(user_id)
+
+    def add_many(self, user_id, papers):
+        FeedEntry.objects.bulk_create([
+            FeedEntry(user_id=user_id, paper_id=paper.pk, uploader_id=paper.uploader_id, uploaded_at=paper.uploaded_at)
+            for paper in papers
+        ], batch_size=1000, ignore_conflicts=True)
+
+    def remove_uploader(self, user_id, uploader_id):
+        FeedEntry.objects.filter(user_id=user_id, uploader_id=uploader_id).delete()
+        self.recount([user_id])
+
+    def remove_paper(self, paper_id):
+        # FeedEntry rows cascade with the paper; recount() catches the lengths up
+        pass
+
+    def recount(self, user_ids=None):
+        """Recomputes feed_length from the FeedEntry rows, for the given users or all of them."""
+        profiles = UserProfile.objects.all() if user_ids is None else UserProfile.objects.filter(user_id__in=user_ids)
+        entries = FeedEntry.objects.filter(user_id=OuterRef("user_id")).order_by().values("user_id")
+        profiles.update(feed_length=Coalesce(Subquery(entries.annotate(n=Count("pk")).values("n")), 0))
+
+    def trim(self, user_id, max_length=FEED_MAX_LENGTH):
+        """Drops everything older than the user's max_length newest entries."""
+        boundary = (
+            FeedEntry.objects.filter(user_id=user_id)
+            .order_by("-uploaded_at", "-paper_id")
+            .values_list("uploaded_at", "paper_id")[max_length:max_length + 1]
+            .first()
+        )
+        if boundary is not None:
+            uploaded_at, paper_id = boundary
+            FeedEntry.objects.filter(user_id=user_id).filter(
+                Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, paper_id__lte=paper_id)
+            ).delete()
+        self.recount([user_id])
+
+    def trim_many(self, user_ids, max_length=FEED_MAX_LENGTH):
+        """
+        Trims several timelines with one ranking query (and delete) per FEED_TRIM_BATCH users.
+        The ranking reads the timelines whole, so this is for trim_feeds_task, not for fan-outs.
+        """
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), FEED_TRIM_BATCH):
+            batch = user_ids[start:start + FEED_TRIM_BATCH]
+            overflow = list(
+                FeedEntry.objects.filter(user_id__in=batch)
+                .annotate(position=Window(
+                    RowNumber(), partition_by=F("user_id"), order_by=[F("uploaded_at").desc(), F("paper_id").desc()],
+                ))
+                .filter(position__gt=max_length)
+                .values_list("pk", flat=True)
+            )
+            for chunk in range(0, len(overflow), FEED_TRIM_BATCH):
+                FeedEntry.objects.filter(pk__in=overflow[chunk:chunk + FEED_TRIM_BATCH]).delete()
+            self.recount(batch)
+
+    def users_over_limit(self, max_length=FEED_MAX_LENGTH):
+        return list(
+            FeedEntry.objects.values("user_id").annotate(n=Count("id")).filter(n__gt=max_length)
+            .values_list("user_id", flat=True)
+        )
+
+    def page(self, user_id, position, limit):
+        """Up to `limit` (uploaded_at, paper_id) pairs, newest first, after `position`."""
+        entries = FeedEntry.objects.filter(user_id=user_id)
+        if position is not None:
+            uploaded_at, paper_id = position
+            entries = entries.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, paper_id__lt=paper_id))
+        return list(entries.order_by("-uploaded_at", "-paper_id").values_list("uploaded_at", "paper_id")[:limit])
+
+    def clear(self):
+        FeedEntry.objects.all().delete()
+        UserProfile.objects.update(feed_length=0)
+
+
+class InMemoryFeedBackend:
+    """Timelines kept in this process, sorted newest first. For tests and local development."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user_id -> sorted list of ((-timestamp, -paper_id), paper_id, uploader_id, uploaded_at)
+        self._timelines = defaultdict(list)
+
+    @staticmethod
+    def _key(uploaded_at, paper_id):
+        return (-uploaded_at.timestamp(), -paper_id)
+
+    def _insert(self, user_id, paper):
+        timeline = self._timelines[user_id]
+        entry = (self._key(paper.uploaded_at, paper.pk), paper.pk, paper.uploader_id, paper.uploaded_at)
+        index = bisect.bisect_left(timeline, entry)
+        if index == len(timeline) or timeline[index][1] != paper.pk:
+            timeline.insert(index, entry)
+
+    def add(self, user_ids, paper):
+        user_ids = list(user_ids)
+        with self._lock:
+            for user_id in user_ids:
+                self._insert(user_id, paper)
+        self.trim_many(user_ids, FEED_MAX_LENGTH)
+
+    def backfill(self, user_id, papers):
+        self.add_many(user_id, papers)
+        self.trim(user_id)
+
+    def add_many(self, user_id, papers):
+        with self._lock:
+            for paper in papers:
+                self._insert(user_id, paper)
+
+    def remove_uploader(self, user_id, uploader_id):
+        with self._lock:
+            self._timelines[user_id] = [e for e in self._timelines[user_id] if e[2] != uploader_id]
+
+    def remove_paper(self, paper_id):
+        with self._lock:
+            for user_id, timeline in self._timelines.items():
+                self._timelines[user_id] = [e for e in timeline if e[1] != paper_id]
+
+    def recount(self, user_ids=None):
+        # a timeline's length is len() of its list
+        pass
+
+    def trim(self, user_id, max_length=FEED_MAX_LENGTH):
+        self.trim_many([user_id], max_length)
+
+    def trim_many(self, user_ids, max_length=FEED_MAX_LENGTH):
+        with self._lock:
+            for user_id in user_ids:
+                del self._timelines[user_id][max_length:]
+
+    def users_over_limit(self, max_length=FEED_MAX_LENGTH):
+        with self._lock:
+            return [user_id for user_id, timeline in self._timelines.items() if len(timeline) > max_length]
+
+    def page(self, user_id, position, limit):
+        with self._lock:
+            timeline = self._timelines.get(user_id, [])
+            start = 0
+            if position is not None:
+                start = bisect.bisect_right(timeline, (self._key(*position), float("inf")))
+            return [(e[3], e[1]) for e in timeline[start:start + limit]]
+
+    def clear(self):
+        with self._lock:
+            self._timelines.clear()
+
+
+_backend = None
+
+
+def get_backend():
+    """The configured feed backend (one instance per process)."""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "FEED_BACKEND", "papers.feed.DatabaseFeedBackend")
+        _backend = import_string(path)()
+    return _backend
+
+
+def follower_ids(user_id):
+    return Follow.objects.filter(user_id=user_id).values_list("userprofile__user_id", flat=True)
+
+
+def high_fanout_user_ids():
+    """Ids of users with more than FEED_FANOUT_LIMIT followers (cached)."""
+    ids = cache.get(HIGH_FANOUT_CACHE_KEY)
+    if ids is None:
+        ids = set(UserProfile.objects.filter(follower_count__gt=FEED_FANOUT_LIMIT).values_list("user_id", flat=True))
+        cache.set(HIGH_FANOUT_CACHE_KEY, ids, None)
+    return ids
+
+
+def is_high_fanout(user_id):
+    """True if pushing to this user's followers is too expensive; the answer is remembered."""
+    if user_id in high_fanout_user_ids():
+        return True
+    if UserProfile.objects.filter(user_id=user_id, follower_count__gt=FEED_FANOUT_LIMIT).exists():
+        cache.set(HIGH_FANOUT_CACHE_KEY, high_fanout_user_ids() | {user_id}, None)
+        return True
+    return False
+
+
+def fan_out(paper):
+    """Pushes a new paper to its uploader's followers, unless they have too many."""
+    if is_high_fanout(paper.uploader_id):
+        return 0
+    ids = list(follower_ids(paper.uploader_id))
+    get_backend().add(ids, paper)
+    return len(ids)
+
+
+def schedule_fan_out(paper):
+    """Fans a paper out in the background once it is committed."""
+    from .tasks import fan_out_paper_task
+    transaction.on_commit(lambda: fan_out_paper_task.delay(paper.pk))
+
+
+def follow(user, followed_user):
+    """Backfills a new follower's timeline with the followed user's recent papers."""
+    if is_high_fanout(followed_user.pk):
+        return
+    papers = Paper.objects.filter(uploader=followed_user).order_by("-uploaded_at", "-id").only(
+        "id", "uploader_id", "uploaded_at"
+    )[:FEED_BACKFILL_LENGTH]
+    get_backend().backfill(user.pk, papers)
+
+
+def unfollow(user, unfollowed_user):
+    get_backend().remove_uploader(user.pk, unfollowed_user.pk)
+
+
+def rebuild(user):
+    """Rebuilds one user's timeline from who they follow."""
+    backend = get_backend()
+    high_fanout = high_fanout_user_ids()
+    for followed_id in user.profile.following.values_list("id", flat=True):
+        backend.remove_uploader(user.pk, followed_id)
+        if followed_id not in high_fanout:
+            papers = Paper.objects.filter(uploader_id=followed_id).order_by("-uploaded_at", "-id").only(
+                "id", "uploader_id", "uploaded_at"
+            )[:FEED_BACKFILL_LENGTH]
+            backend.add_many(user.pk, papers)
+    backend.trim(user.pk)
+
+
+def following_page(request, per_page):
+    """
+    The current user's following timeline as a Page of paper cards: the materialized
+    entries merged with recent papers of followed high-fan-out uploaders.
+    """
+    position = decode_cursor(request.GET.get("cursor"))
+    entries = get_backend().page(request.user.pk, position, per_page + 1)
+
+    pulled_ids = high_fanout_user_ids() & set(request.user.profile.following.values_list("id", flat=True))
+    if pulled_ids:
+        pulled = Paper.objects.filter(uploader_id__in=pulled_ids)
+        if position is not None:
+            uploaded_at, pk = position
+            pulled = pulled.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=pk))
+        pulled = pulled.order_by("-uploaded_at", "-id").values_list("uploaded_at", "id")[:per_page + 1]
+        # an uploader may have entries from before they crossed the limit; drop the doubles
+        merged = []
+        for entry in heapq.merge(entries, pulled, reverse=True):
+            if not merged or merged[-1] != entry:
+                merged.append(entry)
+        entries = merged
+
+    entries = entries[:per_page + 1]
+    ids = [paper_id for uploaded_at, paper_id in entries[:per_page]]
+    papers_by_id = paper_cards(Paper.objects.all()).in_bulk(ids)
+    papers = [papers_by_id[pk] for pk in ids if pk in papers_by_id]
+    next_url = page_url(request, encode_cursor(papers[-1])) if len(entries) > per_page and papers else None
+    return Page(papers, next_url)
@@ -1,13 +1,29 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from .models import Paper, Comment
+from .models import Paper, Comment, UploadSession
+from .uploads import UPLOAD_MAX_BYTES
+
+
+class SelectedUsersWidget(forms.SelectMultiple):
+    """
+    A multi-select that only renders the users already chosen (e.g. when the form
+    is redisplayed with errors). The rest are fetched from the typeahead endpoint
+    as the user types, instead of embedding every user in the page.
+    """
+    def optgroups(self, name, value, attrs=None):
+        ids = [pk for pk in value if str(pk).isdigit()]
+        self.choices = list(User.objects.filter(pk__in=ids).order_by('username').values_list('pk', 'username'))
+        return super().optgroups(name, value, attrs)
+
 
 class PaperUploadForm(forms.ModelForm):
     """
     Form for uploading a new paper. 
     Includes fields to tag existing users as authors and to create new authors who are not users.
     Includes user choice for writing the article content or generating it via AI.
+    The PDF is either posted with the form or, for a chunked upload (see uploads.py),
+    already on disk and referred to by its session id.
     """
     ARTICLES_CHOICES = [
         ('ai', 'Generate article using AI'),
@@ -33,18 +49,46 @@ class PaperUploadForm(forms.ModelForm):
     )
     
     author_users = forms.ModelMultipleChoiceField(
-        queryset=User.objects.all().order_by('username'),
-        widget=forms.SelectMultiple(attrs={'class': 'author-select-input'}),
+        queryset=User.objects.all(),
+        widget=SelectedUsersWidget(attrs={'class': 'author-select-input'}),
         required=False,
         label="Select Authors (from platform users)"
     )
     
     new_authors = forms.CharField(
-        widget=forms.TextInput(attrs={'placeholder': 'e.g., John Doe'}),
+        widget=forms.TextInput(attrs={'placeholder': 'e.g., John Doe', 'list': 'author-suggestions', 'autocomplete': 'off'}),
         required=False,
         label="Add Authors (Non-Users)",
         help_text="Separate multiple author names with a comma."
     )
+
+    upload = forms.ModelChoiceField(
+        queryset=UploadSession.objects.none(),
+        widget=forms.HiddenInput,
+        required=False,
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['pdf_file'].required = False
+        if user is not None:
+            self.fields['upload'].queryset = UploadSession.objects.filter(user=user)
+
+    def clean_pdf_file(self):
+        pdf_file = self.cleaned_data.get('pdf_file')
+        if pdf_file and pdf_file.size > UPLOAD_MAX_BYTES:
+            raise forms.ValidationError(f"PDFs can be at most {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.")
+        return pdf_file
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('upload')
+        if upload is not None:
+            if not upload.complete:
+                self.add_error('pdf_file', "The file hasn't finished uploading.")
+        elif not cleaned_data.get('pdf_file') and 'pdf_file' not in self.errors:
+            self.add_error('pdf_file', forms.Field.default_error_messages['required'])
+        return cleaned_data
     
     class Meta: 
         model = Paper
@@ -0,0 +1,244 @@
+"""
+Bulk ingestion helpers used by the import_papers command.
+
+prepare_pdf does the CPU-heavy work for one file (hashing, text extraction,
+rendering the WebP thumbnails) and only returns plain data, so it can run in a process
+pool. write_batch then stores blobs and creates papers, authors, tags and their
+M2M rows with a handful of bulk queries per batch.
+"""
+import hashlib
+import os
+from collections import defaultdict
+
+import PyPDF2
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from ai_processing.models import ExtractedText
+from profiles.counters import adjust as adjust_counter
+from .citations import index_titles
+from .feed import fan_out
+from .models import Author, Paper, PdfBlob, Tag
+from .search import index_paper
+from .storage import blob_name
+from .tag_cloud import add_papers
+from .thumbnails import render_thumbnails, store_thumbnails
+from .typeahead import invalidate as invalidate_typeahead
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def prepare_pdf(item, max_chars):
+    """
+    Hashes, extracts up to max_chars of text from and renders a thumbnail for one PDF.
+    `item` is a manifest entry ({"path": ..., "title": ..., ...}); returns it with the results added.
+    """
+    result = dict(item)
+    path = item["path"]
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        result.update({"content_hash": digest.hexdigest(), "size": size})
+
+        pages, char_count = [], 0
+        with open(path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            page_count = len(reader.pages)
+            for page in reader.pages:
+                text = page.extract_text() or ""
+                pages.append(text)
+                char_count += len(text)
+                if char_count >= max_chars:
+                    break
+        result.update({"pages": pages, "page_count": page_count, "char_count": char_count})
+
+        result["thumbnails"] = render_thumbnails(path)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def _get_or_create_by_name(model, names):
+    """Returns {name: id} for the given names, creating missing rows in bulk."""
+    if not names:
+        return {}
+    ids = dict(model.objects.filter(name__in=names).values_list("name", "id"))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        model.objects.bulk_create([model(name=name) for name in missing], ignore_conflicts=True)
+        ids.update(model.objects.filter(name__in=missing).values_list("name", "id"))
+        # bulk_create sends no post_save, so tell the typeahead index directly
+        invalidate_typeahead("authors" if model is Author else "tags", [(ids[name], name) for name in missing])
+    return ids
+
+
+def _store_blobs(prepared, written):
+    """
+    Returns {content_hash: PdfBlob}, writing files only for hashes not stored yet. The
+    names of the files written are appended to `written`, for write_batch to remove if
+    the transaction rolls back.
+    """
+    hashes = {item["content_hash"] for item in prepared}
+    existing = set(PdfBlob.objects.filter(content_hash__in=hashes).values_list("content_hash", flat=True))
+
+    new_blobs = {}
+    for item in prepared:
+        digest = item["content_hash"]
+        if digest in existing or digest in new_blobs:
+            continue
+        with open(item["path"], "rb") as f:
+            name = default_storage.save(blob_name(digest), File(f))
+        written.append((digest, name))
+        thumbnails = store_thumbnails(digest, item["thumbnails"])
+        written.extend((digest, thumbnail) for thumbnail in thumbnails.values())
+        new_blobs[digest] = PdfBlob(content_hash=digest, file=name, size=item["size"], **thumbnails)
+    # another import or upload may have stored some of the same files meanwhile; theirs win
+    PdfBlob.objects.bulk_create(new_blobs.values(), ignore_conflicts=True)
+    blobs = {blob.content_hash: blob for blob in PdfBlob.objects.filter(content_hash__in=hashes)}
+    for digest, blob in new_blobs.items():
+        if blobs[digest].file.name != blob.file.name:
+            default_storage.delete(blob.file.name)
+
+    ExtractedText.objects.bulk_create([
+        ExtractedText(
+            content_hash=item["content_hash"], pages=item["pages"], page_count=item["page_count"],
+            char_count=item["char_count"], complete=len(item["pages"]) >= item["page_count"],
+        )
+        for item in prepared
+    ], ignore_conflicts=True)
+    return blobs
+
+
+def _remove_written(written):
+    """Deletes the files of a rolled-back batch, keeping those a committed blob still uses."""
+    kept = set(PdfBlob.objects.filter(content_hash__in={digest for digest, name in written})
+               .values_list("content_hash", flat=True))
+    for digest, name in written:
+        if digest not in kept or name.endswith(".pdf"):
+            default_storage.delete(name)
+
+
+def _already_imported(prepared, uploader):
+    """
+    Drops items whose file the uploader already has a paper for (or that repeat an
+    earlier item), so a resumed import doesn't create the papers of its last batch twice.
+    """
+    hashes = {item["content_hash"] for item in prepared}
+    seen = set(Paper.objects.filter(uploader=uploader, blob__content_hash__in=hashes)
+               .values_list("blob__content_hash", flat=True))
+    fresh = []
+    for item in prepared:
+        if item["content_hash"] not in seen:
+            seen.add(item["content_hash"])
+            fresh.append(item)
+    return fresh
+
+
+def _tag_names(item, blob, generate_ai):
+    """Tags from the manifest, plus the AI tags already generated for the same file."""
+    names = list(item.get("tags", []))
+    if generate_ai:
+        names += blob.ai_tags
+    return {name.strip().lower() for name in names if name.strip()}
+
+
+def _write_papers(prepared, uploader, generate_ai, written):
+    """Writes the blobs, papers, authors and tags of a batch, inside write_batch's transaction."""
+    prepared = _already_imported(prepared, uploader)
+    if not prepared:
+        return []
+    blobs = _store_blobs(prepared, written)
+
+    papers = []
+    for item in prepared:
+        blob = blobs[item["content_hash"]]
+        reuse_article = generate_ai and bool(blob.ai_article)
+        if reuse_article:
+            article = blob.ai_article
+        elif generate_ai:
+            article = None
+        else:
+            article = item.get("article_content")
+        papers.append(Paper(
+            uploader=uploader,
+            title=(item.get("title") or os.path.splitext(os.path.basename(item["path"]))[0])[:300],
+            publication_year=item.get("publication_year"),
+            article_content=article,
+            pdf_file=blob.file.name,
+            thumbnail=blob.thumbnail.name or None,
+            thumbnail_small=blob.thumbnail_small.name or None,
+            blob=blob,
+        ))
+    # bulk_create skips Paper.save, so render the article HTML here
+    for paper in papers:
+        paper.render_article_html()
+    Paper.objects.bulk_create(papers)
+
+    # ... and take the blob references and count the uploads here
+    adjust_counter([uploader.pk], "paper_count", len(papers))
+    references = defaultdict(int)
+    for paper in papers:
+        references[paper.blob_id] += 1
+    for blob_id, count in references.items():
+        PdfBlob.objects.filter(pk=blob_id).update(ref_count=F("ref_count") + count)
+
+    author_ids = _get_or_create_by_name(Author, {
+        name.strip() for item in prepared for name in item.get("authors", []) if name.strip()
+    })
+    paper_tags = [_tag_names(item, blobs[item["content_hash"]], generate_ai) for item in prepared]
+    tag_ids = _get_or_create_by_name(Tag, set().union(*paper_tags))
+
+    Paper.authors.through.objects.bulk_create([
+        Paper.authors.through(paper_id=paper.pk, author_id=author_ids[name.strip()])
+        for paper, item in zip(papers, prepared)
+        for name in set(item.get("authors", [])) if name.strip()
+    ], ignore_conflicts=True)
+    Paper.tags.through.objects.bulk_create([
+        Paper.tags.through(paper_id=paper.pk, tag_id=tag_ids[name])
+        for paper, names in zip(papers, paper_tags)
+        for name in names
+    ], ignore_conflicts=True)
+    tag_counts = defaultdict(int)
+    for names in paper_tags:
+        for name in names:
+            tag_counts[tag_ids[name]] += 1
+    for tag_id, count in tag_counts.items():
+        add_papers([tag_id], count)
+    return papers
+
+
+def write_batch(prepared, uploader, generate_ai=True):
+    """
+    Creates papers for a batch of prepared items. Returns (papers, ai_paper_ids), where
+    ai_paper_ids are the new papers that still need an AI article. Items whose file the
+    uploader already has a paper for are skipped, and files written for a batch that
+    fails are removed again.
+    """
+    prepared = [item for item in prepared if "error" not in item]
+    if not prepared:
+        return [], []
+
+    written = []
+    try:
+        with transaction.atomic():
+            papers = _write_papers(prepared, uploader, generate_ai, written)
+    except Exception:
+        _remove_written(written)
+        raise
+    if not papers:
+        return [], []
+
+    # bulk writes send no signals, so index and fan out the new papers directly
+    for paper in papers:
+        index_paper(paper.pk)
+        fan_out(paper)
+    index_titles(papers)
+
+    ai_paper_ids = [paper.pk for paper in papers if generate_ai and not paper.blob.ai_article]
+    return papers, ai_paper_ids
@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from papers import minhash
+from papers.duplicates import DUPLICATE_THRESHOLD
+
+
+def synthetic_documents(size, length, duplicate_fraction, edit_rate, vocabulary=20000, seed=0):
+    """
+    Yields (text, original index or None). A `duplicate_fraction` of the documents
+    are copies of an earlier one with `edit_rate` of their words replaced and a
+    watermark line added, like a re-exported or lightly revised paper.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocabulary)])
+    zipf = 1.0 / np.arange(1, vocabulary + 1) ** 0.8
+    zipf /= zipf.sum()
+    documents = []
+    for index in range(size):
+        if documents and rng.random() < duplicate_fraction:
+            original = int(rng.integers(0, len(documents)))
+            tokens = documents[original].copy()
+            edits = rng.random(len(tokens)) < edit_rate
+            tokens[edits] = rng.choice(vocabulary, size=int(edits.sum()), p=zipf)
+            documents.append(tokens)
+            yield " ".join(words[tokens]) + f" downloaded from example.org copy {index}", original
+        else:
+            tokens = rng.choice(vocabulary, size=length, p=zipf)
+            documents.append(tokens)
+            yield " ".join(words[tokens]), None
+
+
+class Command(BaseCommand):
+    help = (
+        "Times MinHash signing and LSH lookup against a brute-force scan of every signature on "
+        "synthetic corpora with planted near-duplicates, and reports recall. Nothing is written to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000", help="Comma-separated corpus sizes.")
+        parser.add_argument("--length", type=int, default=3000, help="Words per synthetic document.")
+        parser.add_argument("--duplicates", type=float, default=0.1, help="Fraction of near-duplicate documents.")
+        parser.add_argument("--edit-rate", type=float, default=0.01, help="Fraction of words changed in a duplicate.")
+        parser.add_argument("--queries", type=int, default=200)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options["sizes"].split(","))
+        self.stdout.write(
+            f"{'papers':>8} {'sign ms/doc':>12} {'LSH ms/query':>13} {'scan ms/query':>14} "
+            f"{'candidates':>11} {'recall':>7}"
+        )
+        for size in sizes:
+            signatures, planted = [], []
+            started = time.perf_counter()
+            for index, (text, original) in enumerate(synthetic_documents(
+                size, options["length"], options["duplicates"], options["edit_rate"],
+            )):
+                signatures.append(minhash.signature(minhash.shingles(text)))
+                if original is not None:
+                    planted.append((index, original))
+            signed = time.perf_counter()
+
+            # the in-memory equivalent of the TextKey table
+            buckets = {}
+            for index, sig in enumerate(signatures):
+                for key in minhash.band_keys(sig):
+                    buckets.setdefault(key, []).append(index)
+            matrix = np.stack(signatures)
+
+            queries = planted[:options["queries"]] or [(0, None)]
+            found = candidate_count = 0
+            lsh_started = time.perf_counter()
+            for index, original in queries:
+                candidates = {other for key in minhash.band_keys(signatures[index]) for other in buckets[key]}
+                candidates.discard(index)
+                candidate_count += len(candidates)
+                matches = {
+                    other for other in candidates
+                    if minhash.similarity(signatures[index], signatures[other]) >= DUPLICATE_THRESHOLD
+                }
+                found += original in matches
+            lsh_time = time.perf_counter() - lsh_started
+
+            scan_started = time.perf_counter()
+            for index, original in queries:
+                np.nonzero((matrix == signatures[index]).mean(axis=1) >= DUPLICATE_THRESHOLD)
+            scan_time = time.perf_counter() - scan_started
+
+            self.stdout.write(
+                f"{size:>8} {(signed - started) * 1000 / size:>12.2f} {lsh_time * 1000 / len(queries):>13.3f} "
+                f"{scan_time * 1000 / len(queries):>14.3f} {candidate_count / len(queries):>11.1f} "
+                f"{found / len(queries) if planted else float('nan'):>7.1%}"
+            )
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from ai_processing.models import ExtractedText
+from papers.models import Paper, PdfBlob, RelatedPapers, Tag
+from papers.related import RELATED_K, RelatedIndex, _store
+
+
+def synthetic_corpus(size, length=300, vocabulary=30000, topics=200, seed=0):
+    """
+    Documents over a Zipf-distributed vocabulary. Each document draws half its
+    words from one of `topics` topic vocabularies, so true neighbours exist.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocabulary)])
+    zipf = 1.0 / np.arange(1, vocabulary + 1)
+    zipf /= zipf.sum()
+    topic_words = rng.integers(0, vocabulary, size=(topics, 100))
+    for topic in rng.integers(0, topics, size=size):
+        common = rng.choice(vocabulary, size=length // 2, p=zipf)
+        specific = rng.choice(topic_words[topic], size=length - length // 2)
+        yield " ".join(words[np.concatenate([common, specific])])
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def populate(size, article_words, text_words, batch_size=2000):
+    """
+    Adds `size` papers to the current database the way the index reads them: a
+    title, tags and an article on the Paper, and extracted PDF text on its blob.
+    """
+    uploader, _ = User.objects.get_or_create(username="related-benchmark")
+    tags = [Tag.objects.get_or_create(name=f"topic-{i}")[0] for i in range(50)]
+    articles = synthetic_corpus(size, article_words, seed=1)
+    texts = synthetic_corpus(size, text_words, seed=2)
+    start = Paper.objects.count()
+    for offset in range(0, size, batch_size):
+        count = min(batch_size, size - offset)
+        digests = [hashlib.sha256(f"related-benchmark-{start + offset + i}".encode()).hexdigest() for i in range(count)]
+        with transaction.atomic():
+            blobs = PdfBlob.objects.bulk_create([
+                PdfBlob(content_hash=digest, file=f"papers/blobs/{digest}.pdf", ref_count=1) for digest in digests
+            ])
+            ExtractedText.objects.bulk_create([
+                ExtractedText(content_hash=digest, pages=[next(texts)], page_count=1, complete=True)
+                for digest in digests
+            ])
+            papers = Paper.objects.bulk_create([
+                Paper(uploader=uploader, title=f"Paper {start + offset + i}", article_content=next(articles),
+                      pdf_file=blob.file.name, blob=blob)
+                for i, blob in enumerate(blobs)
+            ])
+            Paper.tags.through.objects.bulk_create([
+                Paper.tags.through(paper_id=paper.pk, tag_id=tags[(paper.pk * 7 + j) % len(tags)].pk)
+                for paper in papers for j in range(3)
+            ])
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the related-papers rebuild as it runs in production (reading papers, tags and extracted "
+        "text from the database, the TF-IDF fit, the batched top-k search and writing the neighbour "
+        "lists) on synthetic corpora of growing size in a throwaway test database, and reports memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000", help="Comma-separated corpus sizes.")
+        parser.add_argument("-k", type=int, default=RELATED_K)
+        parser.add_argument("--article-words", type=int, default=300, help="Words per synthetic article.")
+        parser.add_argument("--text-words", type=int, default=3000, help="Words of extracted PDF text per paper.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options["sizes"].split(","))
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as workdir:
+                self.stdout.write(
+                    f"{'papers':>8} {'populate':>9} {'build':>8} {'top-k':>8} {'store':>8} {'save':>8}"
+                    f" {'matrix MB':>10} {'peak RSS MB':>12}"
+                )
+                for size in sizes:
+                    self.run(size, options, os.path.join(workdir, f"related-{size}.pkl"))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, size, options, path):
+        started = time.perf_counter()
+        populate(size - Paper.objects.count(), options["article_words"], options["text_words"])
+        populated = time.perf_counter()
+        # the same steps as related.rebuild(), timed one by one
+        index = RelatedIndex.build()
+        built = time.perf_counter()
+        neighbours = index.neighbours(options["k"])
+        searched = time.perf_counter()
+        with transaction.atomic():
+            _store(neighbours)
+        stored = time.perf_counter()
+        index.save(path)
+        saved = time.perf_counter()
+
+        matrix = index.matrix
+        matrix_mb = (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2 ** 20
+        self.stdout.write(
+            f"{size:>8} {populated - started:>8.1f}s {built - populated:>7.1f}s {searched - built:>7.1f}s "
+            f"{stored - searched:>7.1f}s {saved - stored:>7.1f}s {matrix_mb:>10.1f} {peak_rss_mb():>12.0f}"
+        )
+        RelatedPapers.objects.all().delete()
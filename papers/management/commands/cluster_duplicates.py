@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from papers.duplicates import cluster, sign_missing
+
+
+class Command(BaseCommand):
+    help = (
+        "Signs every paper with extracted text but no MinHash signature yet, then groups the whole "
+        "corpus into near-duplicate clusters and marks each cluster's later papers as duplicates of its earliest."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--show", type=int, default=10, help="Largest clusters to list.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        signed = sign_missing()
+        groups = cluster()
+        duplicates = sum(len(members) for members in groups.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Signed {signed} papers; found {len(groups)} clusters holding {duplicates} near-duplicates "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
+        for original, members in sorted(groups.items(), key=lambda group: -len(group[1]))[:options["show"]]:
+            self.stdout.write(f"  paper {original}: {', '.join(str(member) for member in sorted(members))}")
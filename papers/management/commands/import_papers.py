@@ -0,0 +1,143 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_processing import jobs, queues
+from ai_processing.models import ProcessingJob
+from ai_processing.tasks import MAX_PROMPT_CHARS, generate_article_task
+from papers.ingest import prepare_pdf, write_batch
+from papers.tasks import index_text_task
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a library of PDFs from a directory or a manifest.jsonl file "
+        "(one {\"path\", \"title\", \"authors\", \"tags\", \"publication_year\"} object per line). "
+        "Hashing, text extraction and thumbnails run in a process pool; rows are written in bulk. "
+        "Interrupted imports resume from a checkpoint file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Directory to scan for PDFs, or a manifest .jsonl file.")
+        parser.add_argument("--user", required=True, help="Username recorded as the uploader.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for PDF work.")
+        parser.add_argument("--batch-size", type=int, default=200, help="Papers written per transaction.")
+        parser.add_argument("--checkpoint", help="Checkpoint file (default: <source>.import-checkpoint).")
+        parser.add_argument("--no-ai", action="store_true", help="Don't enqueue AI article generation.")
+        parser.add_argument("--ai-batch-size", type=int, default=20, help="AI tasks released per interval.")
+        parser.add_argument("--ai-batch-interval", type=int, default=60, help="Seconds between AI task batches.")
+
+    def handle(self, *args, **options):
+        try:
+            uploader = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named '{options['user']}'.")
+
+        source = os.path.abspath(options["source"])
+        checkpoint_path = options["checkpoint"] or source.rstrip(os.sep) + ".import-checkpoint"
+        done = self.load_checkpoint(checkpoint_path)
+        items = [item for item in self.read_source(source) if item["path"] not in done]
+        self.stdout.write(f"{len(items)} PDFs to import ({len(done)} already done according to the checkpoint).")
+
+        batch_size = options["batch_size"]
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        prepare = partial(prepare_pdf, max_chars=MAX_PROMPT_CHARS)
+        imported = skipped = failed = ai_enqueued = 0
+        started = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=django.setup) as pool:
+            # keep one batch in flight in the pool while the previous one is written
+            pending = pool.map(prepare, batches[0]) if batches else None
+            for index in range(len(batches)):
+                prepared = list(pending)
+                pending = pool.map(prepare, batches[index + 1]) if index + 1 < len(batches) else None
+
+                for item in prepared:
+                    if "error" in item:
+                        failed += 1
+                        self.stderr.write(f"Skipping {item['path']}: {item['error']}")
+                papers, ai_paper_ids = write_batch(prepared, uploader, generate_ai=not options["no_ai"])
+                imported += len(papers)
+                # files the uploader already has a paper for, e.g. a batch written just before an interruption
+                skipped += sum("error" not in item for item in prepared) - len(papers)
+                ai_enqueued += self.enqueue_ai(ai_paper_ids, ai_enqueued, options)
+                ai_paper_id_set = set(ai_paper_ids)
+                self.enqueue_indexing([paper.pk for paper in papers if paper.pk not in ai_paper_id_set])
+
+                # failed PDFs stay out of the checkpoint, so a resumed import tries them again
+                self.save_checkpoint(checkpoint_path, [item["path"] for item in prepared if "error" not in item])
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"Batch {index + 1}/{len(batches)}: {imported} imported, {skipped} already there, {failed} failed, "
+                    f"{imported / elapsed:.1f} papers/sec"
+                )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} papers in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.1f} papers/sec); "
+            f"{skipped} were already imported, {failed} failed, {ai_enqueued} AI articles enqueued."
+        ))
+
+    def read_source(self, source):
+        """Yields manifest entries with absolute paths."""
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(".pdf"):
+                        yield {"path": os.path.join(root, name)}
+            return
+        if not os.path.isfile(source):
+            raise CommandError(f"{source} is neither a directory nor a manifest file.")
+        base = os.path.dirname(source)
+        with open(source) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    raise CommandError(f"{source}:{line_number}: invalid JSON ({e})")
+                item["path"] = os.path.abspath(os.path.join(base, item["path"]))
+                yield item
+
+    def enqueue_ai(self, paper_ids, already_enqueued, options):
+        """Schedules AI tasks so that at most ai_batch_size are released per interval."""
+        size, interval = options["ai_batch_size"], options["ai_batch_interval"]
+        queue = queues.route(generate_article_task, bulk=True)[0]
+        job_ids = jobs.enqueue_many(paper_ids, ProcessingJob.ARTICLE, queue)
+        # papers left out already have a run queued or running
+        for offset, paper_id in enumerate([pk for pk in paper_ids if pk in job_ids], already_enqueued):
+            queues.dispatch(
+                generate_article_task, (paper_id,), {"job_id": job_ids[paper_id]}, bulk=True,
+                countdown=(offset // size) * interval,
+            )
+        return len(job_ids)
+
+    def enqueue_indexing(self, paper_ids):
+        """
+        Parses the references of the papers that don't get an AI article (--no-ai, manifest
+        articles, articles reused from the blob) and signs their text for near-duplicate
+        detection; the article task does both for the rest.
+        """
+        for paper_id in paper_ids:
+            queues.dispatch(index_text_task, (paper_id,), bulk=True)
+
+    def load_checkpoint(self, path):
+        """The checkpoint is an append-only list of finished paths, one per line."""
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return {line.rstrip("\n") for line in f if line.endswith("\n")}
+
+    def save_checkpoint(self, path, paths):
+        with open(path, "a") as f:
+            f.writelines(f"{p}\n" for p in paths)
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from papers.models import Paper
+from papers.storage import hash_file, store_pdf
+
+
+class Command(BaseCommand):
+    help = "Moves PDFs uploaded before content-addressed storage into shared blobs, deleting duplicate copies."
+
+    def handle(self, *args, **options):
+        migrated = reused = missing = 0
+        for paper in Paper.objects.filter(blob__isnull=True).iterator():
+            if not paper.pdf_file or not paper.pdf_file.storage.exists(paper.pdf_file.name):
+                missing += 1
+                continue
+
+            old_name = paper.pdf_file.name
+            old_thumbnail = paper.thumbnail.name if paper.thumbnail else None
+            with paper.pdf_file.open('rb') as f:
+                digest, size = hash_file(f)
+                blob, created = store_pdf(f, digest=digest, size=size)
+
+            if not blob.thumbnail and old_thumbnail:
+                # adopt this paper's thumbnail as the blob's
+                blob.thumbnail = old_thumbnail
+                blob.save(update_fields=['thumbnail'])
+                old_thumbnail = None
+
+            Paper.objects.filter(pk=paper.pk).update(
+                blob=blob, pdf_file=blob.file.name, thumbnail=blob.thumbnail.name or None
+            )
+
+            paper.pdf_file.storage.delete(old_name)
+            if old_thumbnail and old_thumbnail != blob.thumbnail.name:
+                paper.pdf_file.storage.delete(old_thumbnail)
+            migrated += 1
+            reused += not created
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {migrated} papers into blob storage ({reused} were duplicates); {missing} had no file on disk."
+        ))
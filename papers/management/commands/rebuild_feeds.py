@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from papers import feed
+
+
+class Command(BaseCommand):
+    help = "Rebuilds every user's materialized following timeline from who they follow."
+
+    def handle(self, *args, **options):
+        cache.delete(feed.HIGH_FANOUT_CACHE_KEY)
+        feed.get_backend().clear()
+        users = User.objects.filter(profile__isnull=False).select_related("profile")
+        rebuilt = 0
+        for user in users.iterator(chunk_size=500):
+            feed.rebuild(user)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {rebuilt} timelines ({len(feed.high_fanout_user_ids())} high-fan-out uploaders are read at query time)."
+        ))
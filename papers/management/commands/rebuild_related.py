@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from papers.related import RELATED_K, rebuild
+
+
+class Command(BaseCommand):
+    help = "Refits the related-papers TF-IDF index over every paper and recomputes all neighbour lists."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-k", type=int, default=RELATED_K, help="Neighbours stored per paper.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild(k=options["k"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Computed related papers for {count} papers in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from papers.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index for all papers from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Papers to index per database batch.")
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(batch_size=options["batch_size"], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the search index for {indexed} papers."))
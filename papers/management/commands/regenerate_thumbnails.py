@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ai_processing import queues
+from papers.models import PdfBlob
+from papers.tasks import generate_thumbnails_task
+
+
+class Command(BaseCommand):
+    help = "Enqueues thumbnail rendering for stored PDFs that are missing WebP thumbnails."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Re-render every blob, not just missing ones.")
+
+    def handle(self, *args, **options):
+        blobs = PdfBlob.objects.all()
+        if not options["all"]:
+            blobs = blobs.filter(
+                Q(thumbnail_small__isnull=True) | Q(thumbnail_small="") | ~Q(thumbnail__endswith=".webp")
+            )
+        count = 0
+        for blob_id in blobs.values_list("pk", flat=True).iterator():
+            queues.dispatch(generate_thumbnails_task, (blob_id,), {"force": options["all"]}, bulk=True)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Enqueued thumbnail rendering for {count} PDFs."))
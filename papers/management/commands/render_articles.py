@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from papers.models import Paper
+
+
+class Command(BaseCommand):
+    help = "Renders stored article HTML for papers whose article content (or the renderer) changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--force", action="store_true", help="Re-render every paper.")
+
+    def handle(self, *args, **options):
+        batch, rendered = [], 0
+        papers = Paper.objects.only("pk", "article_content", "article_html_hash").order_by("pk")
+        for paper in papers.iterator(chunk_size=options["batch_size"]):
+            if options["force"]:
+                paper.article_html_hash = ""
+            if paper.render_article_html():
+                batch.append(paper)
+            if len(batch) >= options["batch_size"]:
+                Paper.objects.bulk_update(batch, ["article_html", "article_html_hash"])
+                rendered += len(batch)
+                batch = []
+        Paper.objects.bulk_update(batch, ["article_html", "article_html_hash"])
+        rendered += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Rendered article HTML for {rendered} papers."))
@@ -0,0 +1,105 @@
+import tempfile
+
+from celery import current_app
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from papers.benchmarks import corpus, report, scenarios
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds a seeded synthetic corpus in a throwaway test database, times the main views and the "
+        "article task (against the mock Gemini server) and writes a JSON report. With --baseline, "
+        "compares against an earlier report and fails if any scenario regressed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--papers", type=int, default=500)
+        parser.add_argument("--authors", type=int, default=200)
+        parser.add_argument("--tags", type=int, default=60)
+        parser.add_argument("--follows", type=int, default=10, help="Users each user follows.")
+        parser.add_argument("--bookmarks", type=int, default=20, help="Bookmarks per user.")
+        parser.add_argument("--comments", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per scenario (after one warm-up).")
+        parser.add_argument("--only", default="", help="Comma-separated scenario names to run.")
+        parser.add_argument("--llm-latency", type=float, default=0.0, help="Mock Gemini latency per call (s).")
+        parser.add_argument("--output", default="benchmark-report.json", help="Where to write the JSON report.")
+        parser.add_argument("--baseline", help="A previous report to compare against.")
+        parser.add_argument("--time-tolerance", type=float, default=0.25,
+                            help="Allowed slowdown of a scenario's median, as a fraction of the baseline's.")
+        parser.add_argument("--min-time-delta", type=float, default=2.0,
+                            help="Slowdowns smaller than this many ms are never regressions.")
+        parser.add_argument("--query-tolerance", type=int, default=0, help="Allowed extra queries per scenario.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            try:
+                baseline = report.load(options["baseline"])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read the baseline: {e}")
+        parameters = {name: options[name] for name in (
+            "users", "papers", "authors", "tags", "follows", "bookmarks", "comments", "seed", "repeat", "llm_latency",
+        )}
+        if baseline and baseline["parameters"] != parameters:
+            self.stderr.write(self.style.WARNING(
+                f"The baseline was run with different parameters: {baseline['parameters']}"
+            ))
+
+        results = self.run(options)
+        current = report.build(results, parameters)
+        report.write(current, options["output"])
+        self.stdout.write(f"Wrote {options['output']}")
+
+        rows, regressions = report.compare(
+            current, baseline or {"results": {}}, options["time_tolerance"], options["min_time_delta"],
+            options["query_tolerance"],
+        )
+        self.print_table(rows)
+        if regressions:
+            raise CommandError(f"{len(regressions)} scenario(s) regressed against {options['baseline']}.")
+
+    def run(self, options):
+        # queue the tasks that views schedule without running them or needing a broker
+        current_app.conf.update(task_always_eager=False, broker_url="memory://")
+        only = {name for name in options["only"].split(",") if name}
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as media, tempfile.TemporaryDirectory() as workdir, override_settings(
+                MEDIA_ROOT=media,
+                CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+            ):
+                self.stdout.write("Generating the corpus...")
+                handles = corpus.generate(
+                    workdir, users=options["users"], papers=options["papers"], authors=options["authors"],
+                    tags=options["tags"], follows=options["follows"], bookmarks_per_user=options["bookmarks"],
+                    comments=options["comments"], seed=options["seed"],
+                )
+                return scenarios.run(
+                    scenarios.build_scenarios(handles), options["repeat"], only, options["llm_latency"]
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def print_table(self, rows):
+        self.stdout.write(
+            f"{'scenario':<24} {'median ms':>10} {'p95 ms':>9} {'queries':>8} {'status':>7}"
+            f" {'base ms':>9} {'base q':>7}"
+        )
+        for row in rows:
+            result, before = row["result"], row["baseline"] or {}
+            line = (
+                f"{row['name']:<24} {result['median_ms']:>10.1f} {result['p95_ms']:>9.1f} {result['queries']:>8}"
+                f" {str(result['status']):>7} {before.get('median_ms', float('nan')):>9.1f}"
+                f" {before.get('queries', '-'):>7}"
+            )
+            if row["problems"]:
+                line = self.style.ERROR(f"{line}  REGRESSED: {'; '.join(row['problems'])}")
+            self.stdout.write(line)
@@ -0,0 +1,158 @@
+"""
+Serving a paper's PDF and thumbnails to logged-in users.
+
+Files are answered with an ETag and Last-Modified (taken from the file's
+modification time and size), so a browser that has them revalidates with a
+304 instead of downloading them again, and with a private Cache-Control so it
+doesn't ask for a while at all. A paper's PDF never changes, so it is cached
+for PAPER_FILE_MAX_AGE; thumbnails can be re-rendered in place
+(regenerate_thumbnails), so they revalidate sooner.
+
+Single byte ranges (`Range: bytes=start-end`) get a 206 with just those bytes,
+streamed from disk. That is what lets the browser's PDF viewer fetch the
+cross-reference table and the first page's objects of a large PDF and show
+page 1 before the rest has arrived. Requests for several ranges at once get the
+whole file, which HTTP allows.
+
+With MEDIA_SENDFILE set, Django only checks the login and the conditional
+headers, and the web server sends the bytes (and handles ranges itself):
+- "x-accel-redirect" (nginx): an `internal` location at MEDIA_ACCEL_PREFIX must
+  alias MEDIA_ROOT;
+- "x-sendfile" (Apache mod_xsendfile, lighttpd): the header carries the file's path.
+Either way MEDIA_ROOT should no longer be served publicly.
+
+papers/urls.py also answers MEDIA_URL itself, with the same login check, for
+links to stored files that don't go through a paper (and so that a
+`static(settings.MEDIA_URL, ...)` route added after the papers URLs never
+serves them to anonymous visitors).
+"""
+import mimetypes
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+PAPER_FILE_MAX_AGE = getattr(settings, "PAPER_FILE_MAX_AGE", timedelta(days=365))
+THUMBNAIL_MAX_AGE = getattr(settings, "THUMBNAIL_MAX_AGE", timedelta(days=7))
+MEDIA_SENDFILE = getattr(settings, "MEDIA_SENDFILE", None)
+MEDIA_ACCEL_PREFIX = getattr(settings, "MEDIA_ACCEL_PREFIX", "/protected-media/")
+MEDIA_READ_SIZE = 64 * 1024
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class StoredFile:
+    """A name in default storage, with the name, path and url serve() reads from a FieldFile."""
+
+    def __init__(self, name, storage=default_storage):
+        self.name = name
+        self.storage = storage
+
+    @property
+    def path(self):
+        return self.storage.path(self.name)
+
+    @property
+    def url(self):
+        return self.storage.url(self.name)
+
+
+def parse_range(header, size):
+    """
+    (start, end exclusive) of a single-range header, or None to send the whole
+    file (no header, several ranges, or one that can't be parsed). Raises
+    RangeNotSatisfiable when the range lies entirely past the end of the file.
+    """
+    match = _RANGE.match((header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # "bytes=-n": the last n bytes
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+        return max(0, size - int(last)), size
+    start = int(first)
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = min(int(last) + 1, size) if last else size
+    return (start, end) if end > start else None
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(MEDIA_READ_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def serve(request, field_file, max_age, filename=None):
+    """The response for a GET of a stored file: 200, 206, 304, 412 or 416."""
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        # remote storage serves (and caches) its own files
+        return HttpResponseRedirect(field_file.url)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("File not found.")
+
+    size = stat.st_size
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{size:x}")
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(field_file.name)[0] or "application/octet-stream"
+    headers = HttpResponse()
+    headers["ETag"] = etag
+    headers["Last-Modified"] = http_date(last_modified)
+    headers["Cache-Control"] = f"private, max-age={int(max_age.total_seconds())}"
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    if conditional is not headers:
+        return conditional
+
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    # a range only applies to the copy the client already has part of
+    if not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    if MEDIA_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        if MEDIA_SENDFILE == "x-accel-redirect":
+            response["X-Accel-Redirect"] = MEDIA_ACCEL_PREFIX.rstrip("/") + "/" + field_file.name
+        else:
+            response["X-Sendfile"] = path
+    elif byte_range is None:
+        # the WSGI server's file wrapper can hand a whole file to sendfile()
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type=content_type)
+        response["Content-Length"] = end - start
+        response["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+
+    for header in ("ETag", "Last-Modified", "Cache-Control"):
+        response[header] = headers[header]
+    response["Accept-Ranges"] = "bytes"
+    if filename:
+        response["Content-Disposition"] = content_disposition_header(False, filename)
+    return response
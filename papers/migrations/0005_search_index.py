@@ -0,0 +1,75 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_papers(apps, schema_editor):
+    # the same postings search.rebuild_index() writes, from the historical models
+    from collections import Counter
+
+    from papers.search import _signature, paper_term_weights
+
+    Paper = apps.get_model("papers", "Paper")
+    SearchDocument = apps.get_model("papers", "SearchDocument")
+    SearchTerm = apps.get_model("papers", "SearchTerm")
+    SearchPosting = apps.get_model("papers", "SearchPosting")
+
+    term_ids, doc_freq, postings, documents = {}, Counter(), [], []
+    papers = Paper.objects.select_related("uploader").prefetch_related("authors", "tags").order_by("pk")
+    for paper in papers.iterator(chunk_size=500):
+        weights = paper_term_weights(paper)
+        new_terms = [term for term in weights if term not in term_ids]
+        if new_terms:
+            created = SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in new_terms])
+            term_ids.update((term.term, term.id) for term in created)
+        for term, weight in weights.items():
+            postings.append(SearchPosting(term_id=term_ids[term], paper_id=paper.pk, weight=weight))
+            doc_freq[term] += 1
+        documents.append(SearchDocument(paper_id=paper.pk, length=sum(weights.values()), signature=_signature(weights)))
+    SearchPosting.objects.bulk_create(postings, batch_size=5000)
+    SearchDocument.objects.bulk_create(documents, batch_size=1000)
+    SearchTerm.objects.bulk_update(
+        [SearchTerm(id=term_ids[term], term=term, doc_freq=count) for term, count in doc_freq.items()],
+        ["doc_freq"], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0004_paper_bookmarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('paper', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='papers.paper')),
+                ('length', models.FloatField(default=0)),
+                ('signature', models.CharField(blank=True, max_length=64)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, unique=True)),
+                ('doc_freq', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.FloatField()),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='papers.paper')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='papers.searchterm')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('term', 'paper'), name='unique_search_posting')],
+            },
+        ),
+        migrations.RunPython(index_papers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to='papers/blobs/')),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('thumbnail', models.ImageField(blank=True, null=True, upload_to='thumbnails/')),
+                ('ai_article', models.TextField(blank=True, null=True)),
+                ('ai_tags', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='papers', to='papers.pdfblob'),
+        ),
+    ]
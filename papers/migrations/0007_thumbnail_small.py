@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0006_pdf_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='thumbnail_small',
+            field=models.ImageField(blank=True, null=True, upload_to='thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='pdfblob',
+            name='thumbnail_small',
+            field=models.ImageField(blank=True, null=True, upload_to='thumbnails/'),
+        ),
+    ]
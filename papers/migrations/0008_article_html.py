@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:32
+
+from django.db import migrations, models
+
+
+def render_articles(apps, schema_editor):
+    # the same rendering Paper.render_article_html() does on save
+    from ai_processing.utils import markdown_fingerprint, markdown_to_html
+
+    Paper = apps.get_model("papers", "Paper")
+    batch = []
+    papers = Paper.objects.exclude(article_content=None).exclude(article_content="").only("pk", "article_content")
+    for paper in papers.order_by("pk").iterator(chunk_size=500):
+        paper.article_html = markdown_to_html(paper.article_content)
+        paper.article_html_hash = markdown_fingerprint(paper.article_content)
+        batch.append(paper)
+        if len(batch) >= 500:
+            Paper.objects.bulk_update(batch, ["article_html", "article_html_hash"])
+            batch = []
+    Paper.objects.bulk_update(batch, ["article_html", "article_html_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0007_thumbnail_small'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='article_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='article_html_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(render_articles, migrations.RunPython.noop),
+    ]
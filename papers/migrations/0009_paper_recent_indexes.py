@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0008_article_html'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='paper_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['uploader', '-uploaded_at', '-id'], name='paper_uploader_recent_idx'),
+        ),
+    ]
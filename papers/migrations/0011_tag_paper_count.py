@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_papers(apps, schema_editor):
+    Paper = apps.get_model("papers", "Paper")
+    Tag = apps.get_model("papers", "Tag")
+    papers = (
+        Paper.tags.through.objects.filter(tag_id=OuterRef("pk")).order_by().values("tag_id")
+        .annotate(n=Count("paper_id")).values("n")
+    )
+    Tag.objects.update(paper_count=Coalesce(Subquery(papers), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0010_feed_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='paper_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-paper_count', 'name'], name='tag_popularity_idx'),
+        ),
+        migrations.RunPython(count_papers, migrations.RunPython.noop),
+    ]
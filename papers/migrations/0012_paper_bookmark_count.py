@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:38
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_bookmarks(apps, schema_editor):
+    Paper = apps.get_model("papers", "Paper")
+    users = (
+        Paper.bookmarks.through.objects.filter(paper_id=OuterRef("pk")).order_by().values("paper_id")
+        .annotate(n=Count("user_id")).values("n")
+    )
+    Paper.objects.update(bookmark_count=Coalesce(Subquery(users), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0011_tag_paper_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='bookmark_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_bookmarks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def thread_existing_comments(apps, schema_editor):
+    """Existing comments are all top level; count them on their papers."""
+    Comment = apps.get_model("papers", "Comment")
+    Paper = apps.get_model("papers", "Paper")
+    for comment in Comment.objects.only("pk").iterator():
+        Comment.objects.filter(pk=comment.pk).update(path=f"{comment.pk:010d}/")
+    comments = (
+        Comment.objects.filter(paper_id=OuterRef("pk")).order_by().values("paper_id")
+        .annotate(n=Count("pk")).values("n")
+    )
+    Paper.objects.update(comment_count=Coalesce(Subquery(comments), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0012_paper_bookmark_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='papers.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['paper', 'parent', '-created_at', '-id'], name='comment_thread_page_idx'),
+        ),
+        migrations.RunPython(thread_existing_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0013_comment_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedPapers',
+            fields=[
+                ('paper', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='related', serialize=False, to='papers.paper')),
+                ('neighbours', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
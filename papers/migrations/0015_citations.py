@@ -0,0 +1,70 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_titles(apps, schema_editor):
+    # reference lists need the PDFs parsed; that is left to the rebuild_citations command
+    from papers.citations import CITATION_MIN_TITLE_CHARS
+    from papers.minhash import text_keys
+
+    Paper = apps.get_model("papers", "Paper")
+    TitleKey = apps.get_model("papers", "TitleKey")
+    keys = []
+    for paper_id, title in Paper.objects.values_list("pk", "title").iterator(chunk_size=2000):
+        grams, band_keys = text_keys(title)
+        if len(grams) >= CITATION_MIN_TITLE_CHARS:
+            keys.extend(TitleKey(paper_id=paper_id, key=key) for key in band_keys)
+    TitleKey.objects.bulk_create(keys, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0014_related_papers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='citation_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Reference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('text', models.TextField()),
+                ('title', models.CharField(max_length=300)),
+                ('score', models.FloatField(default=0)),
+                ('cited', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='citations', to='papers.paper')),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='papers.paper')),
+            ],
+            options={
+                'ordering': ['paper', 'position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReferenceKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('reference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='papers.reference')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TitleKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='papers.paper')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reference',
+            constraint=models.UniqueConstraint(fields=('paper', 'position'), name='unique_reference_position'),
+        ),
+        migrations.RunPython(index_titles, migrations.RunPython.noop),
+    ]
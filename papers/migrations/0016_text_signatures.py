@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0015_citations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('paper', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='papers.paper')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TextSignature',
+            fields=[
+                ('paper', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='text_signature', serialize=False, to='papers.paper')),
+                ('minhash', models.JSONField(default=list)),
+                ('similarity', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('duplicate_of', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='papers.paper')),
+            ],
+        ),
+    ]
@@ -0,0 +1,95 @@
+"""
+MinHash signatures and LSH band keys.
+
+Texts are normalised (lowercased, punctuation dropped) and cut into overlapping
+character n-grams (for short texts such as titles) or word shingles (for whole
+documents). A signature is the minimum of MINHASH_PERMUTATIONS seeded
+hash functions over those n-grams, so two signatures agree in a position with
+probability equal to the texts' Jaccard similarity. The signature is split into
+bands, and each band is hashed to one key. Texts that share any key are likely
+similar, so looking a text up is an indexed `key IN (...)` query instead of a
+scan of the corpus. Candidates are then checked with the exact Jaccard
+similarity of their n-gram sets, or estimated from the signatures.
+"""
+import hashlib
+import re
+
+import numpy as np
+
+MINHASH_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs at Jaccard 0.5 share a key about 64% of the time, at 0.7 about 99%.
+MINHASH_BANDS = 16
+NGRAM_SIZE = 3
+SHINGLE_WORDS = 5
+
+_PRIME = (1 << 31) - 1
+_random = np.random.RandomState(1)
+# the permutations must never change, or stored keys stop matching
+_A = _random.randint(1, _PRIME, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_B = _random.randint(0, _PRIME, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    """Lowercase words separated by single spaces."""
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    """The set of character n-grams of the normalised text, padded so short words still count."""
+    text = normalize(text)
+    if not text:
+        return set()
+    text = f" {text} "
+    return {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+
+
+def shingles(text, k=SHINGLE_WORDS):
+    """The set of k-word shingles of the normalised text."""
+    words = normalize(text).split()
+    if len(words) <= k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _hash(gram):
+    return int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=4).digest(), "little")
+
+
+def signature(grams):
+    """The MinHash signature (a uint64 array of MINHASH_PERMUTATIONS values) of a set of n-grams."""
+    if not grams:
+        return None
+    values = np.fromiter((_hash(gram) for gram in grams), dtype=np.uint64, count=len(grams)) % _PRIME
+    return ((_A[:, None] * values[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def similarity(a, b):
+    """The Jaccard similarity estimated from two signatures: the fraction of positions where they agree."""
+    if a is None or b is None:
+        return 0.0
+    return float(np.mean(np.asarray(a, dtype=np.uint64) == np.asarray(b, dtype=np.uint64)))
+
+
+def band_keys(sig, bands=MINHASH_BANDS):
+    """One signed 64-bit key per band of a signature (the band number is part of the key)."""
+    if sig is None:
+        return []
+    keys = []
+    for band, rows in enumerate(np.array_split(sig, bands)):
+        digest = hashlib.blake2b(rows.tobytes(), digest_size=8, person=band.to_bytes(2, "little")).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+def text_keys(text, n=NGRAM_SIZE):
+    """(n-gram set, band keys) for a text."""
+    grams = ngrams(text, n)
+    return grams, band_keys(signature(grams))
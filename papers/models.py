@@ -1,8 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
 import os
-from ai_processing.utils import markdown_to_html
-from django.db.models.signals import post_save
+import uuid
+from ai_processing.utils import markdown_to_html, markdown_fingerprint
+from django.utils.safestring import mark_safe
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 
 class Author(models.Model):
@@ -20,50 +22,452 @@ class Author(models.Model):
 class Tag(models.Model):
     """Represents a tag or keyword for organizing papers."""
     name = models.CharField(max_length=100, unique=True)
+    # Number of papers with this tag, maintained by the receivers below (see tag_cloud.py)
+    paper_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["-paper_count", "name"], name="tag_popularity_idx")]
 
     def __str__(self):
         return self.name
 
 
+class PdfBlob(models.Model):
+    """
+    A PDF stored once under the SHA-256 of its bytes and shared by every Paper
+    that uploads the same file. Artifacts derived from the bytes (thumbnail,
+    AI article and tags) live here too so duplicate uploads can reuse them.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='papers/blobs/')
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    thumbnail = models.ImageField(upload_to='thumbnails/', null=True, blank=True)
+    thumbnail_small = models.ImageField(upload_to='thumbnails/', null=True, blank=True)
+    ai_article = models.TextField(blank=True, null=True)
+    ai_tags = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.content_hash[:12]} ({self.ref_count} papers)'
+
+
+class UploadSession(models.Model):
+    """
+    A chunked, resumable PDF upload in progress (see uploads.py). The bytes
+    received so far are appended to a temporary file named after the session.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    # the size the client announced; no more than this is accepted
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    # SHA-256 of each chunk, in order
+    chunk_hashes = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    def __str__(self):
+        return f'{self.filename}: {self.received}/{self.size} bytes'
+
+
 class Paper(models.Model):
     """Represents a single research paper/document."""
     # foreign key -> create many-to-one relationship. for eg. many paper objects can have the same user
     uploader = models.ForeignKey(User, on_delete=models.CASCADE, related_name="uploaded_papers")
     title = models.CharField(max_length=300)
     article_content = models.TextField(blank=True, null=True)
+    # article_content rendered to HTML on write, with the fingerprint it was rendered from
+    article_html = models.TextField(blank=True, default="")
+    article_html_hash = models.CharField(max_length=64, blank=True, default="")
     authors = models.ManyToManyField(Author, blank=True)
     publication_year = models.IntegerField(null=True, blank=True)
     tags = models.ManyToManyField(Tag, blank=True)
     pdf_file = models.FileField(upload_to='papers/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # thumbnails are rendered in the background (papers.tasks) and shared through the blob
     thumbnail = models.ImageField(upload_to='thumbnails/', null=True, blank=True)
+    thumbnail_small = models.ImageField(upload_to='thumbnails/', null=True, blank=True)
     bookmarks = models.ManyToManyField(User, related_name='bookmarked_papers', blank=True)
+    # Number of users who bookmarked the paper (see bookmarks.py)
+    bookmark_count = models.PositiveIntegerField(default=0)
+    # Number of comments and replies, maintained by the receivers below
+    comment_count = models.PositiveIntegerField(default=0)
+    # Number of references (on CiteRight) that resolve to this paper, maintained by citations.py
+    citation_count = models.PositiveIntegerField(default=0)
+    blob = models.ForeignKey(PdfBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='papers')
+
+    class Meta:
+        indexes = [
+            # keyset pagination (papers.pagination): newest first, id breaks ties
+            models.Index(fields=['-uploaded_at', '-id'], name='paper_recent_idx'),
+            models.Index(fields=['uploader', '-uploaded_at', '-id'], name='paper_uploader_recent_idx'),
+        ]
     
     @property
     def article_content_html(self):
-        return markdown_to_html(self.article_content)
+        if not self.article_html and self.article_content:
+            # not rendered yet, e.g. written with .update(); render it for this request
+            return mark_safe(markdown_to_html(self.article_content))
+        return mark_safe(self.article_html)
+
+    def render_article_html(self):
+        """Re-renders article_html if article_content changed since the last render; returns True if it did."""
+        fingerprint = markdown_fingerprint(self.article_content)
+        if fingerprint == self.article_html_hash:
+            return False
+        self.article_html = markdown_to_html(self.article_content)
+        self.article_html_hash = fingerprint
+        return True
 
     def __str__(self): return self.title
     
     def filename(self):
         return os.path.basename(self.pdf_file.name)
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'article_content' in update_fields:
+            if self.render_article_html() and update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'article_html', 'article_html_hash'}
+        super().save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
-        self.pdf_file.delete(save=False)
-        if self.thumbnail: self.thumbnail.delete(save=False)
+        # Papers backed by a shared blob release it in the post_delete handler below;
+        # older papers own their files outright.
+        if not self.blob_id:
+            self.pdf_file.delete(save=False)
+            if self.thumbnail: self.thumbnail.delete(save=False)
+            if self.thumbnail_small: self.thumbnail_small.delete(save=False)
         super().delete(*args, **kwargs)
 
     
 class Comment(models.Model):
-    """Represents a public comment on a specific paper."""
+    """
+    Represents a public comment on a specific paper. Replies point at their parent;
+    `path` is the chain of ancestor ids (a materialized path), so a whole thread is
+    one prefix query ordered by path (see comments.py).
+    """
     paper = models.ForeignKey(Paper, related_name='comments', on_delete=models.CASCADE)
     # NEW: Link to the user who wrote the comment
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    parent = models.ForeignKey('self', related_name='replies', on_delete=models.CASCADE, null=True, blank=True)
+    path = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0)
+
+    # Replies nest at most this deep
+    MAX_DEPTH = 5
 
     class Meta:
         ordering = ['-created_at'] # Show newest comments first
+        indexes = [
+            models.Index(fields=['paper', 'parent', '-created_at', '-id'], name='comment_thread_page_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.path:
+            # the path ends with our own id, so it can only be set once we have one
+            prefix = self.parent.path if self.parent_id else ''
+            self.path = f'{prefix}{self.pk:010d}/'
+            self.depth = self.parent.depth + 1 if self.parent_id else 0
+            Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
+    @property
+    def can_reply(self):
+        return self.depth < self.MAX_DEPTH
 
     def __str__(self): return f'Comment by {self.user.username} on "{self.paper.title}"'
 
+
+
+class FeedEntry(models.Model):
+    """
+    One paper in a user's materialized "following" timeline (see papers.feed).
+    uploaded_at and uploader are copied from the paper so a timeline page is a
+    single range scan on feed_timeline_idx and unfollowing can trim by uploader.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='+')
+    uploader = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    uploaded_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'paper'], name='unique_feed_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-uploaded_at', '-paper'], name='feed_timeline_idx'),
+            models.Index(fields=['user', 'uploader'], name='feed_user_uploader_idx'),
+        ]
+
+
+class RelatedPapers(models.Model):
+    """A paper's nearest neighbours by TF-IDF cosine similarity, precomputed by related.py."""
+    paper = models.OneToOneField(Paper, on_delete=models.CASCADE, primary_key=True, related_name='related')
+    # [[paper_id, score], ...], most similar first
+    neighbours = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Papers related to {self.paper_id}'
+
+
+class Reference(models.Model):
+    """
+    One entry of a paper's reference list, parsed from its PDF. `cited` is the
+    paper on CiteRight it refers to, once one with a matching title exists (see citations.py).
+    """
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='references')
+    position = models.PositiveSmallIntegerField()
+    text = models.TextField()
+    title = models.CharField(max_length=300)
+    cited = models.ForeignKey(Paper, on_delete=models.SET_NULL, null=True, blank=True, related_name='citations')
+    # Jaccard similarity of the title's n-grams and the cited paper's
+    score = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['paper', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['paper', 'position'], name='unique_reference_position'),
+        ]
+
+    def __str__(self): return f'Reference {self.position} of paper {self.paper_id}'
+
+
+class TitleKey(models.Model):
+    """An LSH band key of a paper title's MinHash signature (see minhash.py)."""
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='+')
+    key = models.BigIntegerField(db_index=True)
+
+
+class ReferenceKey(models.Model):
+    """An LSH band key of an unresolved reference's title; deleted once the reference resolves."""
+    reference = models.ForeignKey(Reference, on_delete=models.CASCADE, related_name='+')
+    key = models.BigIntegerField(db_index=True)
+
+
+class TextSignature(models.Model):
+    """
+    The MinHash signature of a paper's extracted text (see duplicates.py). `duplicate_of`
+    is the earliest paper whose text this one nearly duplicates, if any.
+    """
+    paper = models.OneToOneField(Paper, on_delete=models.CASCADE, primary_key=True, related_name='text_signature')
+    minhash = models.JSONField(default=list)
+    duplicate_of = models.ForeignKey(
+        Paper, on_delete=models.SET_NULL, null=True, blank=True, related_name='near_duplicates'
+    )
+    # estimated Jaccard similarity of the two texts' shingles
+    similarity = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Text signature of paper {self.paper_id}'
+
+
+class TextKey(models.Model):
+    """An LSH band key of a paper's text signature."""
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='+')
+    key = models.BigIntegerField(db_index=True)
+
+
+class SearchTerm(models.Model):
+    """A term in the full-text search vocabulary with its document frequency."""
+    term = models.CharField(max_length=64, unique=True)
+    doc_freq = models.PositiveIntegerField(default=0)
+
+    def __str__(self): return self.term
+
+
+class SearchDocument(models.Model):
+    """Per-paper statistics used by the BM25 ranker."""
+    paper = models.OneToOneField(Paper, on_delete=models.CASCADE, primary_key=True, related_name="search_document")
+    length = models.FloatField(default=0)
+    # hash of the indexed term weights, lets us skip re-indexing unchanged papers
+    signature = models.CharField(max_length=64, blank=True)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+
+class SearchPosting(models.Model):
+    """One entry of the inverted index: how strongly a term occurs in a paper."""
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name="postings")
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name="search_postings")
+    # field-weighted term frequency (title and tags count more than body text)
+    weight = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["term", "paper"], name="unique_search_posting"),
+        ]
+
+
+"""
+Keep the search index in sync with papers. Re-indexing is deferred until the
+surrounding transaction commits so that a paper saved and then tagged inside
+one request is only read once it is complete.
+"""
+@receiver(post_save, sender=Paper)
+def reindex_saved_paper(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .search import schedule_reindex
+    schedule_reindex(instance.pk)
+
+@receiver(post_save, sender=Paper)
+def fan_out_new_paper(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        from .feed import schedule_fan_out
+        schedule_fan_out(instance)
+
+@receiver(m2m_changed, sender=Paper.tags.through)
+@receiver(m2m_changed, sender=Paper.authors.through)
+def reindex_paper_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    from .search import schedule_reindex
+    if not reverse:
+        schedule_reindex(instance.pk)
+    else:
+        # e.g. tag.paper_set.add(...): the affected papers are in pk_set
+        for paper_id in pk_set or ():
+            schedule_reindex(paper_id)
+
+"""
+Keep Tag.paper_count and Paper.bookmark_count in step with their join tables.
+Additions are counted exactly (pk_set only holds the new rows); removals
+recount the affected rows since pk_set may name ones that were never linked.
+"""
+@receiver(m2m_changed, sender=Paper.tags.through)
+def count_tagged_papers(sender, instance, action, reverse, pk_set, **kwargs):
+    from . import tag_cloud
+    if action == "pre_clear" and not reverse:
+        instance._cleared_tag_ids = list(instance.tags.values_list("id", flat=True))
+    elif action == "post_add" and pk_set:
+        if reverse:
+            tag_cloud.add_papers([instance.pk], len(pk_set))
+        else:
+            tag_cloud.add_papers(pk_set)
+    elif action in ("post_remove", "post_clear"):
+        if reverse:
+            tag_cloud.recount([instance.pk])
+        elif action == "post_remove":
+            tag_cloud.recount(pk_set)
+        else:
+            tag_cloud.recount(getattr(instance, "_cleared_tag_ids", []))
+
+@receiver(m2m_changed, sender=Paper.bookmarks.through)
+def count_bookmarks(sender, instance, action, reverse, pk_set, **kwargs):
+    from profiles import counters
+    from . import bookmarks
+    if action == "pre_clear":
+        related = instance.bookmarked_papers if reverse else instance.bookmarks
+        instance._cleared_bookmark_ids = list(related.values_list("id", flat=True))
+    elif action == "post_add" and pk_set:
+        if reverse:
+            bookmarks.add_bookmarks(pk_set)
+            counters.adjust([instance.pk], "bookmark_count", len(pk_set))
+        else:
+            bookmarks.add_bookmarks([instance.pk], len(pk_set))
+            counters.adjust(pk_set, "bookmark_count", 1)
+    elif action in ("post_remove", "post_clear"):
+        others = pk_set if action == "post_remove" else getattr(instance, "_cleared_bookmark_ids", [])
+        if reverse:
+            counters.recount([instance.pk])
+            bookmarks.recount(others)
+        else:
+            bookmarks.recount([instance.pk])
+            counters.recount(others)
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Paper.objects.filter(pk=instance.paper_id).update(comment_count=models.F('comment_count') + 1)
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, origin=None, **kwargs):
+    # comments deleted along with their paper have nothing left to update
+    if isinstance(origin, Paper):
+        return
+    Paper.objects.filter(pk=instance.paper_id).update(comment_count=models.F('comment_count') - 1)
+
+@receiver(post_save, sender=Paper)
+def count_uploaded_paper(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        from profiles.counters import adjust
+        adjust([instance.uploader_id], "paper_count", 1)
+
+@receiver(pre_delete, sender=Paper)
+def uncount_deleted_paper(sender, instance, **kwargs):
+    from profiles.counters import adjust
+    from .tag_cloud import remove_paper
+    remove_paper(instance)
+    adjust([instance.uploader_id], "paper_count", -1)
+    # the paper's bookmark rows go with it, without m2m_changed
+    adjust(instance.bookmarks.values_list("id", flat=True), "bookmark_count", -1)
+
+@receiver(pre_delete, sender=Paper)
+def unindex_deleted_paper(sender, instance, **kwargs):
+    from .search import remove_paper
+    remove_paper(instance.pk)
+
+"""
+The citation graph (see citations.py): new titles are indexed so waiting references
+can link to them, and a deleted paper leaves the counts and references it touched.
+"""
+@receiver(post_save, sender=Paper)
+def index_new_paper_title(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        from .citations import schedule_index_title
+        schedule_index_title(instance.pk)
+
+@receiver(pre_delete, sender=Paper)
+def release_deleted_paper_citations(sender, instance, **kwargs):
+    from .citations import release_paper
+    release_paper(instance)
+
+@receiver(post_delete, sender=Paper)
+def remove_paper_from_feeds(sender, instance, **kwargs):
+    from .feed import get_backend
+    get_backend().remove_paper(instance.pk)
+
+@receiver(post_delete, sender=Paper)
+def release_paper_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        from .storage import release_blob
+        release_blob(instance.blob_id)
+
+"""
+Typeahead indexes are updated with the names that change (see typeahead.py).
+Logins only touch last_login, so they leave the user index alone.
+"""
+@receiver(post_save, sender=User)
+def invalidate_user_typeahead(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    from .typeahead import invalidate
+    invalidate("users", [(instance.pk, instance.username if instance.is_active else None)])
+
+@receiver(post_save, sender=Author)
+def invalidate_author_typeahead(sender, instance, **kwargs):
+    from .typeahead import invalidate
+    # authors with an account are found as users
+    invalidate("authors", [(instance.pk, instance.name if instance.user_id is None else None)])
+
+@receiver(post_save, sender=Tag)
+def invalidate_tag_typeahead(sender, instance, **kwargs):
+    from .typeahead import invalidate
+    invalidate("tags", [(instance.pk, instance.name)])
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Tag)
+def drop_deleted_from_typeahead(sender, instance, **kwargs):
+    from .typeahead import invalidate
+    invalidate({User: "users", Author: "authors", Tag: "tags"}[sender], [(instance.pk, None)])
@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination for paper listings (and comment threads).
+
+Pages are ordered newest first by (uploaded_at, id) and the cursor encodes the
+last row of the previous page, so fetching page N costs the same as page 1
+(an index range scan on paper_recent_idx) instead of an OFFSET over N pages.
+"""
+import base64
+from collections import namedtuple
+from datetime import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 20
+
+# Renders one page of paper cards (plus the "load more" link) for infinite scroll.
+PAGE_FRAGMENT_TEMPLATE = "papers/partials/_paper_page.html"
+
+# A page of results plus the URL of the next page (None on the last page).
+Page = namedtuple("Page", ["items", "next_url"])
+
+
+def paper_cards(queryset):
+    """Loads what a paper card renders (uploader, authors, tags) in a fixed number of queries."""
+    return queryset.select_related("uploader").prefetch_related("authors", "tags").defer("article_html")
+
+
+def encode_cursor(obj, field="uploaded_at"):
+    raw = f"{getattr(obj, field).isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (timestamp, id) from a cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        uploaded_at, pk = raw.split("|")
+        return datetime.fromisoformat(uploaded_at), int(pk)
+    except ValueError:
+        return None
+
+
+def page_url(request, cursor):
+    """The current URL with `cursor` swapped in (and any fragment flag dropped)."""
+    query = request.GET.copy()
+    query["cursor"] = cursor
+    query.pop("partial", None)
+    return f"?{query.urlencode()}"
+
+
+def paginate(request, queryset, per_page=PAGE_SIZE, field="uploaded_at"):
+    """
+    Returns the Page of `queryset` (newest first by `field`, then id) after the cursor
+    in request.GET.
+    """
+    queryset = queryset.order_by(f"-{field}", "-id")
+    position = decode_cursor(request.GET.get("cursor"))
+    if position is not None:
+        timestamp, pk = position
+        queryset = queryset.filter(Q(**{f"{field}__lt": timestamp}) | Q(**{field: timestamp, "id__lt": pk}))
+
+    items = list(queryset[:per_page + 1])
+    if len(items) > per_page:
+        items = items[:per_page]
+        return Page(items, page_url(request, encode_cursor(items[-1], field)))
+    return Page(items, None)
+
+
+def offset_page(request, items, total, offset, per_page=PAGE_SIZE):
+    """A Page for ranked results (search), where the cursor is simply the next offset."""
+    next_offset = offset + per_page
+    return Page(items, page_url(request, str(next_offset)) if next_offset < total else None)
+
+
+def request_offset(request):
+    """The offset cursor of a ranked listing."""
+    try:
+        return max(int(request.GET.get("cursor", 0)), 0)
+    except ValueError:
+        return 0
+
+
+def is_fragment_request(request):
+    """True when infinite scroll asks for just the next page of cards."""
+    return request.GET.get("partial") == "1"
+
+
+def is_script_request(request):
+    """True for fetch()/XHR requests that want a fragment or JSON rather than a redirect."""
+    return request.headers.get("X-Requested-With") == "XMLHttpRequest"
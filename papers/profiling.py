@@ -0,0 +1,200 @@
+"""
+Per-request query profiling and per-view query budgets.
+
+QueryProfilingMiddleware is opt-in: add "papers.profiling.QueryProfilingMiddleware"
+to MIDDLEWARE. For a profiled request it records the SQL count and time, the
+repeated query shapes (the same SQL run again and again is usually an N+1), the
+template render time and the total latency.
+- PROFILING_HEADERS (default: DEBUG): every request is profiled and the numbers
+  go into Server-Timing and X-Query-* response headers.
+- PROFILING_SAMPLE_RATE (default 0): that fraction of requests is profiled and
+  logged as one JSON line on the "papers.profiling" logger, which suits
+  production.
+
+@query_budget(n) declares how many queries a view may run (middleware queries
+such as the session lookup aren't counted). QUERY_BUDGET_MODE chooses what
+happens when a view runs more:
+- "raise": raise QueryBudgetExceeded (for tests and benchmarks)
+- "warn": log a warning (the default with DEBUG)
+- "off": nothing is counted (the default otherwise)
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+# A query shape repeated this many times in one request is reported as a likely N+1.
+PROFILING_DUPLICATE_THRESHOLD = getattr(settings, "PROFILING_DUPLICATE_THRESHOLD", 3)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised (with QUERY_BUDGET_MODE = "raise") when a view runs more queries than its budget."""
+
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\((?:%s, )+%s\)")
+
+
+def fingerprint(sql):
+    """The shape of a query: parameters are already placeholders, and IN lists of any length look alike."""
+    return _PLACEHOLDER_LIST.sub("(...)", _WHITESPACE.sub(" ", sql).strip())
+
+
+class QueryRecorder:
+    """A database execute wrapper that counts, times and fingerprints queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold=PROFILING_DUPLICATE_THRESHOLD):
+        """[(fingerprint, times run), ...] for query shapes run at least `threshold` times, most repeated first."""
+        return [(sql, n) for sql, n in self.fingerprints.most_common() if n >= threshold]
+
+
+@contextmanager
+def record_queries(recorder):
+    """Sends the queries run on every database connection inside the block through `recorder`."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+
+_local = threading.local()
+_template_timer_installed = False
+
+
+def _install_template_timer():
+    """Wraps Template.render to add top-level render time to the current thread's profile, if any."""
+    global _template_timer_installed
+    if _template_timer_installed:
+        return
+    original = Template.render
+
+    def render(self, context):
+        profile = getattr(_local, "profile", None)
+        if profile is None or profile.rendering:
+            # not profiling, or an {% include %} inside a template already being timed
+            return original(self, context)
+        profile.rendering = True
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            profile.template_time += time.perf_counter() - started
+            profile.rendering = False
+
+    Template.render = render
+    _template_timer_installed = True
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = QueryRecorder()
+        self.template_time = 0.0
+        self.rendering = False
+        self.started = time.perf_counter()
+        self.total_time = None
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def summary(self, request, response):
+        match = getattr(request, "resolver_match", None)
+        return {
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else None,
+            "status": response.status_code,
+            "total_ms": round(self.total_time * 1000, 2),
+            "sql_ms": round(self.queries.duration * 1000, 2),
+            "template_ms": round(self.template_time * 1000, 2),
+            "queries": self.queries.count,
+            "duplicates": [{"sql": sql[:300], "count": n} for sql, n in self.queries.duplicates()],
+        }
+
+
+class QueryProfilingMiddleware:
+    """Profiles requests (see the module docstring); put it first in MIDDLEWARE to include the others' queries."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _install_template_timer()
+
+    def __call__(self, request):
+        headers = getattr(settings, "PROFILING_HEADERS", settings.DEBUG)
+        sampled = random.random() < getattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+        if not headers and not sampled:
+            return self.get_response(request)
+
+        profile = _local.profile = RequestProfile()
+        try:
+            with record_queries(profile.queries):
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+            profile.finish()
+
+        summary = profile.summary(request, response)
+        if headers:
+            response["Server-Timing"] = (
+                f'sql;dur={summary["sql_ms"]};desc="{summary["queries"]} queries", '
+                f'tpl;dur={summary["template_ms"]}, total;dur={summary["total_ms"]}'
+            )
+            response["X-Query-Count"] = summary["queries"]
+            response["X-Query-Duplicates"] = sum(duplicate["count"] for duplicate in summary["duplicates"])
+        if sampled:
+            logger.info(json.dumps(summary, sort_keys=True), extra={"profile": summary})
+        if summary["duplicates"]:
+            logger.warning(
+                "Possible N+1 in %s: %s", summary["view"] or summary["path"],
+                "; ".join(f'{duplicate["count"]}x {duplicate["sql"][:120]}' for duplicate in summary["duplicates"]),
+            )
+        return response
+
+
+def query_budget(limit):
+    """Declares that a view runs at most `limit` queries; see QUERY_BUDGET_MODE above."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            mode = getattr(settings, "QUERY_BUDGET_MODE", "warn" if settings.DEBUG else "off")
+            if mode == "off":
+                return view(request, *args, **kwargs)
+            with record_queries(QueryRecorder()) as recorder:
+                response = view(request, *args, **kwargs)
+            if recorder.count > limit:
+                repeated = recorder.duplicates()
+                message = f"{view.__module__}.{view.__name__} ran {recorder.count} queries (budget {limit})" + (
+                    f"; most repeated ({repeated[0][1]}x): {repeated[0][0][:200]}" if repeated else ""
+                )
+                if mode == "raise":
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return response
+
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
@@ -0,0 +1,301 @@
+"""
+"Related papers": precomputed nearest neighbours by TF-IDF cosine similarity.
+
+A full build fits a TfidfVectorizer over every paper's title, tags, article and
+extracted PDF text. It then finds each paper's RELATED_K most similar papers by
+multiplying batches of rows against the whole (L2-normalised, sparse) matrix,
+and stores the lists in RelatedPapers rows, so paper_detail reads one row.
+
+The fitted vectorizer and matrix are pickled to RELATED_INDEX_PATH. New papers
+are folded in without refitting. They are transformed with the existing
+vocabulary, matched against the matrix, and appended to a small delta file
+next to the index until the next full build (rebuild_related, or the periodic
+rebuild_related_task) absorbs them.
+
+Writers serialize on an flock() of `{RELATED_INDEX_PATH}.lock`, so two workers
+folding papers in can't interleave their appends to the delta file, and a
+rebuild can't swap the files out under a fold-in. The files (and the lock) are
+only shared by processes that see the same RELATED_INDEX_PATH: put it on a
+filesystem every worker host mounts, or route fold_in_related_task and
+rebuild_related_task to a queue that only one host consumes.
+"""
+import fcntl
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from ai_processing.models import ExtractedText
+from .models import Paper, RelatedPapers
+from .pagination import paper_cards
+
+RELATED_K = getattr(settings, "RELATED_K", 10)
+RELATED_MAX_FEATURES = getattr(settings, "RELATED_MAX_FEATURES", 50000)
+# Characters of extracted PDF text that go into a paper's document.
+RELATED_TEXT_CHARS = getattr(settings, "RELATED_TEXT_CHARS", 20000)
+# must be on storage shared by every worker host that runs the related-papers tasks (see above)
+RELATED_INDEX_PATH = getattr(
+    settings, "RELATED_INDEX_PATH", os.path.join(getattr(settings, "BASE_DIR", "."), "var", "related_index.pkl")
+)
+# Rows multiplied against the corpus at a time; bounds memory at batch x corpus floats.
+SIMILARITY_BATCH_SIZE = 256
+
+
+def fit_vectors(documents, max_features=RELATED_MAX_FEATURES):
+    """Fits a vectorizer to `documents`; returns (vectorizer, L2-normalised CSR matrix)."""
+    vectorizer = TfidfVectorizer(
+        max_features=max_features, stop_words="english", sublinear_tf=True,
+        min_df=2 if len(documents) > 50 else 1, max_df=0.5 if len(documents) > 50 else 1.0,
+        dtype=np.float32,
+    )
+    return vectorizer, vectorizer.fit_transform(documents).tocsr()
+
+
+def top_k(queries, corpus, k=RELATED_K, exclude=None):
+    """
+    For each row of `queries`, the k most cosine-similar rows of `corpus`, as a
+    list of [(column, score), ...] with zero scores dropped. `exclude[i]` is a
+    corpus row to skip for query i (the query itself), or -1.
+    """
+    corpus_t = corpus.T.tocsr()
+    results = []
+    for start in range(0, queries.shape[0], SIMILARITY_BATCH_SIZE):
+        scores = (queries[start:start + SIMILARITY_BATCH_SIZE] @ corpus_t).toarray()
+        if exclude is not None:
+            rows = np.arange(scores.shape[0])
+            columns = np.asarray(exclude[start:start + SIMILARITY_BATCH_SIZE])
+            valid = columns >= 0
+            scores[rows[valid], columns[valid]] = 0
+        n = min(k, scores.shape[1])
+        if n == 0:
+            results.extend([] for _ in range(scores.shape[0]))
+            continue
+        best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        for columns, values in zip(np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)):
+            results.append([(int(c), float(v)) for c, v in zip(columns, values) if v > 0])
+    return results
+
+
+def paper_documents(papers):
+    """{paper_id: text} for the given papers (which need title, article_content and blob loaded)."""
+    hashes = {paper.blob.content_hash for paper in papers if paper.blob_id}
+    extracted = {text.content_hash: text for text in ExtractedText.objects.filter(content_hash__in=hashes)}
+    tags = {}
+    for paper_id, name in Paper.tags.through.objects.filter(paper__in=papers).values_list("paper_id", "tag__name"):
+        tags.setdefault(paper_id, []).append(name)
+
+    documents = {}
+    for paper in papers:
+        text = extracted.get(paper.blob.content_hash) if paper.blob_id else None
+        documents[paper.pk] = "\n".join([
+            # the title and tags are short, so count them twice
+            paper.title, paper.title, " ".join(tags.get(paper.pk, []) * 2),
+            paper.article_content or "", text.text(RELATED_TEXT_CHARS) if text else "",
+        ])
+    return documents
+
+
+def _papers():
+    return Paper.objects.select_related("blob").only("id", "title", "article_content", "blob__content_hash")
+
+
+def _store(neighbours):
+    """Writes {paper_id: [(paper_id, score), ...]} to RelatedPapers."""
+    rows = [
+        RelatedPapers(paper_id=paper_id, neighbours=[[other, round(score, 4)] for other, score in pairs])
+        for paper_id, pairs in neighbours.items()
+    ]
+    RelatedPapers.objects.bulk_create(
+        rows, batch_size=1000, update_conflicts=True, unique_fields=["paper"], update_fields=["neighbours", "updated_at"]
+    )
+
+
+class RelatedIndex:
+    """The fitted vectorizer, the corpus matrix and the paper id of each matrix row."""
+
+    def __init__(self, vectorizer, matrix, paper_ids):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.paper_ids = list(paper_ids)
+
+    @classmethod
+    def build(cls, chunk_size=2000):
+        documents = {}
+        papers = _papers().order_by("pk")
+        chunk = []
+        for paper in papers.iterator(chunk_size=chunk_size):
+            chunk.append(paper)
+            if len(chunk) >= chunk_size:
+                documents.update(paper_documents(chunk))
+                chunk = []
+        documents.update(paper_documents(chunk))
+        if not documents:
+            return None
+        vectorizer, matrix = fit_vectors(list(documents.values()))
+        return cls(vectorizer, matrix, documents.keys())
+
+    def neighbours(self, k=RELATED_K):
+        """{paper_id: [(paper_id, score), ...]} for every paper in the index."""
+        results = top_k(self.matrix, self.matrix, k, exclude=np.arange(self.matrix.shape[0]))
+        return {
+            paper_id: [(self.paper_ids[column], score) for column, score in pairs]
+            for paper_id, pairs in zip(self.paper_ids, results)
+        }
+
+    def append(self, paper_id, vector):
+        self.matrix = sparse.vstack([self.matrix, vector], format="csr")
+        self.paper_ids.append(paper_id)
+
+    def save(self, path=RELATED_INDEX_PATH):
+        """Writes the index, keeping only folded-in papers it doesn't already contain."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump((self.vectorizer, self.matrix, self.paper_ids), f, protocol=pickle.HIGHEST_PROTOCOL)
+        known = set(self.paper_ids)
+        pending = [(paper_id, vector) for paper_id, vector in _read_delta(path) if paper_id not in known]
+        os.replace(temporary, path)
+        with open(f"{path}.delta", "wb") as f:
+            for entry in pending:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path=RELATED_INDEX_PATH):
+        """The saved index with any folded-in papers appended, or None if there is none."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            index = cls(*pickle.load(f))
+        pending = [(paper_id, vector) for paper_id, vector in _read_delta(path) if paper_id not in set(index.paper_ids)]
+        if pending:
+            index.matrix = sparse.vstack([index.matrix] + [vector for paper_id, vector in pending], format="csr")
+            index.paper_ids += [paper_id for paper_id, vector in pending]
+        return index
+
+
+@contextmanager
+def _locked(path, blocking=True):
+    """
+    Holds the index's file lock. Without `blocking`, raises RuntimeError at once if
+    another process (or thread) holds it.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            raise RuntimeError("Another related-papers update is running.")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_delta(path):
+    """The (paper_id, vector) pairs folded in since the index at `path` was built."""
+    if not os.path.exists(f"{path}.delta"):
+        return
+    with open(f"{path}.delta", "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+_loaded = threading.local()
+
+
+def _file_stamps(path):
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in (path, f"{path}.delta"))
+
+
+def _current_index(path=RELATED_INDEX_PATH):
+    """The index from disk, reloaded in this thread when the files change."""
+    stamps = _file_stamps(path)
+    if getattr(_loaded, "stamps", None) != stamps:
+        _loaded.index = RelatedIndex.load(path)
+        _loaded.stamps = stamps
+    return _loaded.index
+
+
+def rebuild(k=RELATED_K, path=RELATED_INDEX_PATH):
+    """Refits the whole corpus and replaces every neighbour list. Returns the number of papers."""
+    index = RelatedIndex.build()
+    if index is None:
+        return 0
+    neighbours = index.neighbours(k)
+    indexed = set(index.paper_ids)
+    with transaction.atomic():
+        _store(neighbours)
+        # an `exclude(paper_id__in=<every paper>)` would bind one parameter per paper
+        stale = [
+            paper_id for paper_id in RelatedPapers.objects.values_list("paper_id", flat=True).iterator(chunk_size=5000)
+            if paper_id not in indexed
+        ]
+        for start in range(0, len(stale), 500):
+            RelatedPapers.objects.filter(paper_id__in=stale[start:start + 500]).delete()
+    with _locked(path):
+        index.save(path)
+    return len(index.paper_ids)
+
+
+def fold_in(paper_id, k=RELATED_K, path=RELATED_INDEX_PATH):
+    """
+    Adds one paper to the index without refitting: computes its neighbours, and
+    offers it to those neighbours' lists. Returns False if there is no index yet.
+    """
+    with _locked(path, blocking=False):
+        index = _current_index(path)
+        paper = _papers().filter(pk=paper_id).first()
+        if index is None or paper is None:
+            return False
+        vector = index.vectorizer.transform([paper_documents([paper])[paper.pk]]).tocsr()
+        if paper_id in index.paper_ids:
+            exclude = [index.paper_ids.index(paper_id)]
+        else:
+            exclude = [-1]
+        pairs = [(index.paper_ids[column], score) for column, score in top_k(vector, index.matrix, k, exclude)[0]]
+
+        with transaction.atomic():
+            _store({paper_id: pairs})
+            others = {row.paper_id: row for row in RelatedPapers.objects.select_for_update().filter(
+                paper_id__in=[other for other, score in pairs]
+            )}
+            changed = []
+            for other, score in pairs:
+                row = others.get(other)
+                if row is None:
+                    continue
+                merged = [pair for pair in row.neighbours if pair[0] != paper_id] + [[paper_id, round(score, 4)]]
+                merged.sort(key=lambda pair: -pair[1])
+                if merged[:k] != row.neighbours:
+                    row.neighbours = merged[:k]
+                    changed.append(row)
+            RelatedPapers.objects.bulk_update(changed, ["neighbours"])
+
+        if paper_id not in index.paper_ids:
+            with open(f"{path}.delta", "ab") as f:
+                pickle.dump((paper_id, vector), f, protocol=pickle.HIGHEST_PROTOCOL)
+            # keep this thread's copy current instead of reloading it from disk
+            index.append(paper_id, vector)
+            _loaded.stamps = _file_stamps(path)
+        return True
+
+
+def related_papers(paper, limit=5):
+    """The papers most similar to `paper`, most similar first, ready to render as cards."""
+    row = RelatedPapers.objects.filter(paper_id=paper.pk).values_list("neighbours", flat=True).first()
+    if not row:
+        return []
+    ids = [paper_id for paper_id, score in row[:limit * 2]]
+    by_id = paper_cards(Paper.objects.all()).in_bulk(ids)
+    return [by_id[pk] for pk in ids if pk in by_id][:limit]
@@ -0,0 +1,247 @@
+"""
+Full-text search over papers.
+
+Papers are tokenized into an inverted index (SearchTerm -> SearchPosting) that
+covers the title, author names, tag names, the uploader's username and the
+article content. Queries only read the postings of their own terms, so the cost
+of a search depends on how common the query terms are rather than on the size
+of the corpus. Hits are ranked with BM25.
+"""
+import hashlib
+import heapq
+import math
+import re
+from collections import Counter, namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, F
+
+from .models import Paper, SearchDocument, SearchPosting, SearchTerm
+
+# How much a single occurrence of a term in each field counts towards its weight.
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "authors": 2.0,
+    "tags": 2.0,
+    "uploader": 1.0,
+    "content": 1.0,
+}
+
+# BM25 tuning parameters (the usual defaults).
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAX_TERM_LENGTH = 64
+# The last query word is treated as a prefix ("econ" -> "economics", ...),
+# expanded to at most this many of the most common matching terms.
+MAX_PREFIX_EXPANSIONS = 20
+
+STATS_CACHE_KEY = "papers:search:collection_stats"
+STATS_CACHE_TIMEOUT = 300
+
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have in is it its of on or that
+    the their this to was were which with we our these those not can also such
+""".split())
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+SearchHit = namedtuple("SearchHit", ["paper_id", "score"])
+SearchResults = namedtuple("SearchResults", ["hits", "total"])
+
+
+def tokenize(text):
+    """Split text into lowercase index terms, dropping stop words and noise."""
+    if not text:
+        return []
+    return [
+        token for token in _TOKEN_RE.findall(text.casefold())
+        if 1 < len(token) <= MAX_TERM_LENGTH and token not in STOP_WORDS
+    ]
+
+
+def paper_term_weights(paper):
+    """Returns a {term: weight} mapping for every indexed field of a paper."""
+    fields = {
+        "title": paper.title,
+        "authors": " ".join(author.name for author in paper.authors.all()),
+        "tags": " ".join(tag.name for tag in paper.tags.all()),
+        "uploader": paper.uploader.username,
+        "content": paper.article_content,
+    }
+    weights = Counter()
+    for field, text in fields.items():
+        field_weight = FIELD_WEIGHTS[field]
+        for token in tokenize(text):
+            weights[token] += field_weight
+    return weights
+
+
+def _signature(weights):
+    digest = hashlib.sha256()
+    for term in sorted(weights):
+        digest.update(f"{term}:{weights[term]}\n".encode())
+    return digest.hexdigest()
+
+
+def _term_ids(terms):
+    """Returns {term: id}, creating any terms that are not in the vocabulary yet."""
+    ids = dict(SearchTerm.objects.filter(term__in=terms).values_list("term", "id"))
+    missing = [term for term in terms if term not in ids]
+    if missing:
+        SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in missing], ignore_conflicts=True)
+        ids.update(SearchTerm.objects.filter(term__in=missing).values_list("term", "id"))
+    return ids
+
+
+def index_paper(paper_id):
+    """(Re-)indexes a single paper. Unchanged papers are skipped."""
+    paper = Paper.objects.filter(pk=paper_id).select_related("uploader").prefetch_related("authors", "tags").first()
+    if paper is None:
+        return
+    weights = paper_term_weights(paper)
+    signature = _signature(weights)
+
+    with transaction.atomic():
+        document = SearchDocument.objects.select_for_update().filter(paper_id=paper_id).first()
+        if document is not None and document.signature == signature:
+            return
+
+        old_term_ids = set(
+            SearchPosting.objects.filter(paper_id=paper_id).values_list("term_id", flat=True)
+        )
+        term_ids = _term_ids(list(weights))
+        new_term_ids = set(term_ids.values())
+
+        SearchPosting.objects.filter(paper_id=paper_id).delete()
+        SearchPosting.objects.bulk_create([
+            SearchPosting(term_id=term_ids[term], paper_id=paper_id, weight=weight)
+            for term, weight in weights.items()
+        ])
+
+        dropped = old_term_ids - new_term_ids
+        added = new_term_ids - old_term_ids
+        if dropped:
+            SearchTerm.objects.filter(id__in=dropped).update(doc_freq=F("doc_freq") - 1)
+        if added:
+            SearchTerm.objects.filter(id__in=added).update(doc_freq=F("doc_freq") + 1)
+
+        SearchDocument.objects.update_or_create(
+            paper_id=paper_id,
+            defaults={"length": sum(weights.values()), "signature": signature},
+        )
+
+
+def remove_paper(paper_id):
+    """Drops a paper from the index and keeps the document frequencies right."""
+    term_ids = list(SearchPosting.objects.filter(paper_id=paper_id).values_list("term_id", flat=True))
+    if term_ids:
+        SearchTerm.objects.filter(id__in=term_ids).update(doc_freq=F("doc_freq") - 1)
+    SearchPosting.objects.filter(paper_id=paper_id).delete()
+    SearchDocument.objects.filter(paper_id=paper_id).delete()
+
+
+def schedule_reindex(paper_id):
+    """Re-indexes a paper once the current transaction (if any) commits."""
+    transaction.on_commit(lambda: index_paper(paper_id))
+
+
+def collection_stats():
+    """Returns (document count, average document length), cached briefly."""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        aggregate = SearchDocument.objects.aggregate(count=Count("pk"), avg_length=Avg("length"))
+        stats = (aggregate["count"], aggregate["avg_length"] or 0.0)
+        cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def _query_terms(query):
+    """Resolves the query to {term_id: doc_freq}, expanding the last word as a prefix."""
+    tokens = tokenize(query)
+    if not tokens:
+        return {}
+    terms = dict(SearchTerm.objects.filter(term__in=set(tokens), doc_freq__gt=0).values_list("id", "doc_freq"))
+    expansions = (
+        SearchTerm.objects.filter(term__startswith=tokens[-1], doc_freq__gt=0)
+        .order_by("-doc_freq")
+        .values_list("id", "doc_freq")[:MAX_PREFIX_EXPANSIONS]
+    )
+    terms.update(expansions)
+    return terms
+
+
+def search(query, offset=0, limit=20):
+    """
+    Ranks papers against a free-text query with BM25.
+    Returns a SearchResults with the requested slice of hits and the total hit count.
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return SearchResults(hits=[], total=0)
+
+    doc_count, avg_length = collection_stats()
+    doc_count = max(doc_count, max(terms.values()))
+    avg_length = avg_length or 1.0
+    idf = {
+        term_id: math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        for term_id, df in terms.items()
+    }
+
+    scores = Counter()
+    postings = SearchPosting.objects.filter(term_id__in=terms).values_list(
+        "paper_id", "term_id", "weight", "paper__search_document__length"
+    )
+    for paper_id, term_id, weight, length in postings.iterator(chunk_size=2000):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * (length or 0) / avg_length)
+        scores[paper_id] += idf[term_id] * weight * (BM25_K1 + 1) / (weight + norm)
+
+    top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+    hits = [SearchHit(paper_id, score) for paper_id, score in top[offset:]]
+    return SearchResults(hits=hits, total=len(scores))
+
+
+def rebuild_index(batch_size=500, stdout=None):
+    """Rebuilds the whole index from scratch. Returns the number of papers indexed."""
+    with transaction.atomic():
+        SearchPosting.objects.all().delete()
+        SearchDocument.objects.all().delete()
+        SearchTerm.objects.all().delete()
+
+        term_ids = {}
+        doc_freq = Counter()
+        indexed = 0
+        papers = Paper.objects.select_related("uploader").prefetch_related("authors", "tags").order_by("pk")
+        batch_postings, batch_documents = [], []
+
+        for paper in papers.iterator(chunk_size=batch_size):
+            weights = paper_term_weights(paper)
+            new_terms = [term for term in weights if term not in term_ids]
+            if new_terms:
+                created = SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in new_terms])
+                term_ids.update((term.term, term.id) for term in created)
+            for term, weight in weights.items():
+                batch_postings.append(SearchPosting(term_id=term_ids[term], paper_id=paper.pk, weight=weight))
+                doc_freq[term] += 1
+            batch_documents.append(SearchDocument(
+                paper_id=paper.pk, length=sum(weights.values()), signature=_signature(weights)
+            ))
+            indexed += 1
+
+            if len(batch_documents) >= batch_size:
+                SearchPosting.objects.bulk_create(batch_postings, batch_size=5000)
+                SearchDocument.objects.bulk_create(batch_documents)
+                batch_postings, batch_documents = [], []
+                if stdout:
+                    stdout.write(f"Indexed {indexed} papers...")
+
+        SearchPosting.objects.bulk_create(batch_postings, batch_size=5000)
+        SearchDocument.objects.bulk_create(batch_documents)
+        SearchTerm.objects.bulk_update(
+            [SearchTerm(id=term_ids[term], term=term, doc_freq=count) for term, count in doc_freq.items()],
+            ["doc_freq"], batch_size=1000,
+        )
+
+    cache.delete(STATS_CACHE_KEY)
+    return indexed
@@ -0,0 +1,77 @@
+"""
+Content-addressed storage for uploaded PDFs.
+
+Each distinct file is stored once as a PdfBlob under the SHA-256 of its bytes.
+Papers reference blobs, and a blob (with its files) is removed once the last
+paper referencing it is deleted.
+"""
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import PdfBlob
+
+BLOB_DIR = 'papers/blobs'
+
+
+def blob_name(digest):
+    """Storage path for a blob, fanned out by the first two hex digits."""
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}.pdf'
+
+
+def hash_file(file):
+    """Returns (sha256 hex digest, size) of an uploaded or stored file, read chunk by chunk."""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def store_pdf(file, digest=None, size=None):
+    """
+    Returns (blob, created) for the given file, with one reference taken for
+    the paper about to use it. The bytes are only written to storage when no
+    blob with the same content hash exists yet.
+    """
+    if digest is None:
+        digest, size = hash_file(file)
+    # The increment locks the row, so release_blob can't delete the blob between
+    # finding it and referencing it.
+    with transaction.atomic():
+        if PdfBlob.objects.filter(content_hash=digest).update(ref_count=F('ref_count') + 1):
+            return PdfBlob.objects.get(content_hash=digest), False
+
+    name = default_storage.save(blob_name(digest), file)
+    try:
+        with transaction.atomic():
+            blob = PdfBlob.objects.create(content_hash=digest, file=name, size=size or 0, ref_count=1)
+    except IntegrityError:
+        # Someone stored the same bytes concurrently; keep theirs.
+        default_storage.delete(name)
+        return store_pdf(file, digest, size)
+    return blob, True
+
+
+def release_blob(blob_id):
+    """Drops one reference to a blob, deleting it and its files when none are left."""
+    with transaction.atomic():
+        PdfBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = PdfBlob.objects.filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            return
+        if blob.papers.exists():
+            # the counter drifted (e.g. rows changed outside the ORM); trust the rows
+            PdfBlob.objects.filter(pk=blob_id).update(ref_count=blob.papers.count())
+            return
+        names = [field.name for field in (blob.file, blob.thumbnail, blob.thumbnail_small) if field]
+        # a concurrent store_pdf may have taken a new reference since; only an unreferenced row goes
+        deleted, _ = PdfBlob.objects.filter(pk=blob_id, ref_count=0).delete()
+        if deleted:
+            # only touch storage once the deletion is actually committed
+            transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
@@ -0,0 +1,86 @@
+"""
+The tag sidebar.
+
+Each Tag keeps a denormalized paper_count that is adjusted as papers are tagged,
+untagged and deleted (see the receivers in models.py), so popularity never needs
+a COUNT over the tag join table. The sidebar itself (the TAG_CLOUD_SIZE most used
+tags, by popularity and alphabetically) is cached under a version number that is
+bumped whenever a count changes, which costs a request two small cache reads.
+Tags that no paper uses any more are deleted by prune_empty_tags_task.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Paper, Tag
+
+TAG_CLOUD_SIZE = getattr(settings, "TAG_CLOUD_SIZE", 50)
+TAG_CLOUD_TTL = getattr(settings, "TAG_CLOUD_TTL", 60 * 60)
+
+VERSION_KEY = "papers:tag_cloud:version"
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def invalidate():
+    """Makes the next sidebar read rebuild, once the current transaction commits."""
+    transaction.on_commit(_bump_version)
+
+
+def add_papers(tag_ids, count=1):
+    """Adds `count` papers to each of the given tags."""
+    if tag_ids:
+        Tag.objects.filter(pk__in=tag_ids).update(paper_count=F("paper_count") + count)
+        invalidate()
+
+
+def remove_paper(paper):
+    """Takes a paper that is about to be deleted out of its tags' counts."""
+    if Tag.objects.filter(paper=paper).update(paper_count=F("paper_count") - 1):
+        invalidate()
+
+
+def recount(tag_ids=None):
+    """Recomputes paper_count from the join table, for the given tags or all of them."""
+    through = Paper.tags.through
+    papers = (
+        through.objects.filter(tag_id=OuterRef("pk")).order_by().values("tag_id")
+        .annotate(n=Count("paper_id")).values("n")
+    )
+    tags = Tag.objects.all() if tag_ids is None else Tag.objects.filter(pk__in=tag_ids)
+    updated = tags.update(paper_count=Coalesce(Subquery(papers), 0))
+    invalidate()
+    return updated
+
+
+def tag_cloud():
+    """
+    Returns {"top": [...], "alphabetical": [...]}: the most used tags ordered by
+    paper count and by name, as {"name", "paper_count"} dicts.
+    """
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    key = f"papers:tag_cloud:{version}"
+    cloud = cache.get(key)
+    if cloud is None:
+        top = list(
+            Tag.objects.filter(paper_count__gt=0).order_by("-paper_count", "name")
+            .values("name", "paper_count")[:TAG_CLOUD_SIZE]
+        )
+        cloud = {"top": top, "alphabetical": sorted(top, key=lambda tag: tag["name"])}
+        cache.set(key, cloud, TAG_CLOUD_TTL)
+    return cloud
+
+
+def prune_empty_tags():
+    """Deletes tags that no paper uses. Returns how many were deleted."""
+    deleted, _ = Tag.objects.filter(paper_count__lte=0, paper__isnull=True).delete()
+    if deleted:
+        invalidate()
+    return deleted
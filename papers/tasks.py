@@ -0,0 +1,155 @@
+from celery import shared_task
+
+from ai_processing import jobs
+from ai_processing.models import ProcessingJob
+from .models import Paper, PdfBlob
+from .thumbnails import render_thumbnails, store_thumbnails
+
+
+@shared_task
+def generate_thumbnails_task(blob_id, force=False, job_id=None):
+    """
+    A Celery task that renders the WebP thumbnails for a stored PDF and points
+    the blob and every paper sharing it at them. Timings go to the ProcessingJob
+    `job_id`, or to a new job for one of the blob's papers.
+    """
+    blob = PdfBlob.objects.filter(pk=blob_id).first()
+    if blob is None:
+        if job_id:
+            jobs.fail(job_id, "Blob not found.")
+        return "Blob not found."
+    if not force and blob.thumbnail_small and blob.thumbnail.name.endswith(".webp"):
+        return f"Thumbnails for blob {blob_id} already exist."
+    paper_id = Paper.objects.filter(blob=blob).values_list("pk", flat=True).first()
+    if paper_id is None and not job_id:
+        return f"No paper uses blob {blob_id}."
+
+    try:
+        with jobs.track(paper_id, ProcessingJob.THUMBNAILS, job_id) as job:
+            with job.stage("render"):
+                job.count(bytes_processed=blob.size)
+                try:
+                    images = render_thumbnails(blob.file.path)
+                except NotImplementedError:
+                    # storage without local paths: fall back to reading the bytes
+                    with blob.file.open("rb") as f:
+                        images = render_thumbnails(f.read())
+
+            with job.stage("store"):
+                previous = blob.thumbnail.name if blob.thumbnail else None
+                names = store_thumbnails(blob.content_hash, images)
+                PdfBlob.objects.filter(pk=blob.pk).update(**names)
+                Paper.objects.filter(blob=blob).update(**names)
+
+                # drop an older-format thumbnail (e.g. the PNG rendered at upload time)
+                if previous and previous not in names.values():
+                    blob.thumbnail.storage.delete(previous)
+    except jobs.AlreadyRunning as e:
+        return str(e)
+    except Exception as e:
+        return f"Failed to generate thumbnails: {e}"
+
+    return f"Generated {len(names)} thumbnails for blob {blob_id}"
+
+
+@shared_task
+def fan_out_paper_task(paper_id):
+    """A Celery task that pushes a new paper into its uploader's followers' timelines."""
+    from .feed import fan_out
+
+    paper = Paper.objects.filter(pk=paper_id).only("id", "uploader_id", "uploaded_at").first()
+    if paper is None:
+        return "Paper not found."
+    return f"Fanned paper {paper_id} out to {fan_out(paper)} timelines"
+
+
+@shared_task
+def trim_feeds_task():
+    """
+    A periodic Celery task that refreshes the cached set of high-fan-out uploaders,
+    recounts the timelines' lengths (entries of deleted papers aren't subtracted as they go)
+    and caps any timeline still over FEED_MAX_LENGTH entries (fan-outs trim as they go; this
+    catches the rest, e.g. after FEED_MAX_LENGTH is lowered).
+    """
+    from django.core.cache import cache
+    from .feed import HIGH_FANOUT_CACHE_KEY, get_backend, high_fanout_user_ids
+
+    cache.delete(HIGH_FANOUT_CACHE_KEY)
+    high_fanout_user_ids()
+    backend = get_backend()
+    backend.recount()
+    user_ids = backend.users_over_limit()
+    backend.trim_many(user_ids)
+    return f"Trimmed {len(user_ids)} timelines"
+
+
+@shared_task
+def prune_empty_tags_task():
+    """A periodic Celery task that deletes tags no paper uses any more."""
+    from .tag_cloud import prune_empty_tags
+
+    return f"Pruned {prune_empty_tags()} empty tags"
+
+
+@shared_task
+def expire_upload_sessions_task():
+    """A periodic Celery task that removes chunked uploads abandoned for UPLOAD_SESSION_TTL."""
+    from .uploads import expire
+
+    return f"Expired {expire()} upload sessions"
+
+
+@shared_task(bind=True, max_retries=10)
+def fold_in_related_task(self, paper_id):
+    """A Celery task that adds one paper to the related-papers index without refitting it."""
+    from .related import fold_in
+
+    try:
+        if not fold_in(paper_id):
+            return f"Paper {paper_id} not folded in (no index yet, or no such paper)."
+    except RuntimeError as e:
+        raise self.retry(exc=e, countdown=5)
+    return f"Folded paper {paper_id} into the related-papers index"
+
+
+@shared_task
+def rebuild_related_task():
+    """A periodic Celery task that refits the related-papers index over the whole corpus."""
+    from .related import rebuild
+
+    return f"Rebuilt related papers for {rebuild()} papers"
+
+
+@shared_task
+def index_title_task(paper_id):
+    """A Celery task that indexes a new paper's title for citation matching and links references waiting for it."""
+    from .citations import index_titles
+
+    paper = Paper.objects.filter(pk=paper_id).only("id", "title").first()
+    if paper is None:
+        return "Paper not found."
+    return f"Indexed the title of paper {paper_id}; linked {index_titles([paper])} references to it"
+
+
+@shared_task
+def index_text_task(paper_id, duplicates=True):
+    """
+    A Celery task that parses the reference list from the PDF and links the
+    references it can resolve. Unless `duplicates` is False (the article task
+    has checked already), it also checks the text for near-duplicates of earlier papers.
+    """
+    from ai_processing.extraction import extract_text
+    from .citations import store_references
+    from .duplicates import DUPLICATE_TEXT_CHARS, register
+
+    paper = Paper.objects.select_related("blob").filter(pk=paper_id).first()
+    if paper is None:
+        return "Paper not found."
+    # the references are at the end, so the whole document is read
+    extracted = extract_text(paper.pdf_file, digest=paper.blob.content_hash if paper.blob_id else None)
+    references, resolved = store_references(paper, extracted.pages)
+    original = register(paper, extracted.text(DUPLICATE_TEXT_CHARS)) if duplicates else None
+    return (
+        f"Stored {references} references of paper {paper_id} ({resolved} on CiteRight)"
+        + (f"; it nearly duplicates paper {original}" if original else "")
+    )
@@ -1,3 +1,749 @@
-from django.test import TestCase
+import io
+import os
+import random
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from ai_processing.models import ProcessingJob
+from profiles.models import UserProfile
+from . import citations, duplicates, feed, minhash, related, search, typeahead, uploads
+from .benchmarks import corpus, scenarios
+from .models import (
+    Comment, FeedEntry, Paper, PdfBlob, Reference, RelatedPapers, SearchDocument, SearchTerm, Tag, TextSignature,
+    UploadSession,
+)
+from .profiling import QueryBudgetExceeded
+from .storage import release_blob
+
+SCRIPT = {"HTTP_X_REQUESTED_WITH": "XMLHttpRequest"}
+
+
+def queue_tasks_in_memory(test):
+    """Queues the tasks a test schedules on an in-memory broker instead of running them."""
+    previous = {key: current_app.conf[key] for key in ("task_always_eager", "broker_url")}
+    current_app.conf.update(task_always_eager=False, broker_url="memory://")
+    test.addCleanup(current_app.conf.update, previous)
+
+
+@override_settings(
+    QUERY_BUDGET_MODE="raise",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class QueryBudgetTestCase(TransactionTestCase):
+    """
+    Requests views with their @query_budget enforced, so a view that runs more
+    queries than it declares fails with QueryBudgetExceeded. Each test gets a
+    small benchmark corpus (see benchmarks/corpus.py), so an N+1 shows up as
+    more queries rather than hiding behind a single row. TransactionTestCase
+    because TestCase would count the savepoints it puts around atomic blocks
+    against the budgets. Tasks that views schedule are queued on an in-memory
+    broker, not run.
+    """
+
+    def setUp(self):
+        queue_tasks_in_memory(self)
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            self.corpus = corpus.generate(
+                workdir, users=6, papers=20, authors=10, tags=8, follows=3, bookmarks_per_user=4, comments=40,
+            )
+        self.viewer = User.objects.get(username=self.corpus["viewer"])
+        self.client.force_login(self.viewer)
+
+    def assertStatus(self, response, status):
+        self.assertEqual(response.status_code, status, getattr(response, "content", b"")[:500])
+
+
+class PaperViewBudgetTests(QueryBudgetTestCase):
+
+    def own_paper(self):
+        """A paper uploaded by the logged-in user, for the uploader-only views."""
+        paper = Paper.objects.exclude(uploader=None).order_by("pk").first()
+        self.client.force_login(paper.uploader)
+        return paper
+
+    def test_paper_list(self):
+        url = reverse("papers:paper_list")
+        for params in (
+            {"tab": "all"}, {"tab": "following"}, {"q": self.corpus["search_term"]}, {"tag": self.corpus["tag"]},
+            {"tab": "all", "partial": "1"}, {"tab": "following", "partial": "1"},
+        ):
+            with self.subTest(**params):
+                self.assertStatus(self.client.get(url, params), 200)
+
+    def test_paper_detail(self):
+        url = reverse("papers:paper_detail", args=[self.corpus["hot_paper"]])
+        self.assertStatus(self.client.get(url), 200)
+        self.assertStatus(self.client.get(url, {"partial": "1"}), 200)
+        self.assertStatus(self.client.post(url, {"content": "A new thread."}), 302)
+        parent = Comment.objects.filter(paper_id=self.corpus["hot_paper"], depth=0).first()
+        self.assertStatus(self.client.post(url, {"content": "A reply.", "parent": parent.pk}, **SCRIPT), 201)
+        self.assertStatus(self.client.post(url, {"content": "", "parent": "x"}, **SCRIPT), 400)
+
+    def test_upload_paper(self):
+        url = reverse("papers:upload_paper")
+        self.assertStatus(self.client.get(url), 200)
+        for choice in ("manual", "ai"):
+            with self.subTest(article_choice=choice):
+                pdf = corpus.tiny_pdf([f"Budget test upload ({choice})", "A short paper."])
+                response = self.client.post(url, {
+                    "title": f"Budget test upload ({choice})", "publication_year": 2024, "article_choice": choice,
+                    "user_article": "Written by hand.", "new_authors": "Budget Author",
+                    "author_users": [self.viewer.pk],
+                    "pdf_file": SimpleUploadedFile(f"{choice}.pdf", pdf, content_type="application/pdf"),
+                })
+                self.assertStatus(response, 302)
+
+    def test_chunked_upload(self):
+        pdf = corpus.tiny_pdf(["Chunked budget test upload"])
+        response = self.client.post(reverse("papers:upload_start"), {"filename": "chunked.pdf", "size": len(pdf)})
+        self.assertStatus(response, 201)
+        url = reverse("papers:upload_session", args=[response.json()["id"]])
+        middle = len(pdf) // 2
+        for start, end in ((0, middle), (middle, len(pdf))):
+            response = self.client.put(
+                url, pdf[start:end], content_type="application/octet-stream",
+                HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(pdf)}",
+            )
+            self.assertStatus(response, 200)
+        self.assertStatus(self.client.get(url), 200)
+        response = self.client.post(reverse("papers:upload_paper"), {
+            "title": "Chunked budget test upload", "publication_year": 2024, "article_choice": "manual",
+            "user_article": "Written by hand.", "upload": response.json()["id"],
+        })
+        self.assertStatus(response, 302)
+
+        other = self.client.post(reverse("papers:upload_start"), {"filename": "cancelled.pdf", "size": len(pdf)})
+        self.assertStatus(self.client.delete(reverse("papers:upload_session", args=[other.json()["id"]])), 200)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_chunked_upload_submitted_twice(self):
+        pdf = corpus.tiny_pdf(["Submitted twice"])
+        session = uploads.start(self.viewer, "twice.pdf", len(pdf))
+        # a chunk cut off halfway never reaches the session's file
+        with self.assertRaises(uploads.UploadError):
+            uploads.append(session, io.BytesIO(pdf[:10]), f"bytes 0-{len(pdf) - 1}/{len(pdf)}")
+        self.assertEqual(os.path.getsize(uploads.temp_path(session)), 0)
+        uploads.append(session, io.BytesIO(pdf), f"bytes 0-{len(pdf) - 1}/{len(pdf)}")
+
+        form = {
+            "title": "Submitted twice", "publication_year": 2024, "article_choice": "manual",
+            "user_article": "Written by hand.", "upload": str(session.pk),
+        }
+        # the second submit arrives while the first is still storing the file
+        with uploads.completed_file(session):
+            self.assertStatus(self.client.post(reverse("papers:upload_paper"), form), 409)
+        self.assertFalse(Paper.objects.filter(title="Submitted twice").exists())
+
+    def test_paper_file(self):
+        paper_id = self.corpus["paper_ids"][0]
+        for kind in ("pdf", "thumbnail", "thumbnail_small"):
+            with self.subTest(kind=kind):
+                self.assertStatus(self.client.get(reverse("papers:paper_file", args=[paper_id, kind])), 200)
+        response = self.client.get(reverse("papers:paper_file", args=[paper_id, "pdf"]), HTTP_RANGE="bytes=0-99")
+        self.assertStatus(response, 206)
+
+    def test_delete_paper(self):
+        paper = self.own_paper()
+        url = reverse("papers:delete_paper", args=[paper.pk])
+        self.assertStatus(self.client.get(url), 200)
+        self.assertStatus(self.client.post(url), 302)
+        self.assertFalse(Paper.objects.filter(pk=paper.pk).exists())
+
+    def test_bookmarks(self):
+        paper_id = self.corpus["paper_ids"][0]
+        toggle = reverse("papers:toggle_bookmark", args=[paper_id])
+        self.assertStatus(self.client.post(toggle), 200)
+        self.assertStatus(self.client.post(toggle), 200)
+        self.assertStatus(self.client.get(toggle), 302)
+        self.assertStatus(self.client.get(reverse("papers:bookmarked_papers")), 200)
+        self.assertStatus(self.client.get(reverse("papers:bookmarked_papers"), {"partial": "1"}), 200)
+        ids = ",".join(str(pk) for pk in self.corpus["paper_ids"])
+        self.assertStatus(self.client.get(reverse("papers:bookmark_state"), {"ids": ids}), 200)
+
+    def test_typeahead(self):
+        for kind in ("users", "authors", "tags"):
+            with self.subTest(kind=kind):
+                self.assertStatus(self.client.get(reverse("papers:typeahead", args=[kind]), {"q": "b"}), 200)
+
+    def test_progress_and_regenerate(self):
+        paper = self.own_paper()
+        self.assertStatus(self.client.get(reverse("papers:paper_progress", args=[paper.pk])), 200)
+        url = reverse("papers:regenerate_article", args=[paper.pk])
+        self.assertStatus(self.client.post(url), 202)
+        # the second request finds the run already queued
+        self.assertStatus(self.client.post(url), 200)
+        self.assertEqual(ProcessingJob.objects.filter(paper=paper, kind=ProcessingJob.ARTICLE).count(), 1)
+
+    def test_processing_stats(self):
+        User.objects.filter(pk=self.viewer.pk).update(is_staff=True)
+        self.assertStatus(self.client.get(reverse("papers:processing_stats")), 200)
+
+
+class MediaTests(QueryBudgetTestCase):
+    """Stored files are served to logged-in users only, with ranges and conditional GETs."""
+
+    def setUp(self):
+        super().setUp()
+        self.paper = Paper.objects.get(pk=self.corpus["paper_ids"][0])
+        self.url = reverse("papers:paper_file", args=[self.paper.pk, "pdf"])
+        with self.paper.pdf_file.open("rb") as f:
+            self.content = f.read()
+        self.size = len(self.content)
+
+    def test_anonymous_is_sent_to_login(self):
+        self.client.logout()
+        for url in (self.url, reverse("papers:media_file", args=[self.paper.pdf_file.name])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertStatus(response, 302)
+                self.assertIn("login", response["Location"])
+
+    def test_media_url_serves_logged_in_users(self):
+        response = self.client.get(reverse("papers:media_file", args=[self.paper.pdf_file.name]))
+        self.assertStatus(response, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertStatus(response, 200)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertStatus(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]), 304)
+        self.assertStatus(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]), 304)
+        self.assertStatus(self.client.get(self.url, HTTP_IF_MATCH='"stale"'), 412)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertStatus(response, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{self.size}")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertStatus(response, 206)
+        self.assertEqual(response["Content-Range"], f"bytes {self.size - 5}-{self.size - 1}/{self.size}")
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={self.size}-")
+        self.assertStatus(response, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{self.size}")
+
+        # the client's copy is out of date, so it gets the whole file
+        self.assertStatus(self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"'), 200)
+
+
+class PdfBlobTests(QueryBudgetTestCase):
+    """Identical uploads share one stored blob, which goes once the last paper using it is deleted."""
+
+    def upload(self, title, pdf):
+        response = self.client.post(reverse("papers:upload_paper"), {
+            "title": title, "publication_year": 2024, "article_choice": "manual", "user_article": "Written by hand.",
+            "pdf_file": SimpleUploadedFile("same.pdf", pdf, content_type="application/pdf"),
+        })
+        self.assertStatus(response, 302)
+        return Paper.objects.get(title=title)
+
+    def test_same_file_twice(self):
+        pdf = corpus.tiny_pdf(["Uploaded twice"])
+        first, second = self.upload("First copy", pdf), self.upload("Second copy", pdf)
+        self.assertEqual(first.blob_id, second.blob_id)
+        blob = PdfBlob.objects.get(pk=first.blob_id)
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(os.listdir(os.path.dirname(blob.file.path)), [os.path.basename(blob.file.path)])
+
+    def test_delete_releases_blob(self):
+        pdf = corpus.tiny_pdf(["Deleted twice"])
+        first, second = self.upload("First copy", pdf), self.upload("Second copy", pdf)
+        blob = PdfBlob.objects.get(pk=first.blob_id)
+        for paper in (first, second):
+            self.assertStatus(self.client.post(reverse("papers:delete_paper", args=[paper.pk])), 302)
+            if paper is first:
+                blob.refresh_from_db()
+                self.assertEqual(blob.ref_count, 1)
+                self.assertTrue(os.path.exists(blob.file.path))
+        self.assertFalse(PdfBlob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(os.path.exists(blob.file.path))
+
+    def test_release_keeps_a_blob_papers_still_use(self):
+        paper = self.upload("Kept", corpus.tiny_pdf(["Kept"]))
+        # the counter drifted below the paper rows
+        PdfBlob.objects.filter(pk=paper.blob_id).update(ref_count=1)
+        release_blob(paper.blob_id)
+        self.assertEqual(PdfBlob.objects.get(pk=paper.blob_id).ref_count, 1)
+
+
+class ImportPapersTests(TestCase):
+    """import_papers stores each file once and a resumed import doesn't create its papers twice."""
+
+    def setUp(self):
+        queue_tasks_in_memory(self)
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.source = source.name
+        for name, lines in (("a.pdf", ["First paper"]), ("b.pdf", ["Second paper"]), ("copy.pdf", ["First paper"])):
+            with open(os.path.join(self.source, name), "wb") as f:
+                f.write(corpus.tiny_pdf(lines))
+        self.checkpoint = os.path.join(self.source, "import-checkpoint")
+        self.uploader = User.objects.create(username="librarian")
+
+    def run_import(self):
+        call_command(
+            "import_papers", self.source, user="librarian", workers=1, no_ai=True, checkpoint=self.checkpoint,
+            stdout=io.StringIO(),
+        )
+
+    def test_import(self):
+        self.run_import()
+        self.assertEqual(Paper.objects.filter(uploader=self.uploader).count(), 2)
+        self.assertEqual(sorted(PdfBlob.objects.values_list("ref_count", flat=True)), [1, 1])
+        with open(self.checkpoint) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_resume_after_lost_checkpoint(self):
+        self.run_import()
+        # interrupted after the batch was written but before the checkpoint was
+        os.remove(self.checkpoint)
+        self.run_import()
+        self.assertEqual(Paper.objects.filter(uploader=self.uploader).count(), 2)
+        self.assertEqual(sorted(PdfBlob.objects.values_list("ref_count", flat=True)), [1, 1])
+
+    def test_failed_batch_removes_its_files(self):
+        with mock.patch("papers.ingest.adjust_counter", side_effect=RuntimeError("boom")), \
+                self.assertRaises(RuntimeError):
+            self.run_import()
+        self.assertFalse(PdfBlob.objects.exists())
+        blob_dir = os.path.join(settings.MEDIA_ROOT, "papers", "blobs")
+        self.assertEqual([name for _, _, names in os.walk(blob_dir) for name in names], [])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SearchIndexTests(TestCase):
+    """Papers are ranked with BM25 and the index follows saves, tagging and deletes."""
+
+    def setUp(self):
+        queue_tasks_in_memory(self)
+        cache.clear()
+        self.uploader = User.objects.create(username="uploader")
+
+    def paper(self, title, article):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Paper.objects.create(
+                uploader=self.uploader, title=title, article_content=article, pdf_file="papers/a.pdf",
+            )
+
+    def ranked(self, query):
+        cache.clear()
+        return [hit.paper_id for hit in search.search(query).hits]
+
+    def test_bm25_ranking(self):
+        filler = " ".join(f"filler{i}" for i in range(200))
+        in_title = self.paper("Graphene transistors", "Device physics.")
+        in_short_article = self.paper("Device notes", "Graphene again and graphene.")
+        in_long_article = self.paper("Long survey", f"Graphene once. {filler}")
+        self.paper("Unrelated", "Protein folding.")
+        # the title counts more, and a term weighs less in a longer document
+        self.assertEqual(self.ranked("graphene"), [in_title.pk, in_short_article.pk, in_long_article.pk])
+        # a rarer term outweighs a common one
+        self.assertEqual(self.ranked("graphene survey")[0], in_long_article.pk)
+        self.assertEqual(search.search("graphene", offset=1, limit=1).total, 3)
+
+    def test_prefix_expansion(self):
+        paper = self.paper("Econometrics of housing", "Prices.")
+        self.assertEqual(self.ranked("econ"), [paper.pk])
+
+    def test_incremental_updates(self):
+        paper = self.paper("Soil bacteria", "Microbes in soil.")
+        self.assertEqual(self.ranked("bacteria"), [paper.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            paper.title = "Soil fungi"
+            paper.save()
+        self.assertEqual(self.ranked("bacteria"), [])
+        self.assertEqual(self.ranked("fungi"), [paper.pk])
+        self.assertEqual(SearchTerm.objects.get(term="bacteria").doc_freq, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            paper.tags.add(Tag.objects.create(name="mycology"))
+        self.assertEqual(self.ranked("mycology"), [paper.pk])
+
+        paper.delete()
+        self.assertEqual(self.ranked("fungi"), [])
+        self.assertEqual(SearchTerm.objects.get(term="fungi").doc_freq, 0)
+        self.assertFalse(SearchDocument.objects.exists())
+
+
+class ArticleHtmlTests(TestCase):
+    """The article is rendered to HTML on save, and on the fly for rows that skipped save()."""
+
+    def setUp(self):
+        queue_tasks_in_memory(self)
+        self.paper = Paper.objects.create(
+            uploader=User.objects.create(username="uploader"), title="A paper", pdf_file="papers/a.pdf",
+            article_content="Some **bold** text.",
+        )
+
+    def test_rendered_on_save(self):
+        self.assertIn("<strong>bold</strong>", Paper.objects.get(pk=self.paper.pk).article_html)
+
+    def test_unrendered_row(self):
+        Paper.objects.filter(pk=self.paper.pk).update(article_content="Some *new* text.", article_html="")
+        paper = Paper.objects.get(pk=self.paper.pk)
+        self.assertIn("<em>new</em>", paper.article_content_html)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TypeaheadTests(TestCase):
+    """Lookups rank whole-label matches first and follow renames without rebuilding the index."""
+
+    def setUp(self):
+        cache.clear()
+        typeahead._indexes.clear()
+        self.addCleanup(typeahead._indexes.clear)
+
+    def labels(self, query, limit=5):
+        return [result["label"] for result in typeahead.lookup("tags", query, limit)]
+
+    def test_whole_label_beyond_many_word_matches(self):
+        index = typeahead.PrefixIndex(
+            [(i, f"topic{i} machine learning") for i in range(50)] + [(100, "Mathematics")]
+        )
+        self.assertEqual(index.search("ma", 5)[0], (100, "Mathematics"))
+        self.assertEqual(len(index.search("ma", 5)), 5)
+        self.assertEqual(index.search("learn", 3), [(0, "topic0 machine learning"), (1, "topic1 machine learning"),
+                                                    (2, "topic2 machine learning")])
+
+    def test_changes_are_applied_in_place(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="graphene")
+        self.assertEqual(self.labels("gra"), ["graphene"])
+
+        def rebuild():
+            raise AssertionError("the index was rebuilt")
+
+        with mock.patch.dict(typeahead.SOURCES, {"tags": rebuild}):
+            with self.captureOnCommitCallbacks(execute=True):
+                tag = Tag.objects.create(name="gravity waves")
+            self.assertEqual(self.labels("gra"), ["graphene", "gravity waves"])
+            self.assertEqual(self.labels("wav"), ["gravity waves"])
+            with self.captureOnCommitCallbacks(execute=True):
+                tag.name = "gravitation"
+                tag.save()
+            self.assertEqual(self.labels("gra"), ["graphene", "gravitation"])
+            self.assertEqual(self.labels("wav"), [])
+            with self.captureOnCommitCallbacks(execute=True):
+                tag.delete()
+            self.assertEqual(self.labels("gra"), ["graphene"])
+
+    def test_rebuilds_when_a_change_is_lost(self):
+        self.assertEqual(self.labels("gra"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="graphene")
+        cache.delete(typeahead._change_key("tags", typeahead.version("tags")))
+        self.assertEqual(self.labels("gra"), ["graphene"])
+
+
+class BenchmarkMeasureTests(TestCase):
+    """A scenario that goes over its query budget in any run is reported, not raised."""
+
+    def scenario(self, failing_run):
+        runs = iter(range(1, 100))
+
+        def run():
+            if next(runs) == failing_run:
+                raise QueryBudgetExceeded("papers.views.paper_list_view ran 9 queries (budget 8)")
+            return "ok"
+        return SimpleNamespace(run=run)
+
+    def test_over_budget_in_warm_up(self):
+        result = scenarios.measure(self.scenario(1), 3)
+        self.assertEqual((result["status"], result["runs"]), ("over_budget", 0))
+
+    def test_over_budget_in_timed_run(self):
+        result = scenarios.measure(self.scenario(3), 3)
+        self.assertEqual((result["status"], result["runs"]), ("over_budget", 1))
+        self.assertIn("budget 8", result["error"])
+
+    def test_within_budget(self):
+        result = scenarios.measure(self.scenario(None), 3)
+        self.assertEqual((result["status"], result["runs"]), ("ok", 3))
+
+
+class CitationTests(TestCase):
+    """References are parsed from the text, linked to papers by title, and relinked as papers come and go."""
+
+    PAGES = [
+        "Introduction text.\n\nReferences\n"
+        "[1] A. Smith and B. Jones. Deep residual learning for image recognition. In CVPR, 2016.\n"
+        "[2] C. Doe. \"Attention is all you need in neural machine translation\", NeurIPS 2017.\n"
+        "[3] Too short.\n",
+        "Appendix A\nDerivations that are not references at all.",
+    ]
+
+    def setUp(self):
+        queue_tasks_in_memory(self)
+        self.uploader = User.objects.create(username="uploader")
+        self.citing = self.paper("A survey of vision and language models")
+
+    def paper(self, title):
+        paper = Paper.objects.create(uploader=self.uploader, title=title, pdf_file="papers/a.pdf")
+        citations.index_titles([paper])
+        return paper
+
+    def test_parse_numbered_references(self):
+        self.assertEqual([title for entry, title in citations.parse_references(self.PAGES)], [
+            "Deep residual learning for image recognition",
+            "Attention is all you need in neural machine translation",
+        ])
+
+    def test_parse_author_year_references(self):
+        pages = [
+            "Bibliography\nSmith, J. 2019. Graph neural networks for molecules. Journal of Chem, 12.\n\n"
+            "Lovelace, A. (1843). Notes on the analytical engine. Scientific Memoirs."
+        ]
+        self.assertEqual([title for entry, title in citations.parse_references(pages)], [
+            "Graph neural networks for molecules", "Notes on the analytical engine",
+        ])
+
+    def test_resolves_against_existing_papers(self):
+        cited = self.paper("Deep Residual Learning for Image Recognition")
+        self.paper("Protein structure prediction at scale")
+        self.assertEqual(citations.store_references(self.citing, self.PAGES), (2, 1))
+        self.assertEqual(
+            list(Reference.objects.filter(paper=self.citing).order_by("position").values_list("cited", flat=True)),
+            [cited.pk, None],
+        )
+        cited.refresh_from_db()
+        self.assertEqual(cited.citation_count, 1)
+        # storing again replaces the references rather than counting them twice
+        citations.store_references(self.citing, self.PAGES)
+        cited.refresh_from_db()
+        self.assertEqual(cited.citation_count, 1)
+
+    def test_later_upload_links_waiting_reference(self):
+        citations.store_references(self.citing, self.PAGES)
+        self.assertFalse(Reference.objects.filter(cited__isnull=False).exists())
+        cited = self.paper("Attention Is All You Need in Neural Machine Translation")
+        reference = Reference.objects.get(paper=self.citing, position=1)
+        self.assertEqual(reference.cited_id, cited.pk)
+        cited.refresh_from_db()
+        self.assertEqual(cited.citation_count, 1)
+
+    def test_deletes_unlink(self):
+        cited = self.paper("Deep Residual Learning for Image Recognition")
+        citations.store_references(self.citing, self.PAGES)
+        # the cited paper goes: its citing reference waits for a new match
+        cited.delete()
+        reference = Reference.objects.get(paper=self.citing, position=0)
+        self.assertIsNone(reference.cited_id)
+        again = self.paper("Deep residual learning for image recognition")
+        reference.refresh_from_db()
+        self.assertEqual(reference.cited_id, again.pk)
+        # the citing paper goes: it no longer counts towards the cited one
+        self.citing.delete()
+        again.refresh_from_db()
+        self.assertEqual(again.citation_count, 0)
+
+
+def words(seed, count=400):
+    rng = random.Random(seed)
+    return [f"w{rng.randrange(5000)}" for _ in range(count)]
+
+
+def edited(text_words, *positions):
+    """The text with the words at `positions` replaced."""
+    text_words = list(text_words)
+    for position in positions:
+        text_words[position] = "edited"
+    return " ".join(text_words)
+
+
+class MinHashTests(SimpleTestCase):
+    """Signatures estimate Jaccard similarity, and similar texts share band keys."""
+
+    def test_ngrams_and_jaccard(self):
+        self.assertEqual(minhash.normalize("Deep-Learning, for  ALL!"), "deep learning for all")
+        self.assertEqual(minhash.ngrams("Ab"), {" ab", "ab "})
+        self.assertEqual(minhash.jaccard({1, 2, 3}, {2, 3, 4}), 0.5)
+        self.assertEqual(minhash.jaccard(set(), {1}), 0.0)
+
+    def test_signature_estimates_jaccard(self):
+        base = words(1)
+        a, b = minhash.shingles(" ".join(base)), minhash.shingles(edited(base, 50, 150, 250, 350))
+        exact = minhash.jaccard(a, b)
+        estimate = minhash.similarity(minhash.signature(a), minhash.signature(b))
+        self.assertAlmostEqual(estimate, exact, delta=0.15)
+        self.assertEqual(minhash.similarity(minhash.signature(a), minhash.signature(set(a))), 1.0)
+
+    def test_band_keys(self):
+        title = "Deep residual learning for image recognition"
+        grams, keys = minhash.text_keys(title)
+        self.assertEqual(len(keys), minhash.MINHASH_BANDS)
+        self.assertEqual(minhash.text_keys(title.upper())[1], keys)
+        self.assertTrue(set(keys) & set(minhash.text_keys("Deep residual learning for image recognitions")[1]))
+        self.assertFalse(set(keys) & set(minhash.text_keys("Protein folding with attention networks")[1]))
+        self.assertEqual(minhash.band_keys(None), [])
+
+
+class DuplicateTests(TestCase):
+    """Near-duplicate texts are matched through LSH candidates, on upload and when the corpus is regrouped."""
+
+    def setUp(self):
+        queue_tasks_in_memory(self)
+        self.uploader = User.objects.create(username="uploader")
+        self.base = words(1)
+
+    def paper(self, title):
+        return Paper.objects.create(uploader=self.uploader, title=title, pdf_file="papers/a.pdf")
+
+    def test_register(self):
+        original, revised, revised_again, unrelated, stub = (
+            self.paper(title) for title in ("Original", "Revised", "Revised again", "Unrelated", "Stub")
+        )
+        self.assertIsNone(duplicates.register(original, " ".join(self.base)))
+        self.assertEqual(duplicates.register(revised, edited(self.base, 100)), original.pk)
+        # a copy of the copy points at the original of the group
+        self.assertEqual(duplicates.register(revised_again, edited(self.base, 100, 300)), original.pk)
+        self.assertIsNone(duplicates.register(unrelated, " ".join(words(2))))
+        self.assertIsNone(duplicates.register(stub, "Too short to compare."))
+        self.assertFalse(TextSignature.objects.filter(paper=stub).exists())
+
+        self.assertEqual(duplicates.original_of(revised)[0], original)
+        self.assertGreaterEqual(duplicates.original_of(revised)[1], duplicates.DUPLICATE_THRESHOLD)
+        self.assertIsNone(duplicates.original_of(unrelated))
+        sig = duplicates.sign(" ".join(self.base))
+        self.assertEqual([paper_id for paper_id, score in duplicates.candidates(sig, original.pk)],
+                         [revised.pk, revised_again.pk])
+
+    def test_cluster(self):
+        first, second, third, other, other_copy = (self.paper(f"Paper {i}") for i in range(5))
+        texts = {
+            third: edited(self.base, 300), first: " ".join(self.base), second: edited(self.base, 100),
+            other: " ".join(words(2)), other_copy: edited(words(2), 10),
+        }
+        # signed without grouping, as sign_missing() leaves them
+        for paper, text in texts.items():
+            duplicates._store(paper.pk, duplicates.sign(text))
+        groups = {first.pk: [second.pk, third.pk], other.pk: [other_copy.pk]}
+        self.assertEqual({root: sorted(ids) for root, ids in duplicates.cluster().items()}, groups)
+        self.assertEqual(
+            dict(TextSignature.objects.values_list("paper_id", "duplicate_of_id")),
+            {first.pk: None, second.pk: first.pk, third.pk: first.pk, other.pk: None, other_copy.pk: other.pk},
+        )
+        # regrouping an unchanged corpus finds the same groups
+        self.assertEqual({root: sorted(ids) for root, ids in duplicates.cluster().items()}, groups)
+
+
+class FeedCapTests(TestCase):
+    """Fan-outs keep every timeline within FEED_MAX_LENGTH without waiting for trim_feeds_task."""
+
+    MAX_LENGTH = 3
+
+    def setUp(self):
+        self.uploader = User.objects.create(username="uploader")
+        self.followers = [User.objects.create(username=f"follower{i}") for i in range(3)]
+        self.papers = [
+            Paper.objects.create(uploader=self.uploader, title=f"Paper {i}", pdf_file=f"papers/{i}.pdf")
+            for i in range(self.MAX_LENGTH + 2)
+        ]
+
+    def fan_out_all(self, backend):
+        with mock.patch.object(feed, "FEED_MAX_LENGTH", self.MAX_LENGTH):
+            for paper in self.papers:
+                backend.add([user.pk for user in self.followers], paper)
+
+    def newest_ids(self):
+        return [paper.pk for paper in sorted(self.papers, key=lambda p: (p.uploaded_at, p.pk), reverse=True)]
+
+    def test_database_backend(self):
+        self.fan_out_all(feed.DatabaseFeedBackend())
+        for user in self.followers:
+            ids = list(FeedEntry.objects.filter(user=user).order_by("-uploaded_at", "-paper_id")
+                       .values_list("paper_id", flat=True))
+            self.assertEqual(ids, self.newest_ids()[:self.MAX_LENGTH])
+            self.assertEqual(UserProfile.objects.get(user=user).feed_length, self.MAX_LENGTH)
+
+    def test_database_fan_out_does_not_scan_timelines(self):
+        backend = feed.DatabaseFeedBackend()
+        self.fan_out_all(backend)
+        paper = Paper.objects.create(uploader=self.uploader, title="Newest", pdf_file="papers/new.pdf")
+        # insert, bump the lengths, find the full timelines' oldest entries, delete them, set the lengths
+        with mock.patch.object(feed, "FEED_MAX_LENGTH", self.MAX_LENGTH), self.assertNumQueries(5):
+            backend.add([user.pk for user in self.followers], paper)
+        for user in self.followers:
+            self.assertEqual(FeedEntry.objects.filter(user=user).count(), self.MAX_LENGTH)
+            self.assertTrue(FeedEntry.objects.filter(user=user, paper=paper).exists())
+
+    def test_recount_repairs_lengths(self):
+        backend = feed.DatabaseFeedBackend()
+        self.fan_out_all(backend)
+        self.papers[-1].delete()
+        backend.recount()
+        for user in self.followers:
+            self.assertEqual(UserProfile.objects.get(user=user).feed_length, self.MAX_LENGTH - 1)
+
+    def test_in_memory_backend(self):
+        backend = feed.InMemoryFeedBackend()
+        self.fan_out_all(backend)
+        for user in self.followers:
+            ids = [paper_id for uploaded_at, paper_id in backend.page(user.pk, None, self.MAX_LENGTH + 2)]
+            self.assertEqual(ids, self.newest_ids()[:self.MAX_LENGTH])
+
+
+class RelatedIndexTests(TestCase):
+    """Folding papers into the related-papers index, one writer at a time."""
+
+    TOPICS = ["protein folding structure", "graph neural network", "quantum error correction"]
+
+    def setUp(self):
+        self.uploader = User.objects.create(username="uploader")
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = f"{workdir.name}/related.pkl"
+        for i in range(9):
+            self.paper(i)
+        related.rebuild(k=3, path=self.path)
+
+    def paper(self, i):
+        topic = self.TOPICS[i % len(self.TOPICS)]
+        return Paper.objects.create(
+            uploader=self.uploader, title=f"{topic} {i}", article_content=f"A study of {topic}. " * 5,
+            pdf_file=f"papers/{i}.pdf",
+        )
+
+    def test_fold_in_appends_to_delta(self):
+        papers = [self.paper(i) for i in (9, 10)]
+        for paper in papers:
+            self.assertTrue(related.fold_in(paper.pk, k=3, path=self.path))
+        self.assertEqual([paper_id for paper_id, vector in related._read_delta(self.path)], [p.pk for p in papers])
+        neighbours = RelatedPapers.objects.get(paper=papers[0]).neighbours
+        titles = Paper.objects.filter(pk__in=[pk for pk, score in neighbours]).values_list("title", flat=True)
+        self.assertTrue(all(title.startswith(self.TOPICS[0]) for title in titles))
+        self.assertIn(papers[1].pk, related.RelatedIndex.load(self.path).paper_ids)
+
+    def test_fold_in_refuses_while_locked(self):
+        paper = self.paper(9)
+        with related._locked(self.path):
+            with self.assertRaises(RuntimeError):
+                related.fold_in(paper.pk, k=3, path=self.path)
+        self.assertTrue(related.fold_in(paper.pk, k=3, path=self.path))
@@ -0,0 +1,62 @@
+"""
+First-page thumbnails for uploaded PDFs.
+
+The page is rendered once at the largest configured width and downscaled for the
+smaller sizes. Images are encoded as WebP and stored under names derived from the
+blob's content hash, so re-running the task overwrites instead of piling up
+suffixed copies.
+"""
+import io
+
+import fitz
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+# Target widths in pixels: small for the list cards, medium for the detail page
+# (both about twice their CSS size, for high-density screens).
+THUMBNAIL_WIDTHS = {
+    "small": 240,
+    "medium": 640,
+}
+WEBP_QUALITY = 80
+
+# Which model field holds which size.
+THUMBNAIL_FIELDS = {
+    "small": "thumbnail_small",
+    "medium": "thumbnail",
+}
+
+
+def render_thumbnails(source):
+    """Renders page 1 of a PDF (a file path or the raw bytes) to {size: webp bytes}."""
+    if isinstance(source, (bytes, bytearray)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
+    with doc:
+        page = doc.load_page(0)
+        zoom = max(THUMBNAIL_WIDTHS.values()) / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+    images = {}
+    for size, width in THUMBNAIL_WIDTHS.items():
+        resized = image
+        if image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, "WEBP", quality=WEBP_QUALITY)
+        images[size] = buffer.getvalue()
+    return images
+
+
+def store_thumbnails(content_hash, images):
+    """Writes rendered thumbnails to storage; returns {field name: storage name}."""
+    names = {}
+    for size, data in images.items():
+        name = f"thumbnails/{content_hash}_{size}.webp"
+        # replace rather than letting the storage pick a suffixed name
+        default_storage.delete(name)
+        names[THUMBNAIL_FIELDS[size]] = default_storage.save(name, ContentFile(data))
+    return names
@@ -0,0 +1,224 @@
+"""
+Typeahead lookups for platform users, external authors and tags.
+
+Each kind has a sorted-prefix index: every word of every name is a key in a
+sorted list, so a prefix is a bisect plus a short scan instead of a LIKE over the
+table. Each process builds the index lazily. Saves and deletes bump the kind's
+version and leave the change (id and new label, or None once it is gone) in
+the cache under that version, so a process that is behind applies the changes
+it missed to its index in place instead of reading the whole table again. It
+only rebuilds when a change has dropped out of the cache, when it is more than
+TYPEAHEAD_MAX_CHANGES versions behind, or after TYPEAHEAD_INDEX_MAX_AGE (which
+also fixes up changes that committed in a different order than they were
+numbered). Answers are cached for TYPEAHEAD_CACHE_TTL seconds on top of that.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Author, Tag
+
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 25
+TYPEAHEAD_CACHE_TTL = getattr(settings, "TYPEAHEAD_CACHE_TTL", 30)
+TYPEAHEAD_INDEX_MAX_AGE = getattr(settings, "TYPEAHEAD_INDEX_MAX_AGE", 300)
+# a process further behind than this many changes rebuilds its index instead
+TYPEAHEAD_MAX_CHANGES = getattr(settings, "TYPEAHEAD_MAX_CHANGES", 200)
+
+# kind -> the (id, label) pairs it indexes
+SOURCES = {
+    "users": lambda: User.objects.filter(is_active=True).values_list("id", "username"),
+    "authors": lambda: Author.objects.filter(user__isnull=True).values_list("id", "name"),
+    "tags": lambda: Tag.objects.values_list("id", "name"),
+}
+
+
+class _SortedKeys:
+    """Parallel lists of keys and ids, kept sorted by (key, id)."""
+
+    def __init__(self, entries):
+        entries.sort()
+        self.keys = [key for key, pk in entries]
+        self.ids = [pk for key, pk in entries]
+
+    def _position(self, key, pk):
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        # ids are sorted within a run of equal keys
+        return bisect.bisect_left(self.ids, pk, lo, hi)
+
+    def insert(self, key, pk):
+        i = self._position(key, pk)
+        self.keys.insert(i, key)
+        self.ids.insert(i, pk)
+
+    def remove(self, key, pk):
+        i = self._position(key, pk)
+        if i < len(self.keys) and self.keys[i] == key and self.ids[i] == pk:
+            del self.keys[i]
+            del self.ids[i]
+
+    def scan(self, prefix):
+        """Yields the ids of keys starting with `prefix`, in key order."""
+        # walk by index: slicing (or islice) would cost O(N) per keystroke
+        for i in range(bisect.bisect_left(self.keys, prefix), len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                return
+            yield self.ids[i]
+
+
+def _keys(label):
+    """The whole label, then the label from each later word on: "ada lovelace" is found by "ada l..." and "love..."."""
+    words = label.lower().split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+    """
+    Whole labels and the later-word suffixes of labels in two sorted key lists, so
+    whole-label matches are found without scanning past word-start ones. Labels can
+    be changed in place with put() and discard().
+    """
+
+    def __init__(self, rows):
+        self.labels = {}
+        whole, words = [], []
+        for pk, label in rows:
+            self.labels[pk] = label
+            keys = _keys(label)
+            whole.extend((key, pk) for key in keys[:1])
+            words.extend((key, pk) for key in keys[1:])
+        self.whole = _SortedKeys(whole)
+        self.words = _SortedKeys(words)
+
+    def put(self, pk, label):
+        if self.labels.get(pk) == label:
+            return
+        self.discard(pk)
+        self.labels[pk] = label
+        keys = _keys(label)
+        for key in keys[:1]:
+            self.whole.insert(key, pk)
+        for key in keys[1:]:
+            self.words.insert(key, pk)
+
+    def discard(self, pk):
+        label = self.labels.pop(pk, None)
+        if label is None:
+            return
+        keys = _keys(label)
+        for key in keys[:1]:
+            self.whole.remove(key, pk)
+        for key in keys[1:]:
+            self.words.remove(key, pk)
+
+    def search(self, prefix, limit):
+        """Up to `limit` (id, label) pairs with a word starting with `prefix`; whole-label matches first."""
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+        found = []
+        for pk in self.whole.scan(prefix):
+            if len(found) >= limit:
+                break
+            found.append(pk)
+        seen = set(found)
+        for pk in self.words.scan(prefix):
+            if len(found) >= limit:
+                break
+            if pk not in seen:
+                seen.add(pk)
+                found.append(pk)
+        return [(pk, self.labels[pk]) for pk in found]
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _version_key(kind):
+    return f"papers:typeahead:{kind}:version"
+
+
+def _change_key(kind, number):
+    return f"papers:typeahead:{kind}:change:{number}"
+
+
+def version(kind):
+    return cache.get_or_set(_version_key(kind), 1, None)
+
+
+def invalidate(kind, changes=None):
+    """
+    Marks a kind's indexes and cached answers stale once the current transaction
+    commits. `changes` lists the (id, label) pairs that changed, with None as the
+    label of one that is gone or no longer belongs to the kind; without it every
+    process rebuilds its index.
+    """
+    def bump():
+        try:
+            number = cache.incr(_version_key(kind))
+        except ValueError:
+            cache.set(_version_key(kind), 1, None)
+            return
+        if changes is not None:
+            cache.set(_change_key(kind, number), list(changes), TYPEAHEAD_INDEX_MAX_AGE)
+    transaction.on_commit(bump)
+
+
+def _missed_changes(kind, since, current_version):
+    """The changes after version `since` up to current_version in order, or None if any are unavailable."""
+    if not since < current_version <= since + TYPEAHEAD_MAX_CHANGES:
+        return None
+    keys = [_change_key(kind, number) for number in range(since + 1, current_version + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return None
+    return [change for key in keys for change in found[key]]
+
+
+def _get_index(kind, current_version):
+    """The kind's index brought up to current_version; the caller holds _lock."""
+    entry = _indexes.get(kind)
+    if entry is not None and time.monotonic() - entry[1] <= TYPEAHEAD_INDEX_MAX_AGE:
+        if entry[0] == current_version:
+            return entry[2]
+        changes = _missed_changes(kind, entry[0], current_version)
+        if changes is not None:
+            index = entry[2]
+            for pk, label in changes:
+                if label is None:
+                    index.discard(pk)
+                else:
+                    index.put(pk, label)
+            _indexes[kind] = (current_version, entry[1], index)
+            return index
+    index = PrefixIndex(SOURCES[kind]())
+    _indexes[kind] = (current_version, time.monotonic(), index)
+    return index
+
+
+def search_index(kind, current_version, query, limit):
+    # the index is changed in place, so searches and updates take turns
+    with _lock:
+        return _get_index(kind, current_version).search(query, limit)
+
+
+def lookup(kind, query, limit=TYPEAHEAD_LIMIT):
+    """[{"id", "label"}, ...] for names of `kind` matching `query` as a prefix."""
+    limit = max(1, min(limit, TYPEAHEAD_MAX_LIMIT))
+    query = " ".join(query.lower().split())[:100]
+    if not query:
+        return []
+    current_version = version(kind)
+    key = f"papers:typeahead:{kind}:{current_version}:{limit}:{query}"
+    results = cache.get(key)
+    if results is None:
+        results = [{"id": pk, "label": label} for pk, label in search_index(kind, current_version, query, limit)]
+        cache.set(key, results, TYPEAHEAD_CACHE_TTL)
+    return results
@@ -0,0 +1,234 @@
+"""
+Chunked, resumable PDF uploads.
+
+A browser announces the file (name and size) and gets an UploadSession back.
+It then PUTs the file in pieces of at most UPLOAD_CHUNK_SIZE bytes, each with a
+`Content-Range: bytes start-end/total` header. Each piece is streamed from the
+request into a scratch file, UPLOAD_READ_SIZE bytes at a time, so a worker holds
+at most one read buffer no matter how large the PDF is. Only once the piece has
+arrived whole is the session locked and the piece copied onto the end of the
+session's temporary file. Limits are checked before anything is written: the
+announced size when the session starts, and every chunk's range against it. The
+first chunk must start like a PDF.
+
+Every chunk is hashed as it streams in, and checked against the client's
+X-Chunk-SHA256 header when one is sent. If a connection drops, the client asks
+for the session's `received` offset and carries on from there; bytes past that
+offset (left by a worker that died mid-copy) are truncated before the next
+append. A hash object can't be carried from one request (or worker) to the
+next, so the whole-file SHA-256 that storage.py keys blobs on is taken in one
+sequential read of the finished file.
+
+The upload form then submits the session id in place of the file, and the
+temporary file is moved into blob storage. Nothing downstream ever holds the
+PDF in memory: the background tasks get the paper id and read the stored file
+from disk. Sessions left unfinished for UPLOAD_SESSION_TTL are removed by
+expire_upload_sessions_task.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UploadSession
+from .storage import hash_file
+
+UPLOAD_CHUNK_SIZE = getattr(settings, "UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024)
+UPLOAD_MAX_BYTES = getattr(settings, "UPLOAD_MAX_BYTES", 100 * 1024 * 1024)
+UPLOAD_READ_SIZE = 64 * 1024
+UPLOAD_SESSION_TTL = getattr(settings, "UPLOAD_SESSION_TTL", timedelta(days=1))
+# uploads one user may have in progress at once
+UPLOAD_MAX_SESSIONS = getattr(settings, "UPLOAD_MAX_SESSIONS", 5)
+# must be shared by every web worker that can receive a session's chunks
+UPLOAD_TEMP_DIR = getattr(settings, "UPLOAD_TEMP_DIR", None) or os.path.join(
+    getattr(settings, "FILE_UPLOAD_TEMP_DIR", None) or tempfile.gettempdir(), "citeright-uploads"
+)
+PDF_MAGIC = b"%PDF-"
+
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadError(Exception):
+    """A chunk or session request that can't be accepted; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _UploadedFile(File):
+    """A finished upload; FileSystemStorage moves it into place instead of copying it."""
+
+    def __init__(self, file, name, path):
+        super().__init__(file, name)
+        self._path = path
+
+    def temporary_file_path(self):
+        return self._path
+
+
+def temp_path(session):
+    return os.path.join(UPLOAD_TEMP_DIR, f"{session.pk}.part")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def status(session):
+    """What a client needs to (re)start sending chunks."""
+    return {
+        "id": str(session.pk), "filename": session.filename, "size": session.size,
+        "received": session.received, "chunk_size": UPLOAD_CHUNK_SIZE, "complete": session.complete,
+    }
+
+
+def start(user, filename, size):
+    """Opens an UploadSession for a file of `size` bytes, refusing it up front if it is too large."""
+    if size <= 0:
+        raise UploadError("The file is empty.")
+    if size > UPLOAD_MAX_BYTES:
+        raise UploadError(f"PDFs can be at most {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.", status=413)
+    expired = UploadSession.objects.filter(user=user, updated_at__lt=timezone.now() - UPLOAD_SESSION_TTL)
+    if expired.exists():
+        discard(*expired)
+    if UploadSession.objects.filter(user=user).count() >= UPLOAD_MAX_SESSIONS:
+        raise UploadError("Too many uploads in progress; finish or cancel one first.", status=429)
+    session = UploadSession.objects.create(user=user, filename=os.path.basename(filename)[:255] or "paper.pdf", size=size)
+    os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+    open(temp_path(session), "wb").close()
+    return session
+
+
+def parse_content_range(header):
+    """(start, end exclusive, total) from a `bytes start-end/total` header."""
+    match = _CONTENT_RANGE.match(header or "")
+    if not match:
+        raise UploadError("A Content-Range header of the form 'bytes start-end/total' is required.")
+    first, last, total = (int(value) for value in match.groups())
+    if last < first:
+        raise UploadError("The Content-Range is empty.")
+    return first, last + 1, total
+
+
+def _receive(stream, start_at, length, checksum):
+    """
+    Streams one chunk into an anonymous temporary file next to the session files,
+    checking it on the way. Returns the file, rewound, and the chunk's SHA-256.
+    """
+    digest = hashlib.sha256()
+    written = 0
+    chunk = tempfile.TemporaryFile(dir=UPLOAD_TEMP_DIR)
+    try:
+        while written < length:
+            piece = stream.read(min(UPLOAD_READ_SIZE, length - written))
+            if not piece:
+                break
+            if start_at == 0 and written < len(PDF_MAGIC):
+                head = PDF_MAGIC[written:written + len(piece)]
+                if piece[:len(head)] != head:
+                    raise UploadError("The file is not a PDF.", status=415)
+            chunk.write(piece)
+            digest.update(piece)
+            written += len(piece)
+        if written != length:
+            raise UploadError(f"The chunk was cut off after {written} of {length} bytes.")
+        if checksum and checksum.lower() != digest.hexdigest():
+            raise UploadError("The chunk's SHA-256 does not match.")
+    except BaseException:
+        chunk.close()
+        raise
+    chunk.seek(0)
+    return chunk, digest.hexdigest()
+
+
+def append(session, stream, content_range, checksum=None):
+    """
+    Appends one chunk from `stream` to the session's temporary file. The chunk
+    must start exactly at `session.received`; a chunk that arrives short or with
+    the wrong checksum is dropped, leaving the session where it was.
+    """
+    start_at, end, total = parse_content_range(content_range)
+    if total != session.size:
+        raise UploadError(f"This upload is {session.size} bytes, not {total}.")
+    if end - start_at > UPLOAD_CHUNK_SIZE:
+        raise UploadError(f"Chunks can be at most {UPLOAD_CHUNK_SIZE} bytes.", status=413)
+    if end > session.size:
+        raise UploadError("The chunk runs past the end of the file.", status=413)
+    if start_at != session.received:
+        raise UploadError(f"Expected the chunk at offset {session.received}.", status=409)
+
+    # The chunk is read off the network before the session row is locked, so a slow
+    # client doesn't hold the lock (and a database connection) while it sends.
+    chunk, chunk_hash = _receive(stream, start_at, end - start_at, checksum)
+    with chunk:
+        # the row lock serializes overlapping PUTs of the same session, whichever workers they reach
+        with transaction.atomic():
+            session.received, session.chunk_hashes = UploadSession.objects.select_for_update().filter(
+                pk=session.pk
+            ).values_list("received", "chunk_hashes").get()
+            if start_at != session.received:
+                raise UploadError(f"Expected the chunk at offset {session.received}.", status=409)
+            with open(temp_path(session), "r+b") as f:
+                f.seek(session.received)
+                f.truncate()
+                shutil.copyfileobj(chunk, f, UPLOAD_READ_SIZE)
+            session.received = end
+            session.chunk_hashes.append(chunk_hash)
+            session.save(update_fields=["received", "chunk_hashes", "updated_at"])
+    return session
+
+
+@contextmanager
+def completed_file(session):
+    """
+    Yields (file, sha256 hex digest, size) for a finished upload, ready for store_pdf.
+    The temporary file is claimed first, so when the same upload is submitted twice the
+    second submit gets a 409 UploadError instead of a file that is gone.
+    """
+    path = temp_path(session)
+    claimed = f"{path}.{uuid.uuid4().hex}"
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        raise UploadError("This upload has already been submitted.", status=409)
+    try:
+        with open(claimed, "rb") as handle:
+            file = _UploadedFile(handle, session.filename, claimed)
+            digest, size = hash_file(file)
+            if size != session.size:
+                raise UploadError("The upload is incomplete.")
+            yield file, digest, size
+    except BaseException:
+        # give the file back so the upload can be submitted again, unless storage already moved it
+        if os.path.exists(claimed):
+            os.rename(claimed, path)
+        raise
+    _remove(claimed)
+
+
+def discard(*sessions):
+    """Deletes sessions and whatever is left of their temporary files."""
+    for session in sessions:
+        _remove(temp_path(session))
+    UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+
+
+def expire():
+    """Discards the sessions nobody has sent a chunk to for UPLOAD_SESSION_TTL. Returns how many."""
+    sessions = list(UploadSession.objects.filter(updated_at__lt=timezone.now() - UPLOAD_SESSION_TTL))
+    if sessions:
+        discard(*sessions)
+    return len(sessions)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -7,9 +8,23 @@ app_name = 'papers'
 urlpatterns = [
     path('', views.paper_list_view, name='paper_list'), # This pattern handles the universal list of all papers (e.g., your homepage)
     path('paper/<int:pk>/', views.paper_detail, name='paper_detail'), # This pattern handles the detail view for a single paper
+    path('paper/<int:pk>/progress/', views.paper_progress_view, name='paper_progress'), # JSON state of the paper's background jobs
+    path('paper/<int:pk>/file/<str:kind>/', views.paper_file_view, name='paper_file'), # the PDF and thumbnails, with Range/ETag support
+    path('paper/<int:pk>/regenerate/', views.regenerate_article_view, name='regenerate_article'), # retries the AI article
     path('upload/', views.upload_paper, name='upload_paper'), # This pattern handles the paper upload page    
+    path('upload/chunks/', views.upload_start_view, name='upload_start'), # opens a chunked, resumable upload
+    path('upload/chunks/<uuid:pk>/', views.upload_session_view, name='upload_session'), # chunks, progress and cancelling
     path('delete/<int:pk>', views.delete_paper, name='delete_paper'), # This pattern handles the paper upload page
     path('toggle_bookmark/<int:pk>/', views.toggle_bookmark_view, name='toggle_bookmark'), # This pattern handles bookmarking a paper
     path('bookmarks/', views.bookmarked_papers_view, name='bookmarked_papers'),
+    path('bookmarks/state/', views.bookmark_state_view, name='bookmark_state'),
+    path('processing/stats/', views.processing_stats_view, name='processing_stats'),
+    path('typeahead/<str:kind>/', views.typeahead_view, name='typeahead'), # JSON lookups for users, authors and tags
 ]
 
+# Stored files are for logged-in users only. This route comes before any public
+# static(settings.MEDIA_URL, ...) route the project adds after the papers URLs.
+if settings.MEDIA_URL.startswith('/'):
+    urlpatterns.append(
+        path(f"{settings.MEDIA_URL.lstrip('/')}<path:path>", views.media_file_view, name='media_file')
+    )
@@ -1,48 +1,63 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseForbidden
-from .models import Paper, Tag, Author, Comment
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.db import transaction
+from django.http import Http404, HttpResponseForbidden, JsonResponse
+from .models import Paper, Tag, Author, Comment, UploadSession
 from .forms import PaperUploadForm, CommentForm
+from ai_processing import jobs, queues
+from ai_processing.models import ProcessingJob
 from ai_processing.tasks import generate_article_task
-from django.db.models import Q
-import fitz
-from django.core.files.base import ContentFile
+from .bookmarks import MAX_STATE_IDS, annotate_bookmarks, bookmarked_ids, is_bookmarked, toggle as toggle_bookmark
+from .citations import paper_citations
+from .comments import COMMENT_FRAGMENT_TEMPLATE, COMMENT_PAGE_TEMPLATE, thread_page
+from .duplicates import original_of
+from .feed import following_page
+from .pagination import (
+    PAGE_FRAGMENT_TEMPLATE, PAGE_SIZE, is_fragment_request, is_script_request, offset_page, paginate, paper_cards,
+    request_offset,
+)
+from .profiling import query_budget
+from .search import search
+from .storage import release_blob, store_pdf
+from .tag_cloud import tag_cloud
+from .related import related_papers
+from .tasks import fold_in_related_task, generate_thumbnails_task, index_text_task
+from . import media, typeahead, uploads
 
 
 @login_required
+@query_budget(12)
 def paper_list_view(request):
     """
     Handles displaying the homepage with tabs, search results, and tag-filtered results.
     Supports two main tabs: 'all' (all papers) and 'following' (papers from followed users).
+    Every listing is paginated; infinite scroll requests (?partial=1) get just the next page of cards.
     """
-    all_tags = Tag.objects.all().order_by("name")
     query = request.GET.get("q")
     tag_filter = request.GET.get("tag")
     tab = request.GET.get("tab", "all")  # Default tab = all
     context = {}
 
-    papers_base_qs = Paper.objects.select_related("uploader").prefetch_related(
-        "authors", "tags", "bookmarks"
-    )
+    papers_base_qs = paper_cards(Paper.objects.all())
 
     if query:
-        # Search results
-        papers = papers_base_qs.filter(
-            Q(title__icontains=query)
-            | Q(authors__name__icontains=query)
-            | Q(uploader__username__icontains=query)
-        ).distinct()
+        # Ranked search results; the cursor is the offset into the ranking
+        offset = request_offset(request)
+        results = search(query, offset=offset, limit=PAGE_SIZE)
+        hit_ids = [hit.paper_id for hit in results.hits]
+        papers_by_id = papers_base_qs.in_bulk(hit_ids)
+        papers = [papers_by_id[pk] for pk in hit_ids if pk in papers_by_id]
         context.update({
-            "papers": papers.order_by("-uploaded_at"),
+            "page": offset_page(request, papers, results.total, offset),
             "view_title": f"Search Results for '{query}'",
             "search_query": query,
+            "search_total": results.total,
         })
 
     elif tag_filter:
         # Tag-filtered results
-        papers = papers_base_qs.filter(tags__name=tag_filter)
         context.update({
-            "papers": papers.order_by("-uploaded_at"),
+            "page": paginate(request, papers_base_qs.filter(tags__name=tag_filter)),
             "view_title": f"Papers tagged with '{tag_filter}'",
             "selected_tag": tag_filter,
         })
@@ -50,102 +65,239 @@ def paper_list_view(request):
     else:
         # Homepage tabbed view
         view_title = "CiteRight"
-        all_papers = None
-        feed_papers = None
+        page = None
 
         if tab == "all":
-            all_papers = papers_base_qs.order_by("-uploaded_at")
+            page = paginate(request, papers_base_qs)
         elif tab == "following":
-            followed_users = request.user.profile.following.all()
-            feed_papers = papers_base_qs.filter(
-                uploader__in=followed_users
-            ).order_by("-uploaded_at")
+            # Read from the user's materialized timeline (see papers/feed.py)
+            page = following_page(request, PAGE_SIZE)
 
         context.update({
             "tab": tab,
-            "all_papers": all_papers,
-            "feed_papers": feed_papers,
+            "page": page,
             "is_home_view": True,  # Flag for template
             "view_title": view_title,
         })
 
+    if context["page"] is not None:
+        annotate_bookmarks(request.user, context["page"].items)
+
+    if is_fragment_request(request):
+        return render(request, PAGE_FRAGMENT_TEMPLATE, {"page": context["page"]})
+
     # Always pass tags for sidebar
-    context["all_tags"] = all_tags
+    context["tag_cloud"] = tag_cloud()
 
     return render(request, "papers/paper_list.html", context)
 
 
 @login_required
+@query_budget(14)
 def paper_detail(request, pk):
-    """Displays a single paper and handles its comment section."""
-    paper = get_object_or_404(Paper, pk=pk)
+    """
+    Displays a single paper and handles its comment section. Comments are paginated
+    threads; script requests get HTML fragments back (the next page of threads, or
+    the newly posted comment) instead of the whole page.
+    """
+    paper = get_object_or_404(paper_cards(Paper.objects.all()).defer(None), pk=pk)
     comment_form = CommentForm()
     if request.method == "POST":
         comment_form = CommentForm(request.POST)
+        parent = None
+        parent_id = request.POST.get('parent')
+        if parent_id:
+            if parent_id.isdecimal():
+                parent = Comment.objects.filter(paper=paper, pk=parent_id, depth__lt=Comment.MAX_DEPTH).first()
+            if parent is None:
+                comment_form.add_error(None, "You can't reply to that comment.")
         if comment_form.is_valid():
             comment = comment_form.save(commit=False)
             comment.paper = paper
             comment.user = request.user
+            comment.parent = parent
             comment.save()
+            if is_script_request(request):
+                comment.children = []
+                return render(request, COMMENT_FRAGMENT_TEMPLATE, {'comment': comment, 'paper': paper}, status=201)
             return redirect('papers:paper_detail', pk=paper.pk)
-    context = {'paper': paper, 'comment_form': comment_form}
+        if is_script_request(request):
+            return JsonResponse({'errors': comment_form.errors}, status=400)
+
+    comments = thread_page(request, paper)
+    if is_fragment_request(request):
+        return render(request, COMMENT_PAGE_TEMPLATE, {'comments': comments, 'paper': paper})
+    references, cited_by = paper_citations(paper)
+    context = {
+        'paper': paper,
+        'comment_form': comment_form,
+        'comments': comments,
+        'is_bookmarked': is_bookmarked(request.user, paper),
+        'related_papers': related_papers(paper),
+        'references': references,
+        'cited_by': cited_by,
+        'near_duplicate': original_of(paper) if paper.uploader_id == request.user.pk else None,
+        'article_job': jobs.latest_jobs(paper.pk).get(ProcessingJob.ARTICLE),
+    }
     return render(request, 'papers/paper_detail.html', context)
 
 
 @login_required
+@query_budget(60)
 def upload_paper(request):
-    """Handles the form for uploading a new paper."""
+    """Handles the form for uploading a new paper, with the PDF attached or sent beforehand in chunks."""
     if request.method == 'POST':
-        form = PaperUploadForm(request.POST, request.FILES)
+        form = PaperUploadForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
             paper = form.save(commit=False)
             paper.uploader = request.user
+
+            # Identical bytes are stored once; a re-upload shares the existing blob.
+            upload = form.cleaned_data.get('upload')
+            if upload is not None:
+                try:
+                    with uploads.completed_file(upload) as (uploaded_file, digest, size):
+                        blob, created = store_pdf(uploaded_file, digest, size)
+                except uploads.UploadError as e:
+                    # e.g. the form was submitted twice and the first submit took the file
+                    form.add_error('pdf_file', str(e))
+                    context = {'form': form, 'chunk_size': uploads.UPLOAD_CHUNK_SIZE}
+                    return render(request, 'papers/paper_upload.html', context, status=e.status)
+                uploads.discard(upload)
+            else:
+                blob, created = store_pdf(form.cleaned_data.get('pdf_file'))
+            paper.blob = blob
+            paper.pdf_file = blob.file.name
+            paper.thumbnail = blob.thumbnail.name or None
+            paper.thumbnail_small = blob.thumbnail_small.name or None
             
             choice = form.cleaned_data.get('article_choice')
-            if choice == 'ai':
-                paper.article_content = "Generating AI article & tags, please check back..."
+            reuse_article = choice == 'ai' and bool(blob.ai_article)
+            if reuse_article:
+                paper.article_content = blob.ai_article
+            elif choice == 'ai':
+                # filled in by generate_article_task; the detail page polls its progress meanwhile
+                paper.article_content = None
             else:
                 paper.article_content = form.cleaned_data.get('user_article')
             
-            paper.save()
-            
-            if choice == 'ai':
-                generate_article_task.delay(paper.id)
-
-            # Handle author tagging
-            tagged_users = form.cleaned_data.get('author_users', [])
-            for user in tagged_users:
-                author_profile, created = Author.objects.get_or_create(user=user, defaults={'name': user.username})
-                paper.authors.add(author_profile)
-            new_author_names = form.cleaned_data.get('new_authors')
-            if new_author_names:
-                author_names = [name.strip() for name in new_author_names.split(',') if name.strip()]
-                for name in author_names:
-                    author, created = Author.objects.get_or_create(name=name, user=None)
-                    paper.authors.add(author)
-            
-            # Thumbnail generation logic
-            uploaded_file = form.cleaned_data.get('pdf_file')
-            if uploaded_file and uploaded_file.name.lower().endswith('.pdf'):
-                try:
-                    uploaded_file.seek(0)
-                    doc = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-                    page = doc.load_page(0)
-                    pix = page.get_pixmap()
-                    img_bytes = pix.tobytes("png")
-                    thumbnail_file = ContentFile(img_bytes)
-                    paper.thumbnail.save(f'{paper.pk}_thumbnail.png', thumbnail_file, save=True)
-                    doc.close()
-                except Exception as e:
-                    print(f"Error generating thumbnail: {e}")
-
-            return redirect('papers:paper_list')
+            # The paper, its tags and its authors are written together, so the search
+            # index reads the finished paper once, on commit, rather than after every step.
+            try:
+                with transaction.atomic():
+                    paper.save()
+
+                    if reuse_article:
+                        paper.tags.add(*[Tag.objects.get_or_create(name=name)[0] for name in blob.ai_tags])
+
+                    # Handle author tagging
+                    authors = []
+                    tagged_users = form.cleaned_data.get('author_users', [])
+                    for user in tagged_users:
+                        author_profile, created = Author.objects.get_or_create(user=user, defaults={'name': user.username})
+                        authors.append(author_profile)
+                    new_author_names = form.cleaned_data.get('new_authors')
+                    if new_author_names:
+                        author_names = [name.strip() for name in new_author_names.split(',') if name.strip()]
+                        for name in author_names:
+                            author, created = Author.objects.get_or_create(name=name, user=None)
+                            authors.append(author)
+                    if authors:
+                        paper.authors.add(*authors)
+            except Exception:
+                # store_pdf took a reference to the blob for this paper; give it back
+                release_blob(blob.pk)
+                raise
+
+            if choice == 'ai' and not reuse_article:
+                # the task folds the paper into the related-papers index once it has an article
+                jobs.submit(generate_article_task, paper, ProcessingJob.ARTICLE, (paper.id,))
+            else:
+                # the article task does both of these itself
+                fold_in_related_task.delay(paper.id)
+                queues.dispatch(index_text_task, (paper.id,))
+
+            # Thumbnails are rendered off the request thread, once per blob
+            if not blob.thumbnail_small:
+                jobs.submit(generate_thumbnails_task, paper, ProcessingJob.THUMBNAILS, (blob.pk,))
+
+            return redirect('papers:paper_detail', pk=paper.pk)
     else:
         form = PaperUploadForm()
-    return render(request, 'papers/paper_upload.html', {'form': form})
+    return render(request, 'papers/paper_upload.html', {'form': form, 'chunk_size': uploads.UPLOAD_CHUNK_SIZE})
 
 
 @login_required
+@query_budget(6)
+def upload_start_view(request):
+    """Opens a chunked upload (POST with `filename` and `size`); the response says where to send the chunks."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required.'}, status=405)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'size must be an integer.'}, status=400)
+    try:
+        session = uploads.start(request.user, request.POST.get('filename', ''), size)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(uploads.status(session), status=201)
+
+
+@login_required
+@query_budget(4)
+def upload_session_view(request, pk):
+    """
+    One chunked upload. GET reports how much has arrived (to resume from), PUT
+    appends the chunk in the request body, and DELETE cancels the upload.
+    """
+    session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+    if request.method == 'PUT':
+        try:
+            uploads.append(
+                session, request, request.headers.get('Content-Range'), request.headers.get('X-Chunk-SHA256'),
+            )
+        except uploads.UploadError as e:
+            return JsonResponse({'error': str(e), **uploads.status(session)}, status=e.status)
+    elif request.method == 'DELETE':
+        uploads.discard(session)
+        return JsonResponse({'deleted': True})
+    elif request.method != 'GET':
+        return JsonResponse({'error': 'GET, PUT or DELETE required.'}, status=405)
+    return JsonResponse(uploads.status(session))
+
+
+# what paper_file_view serves: the paper field and how long browsers may keep it
+PAPER_FILES = {
+    'pdf': ('pdf_file', media.PAPER_FILE_MAX_AGE),
+    'thumbnail': ('thumbnail', media.THUMBNAIL_MAX_AGE),
+    'thumbnail_small': ('thumbnail_small', media.THUMBNAIL_MAX_AGE),
+}
+
+
+@login_required
+@query_budget(1)
+def paper_file_view(request, pk, kind):
+    """Serves a paper's PDF or a thumbnail with range requests and conditional GETs (see media.py)."""
+    if kind not in PAPER_FILES:
+        raise Http404("No such file.")
+    field, max_age = PAPER_FILES[kind]
+    paper = get_object_or_404(Paper.objects.only('pk', field), pk=pk)
+    field_file = getattr(paper, field)
+    if not field_file:
+        raise Http404("No such file.")
+    return media.serve(request, field_file, max_age, paper.filename() if kind == 'pdf' else None)
+
+
+@login_required
+@query_budget(0)
+def media_file_view(request, path):
+    """Serves any stored file under MEDIA_URL to logged-in users, like paper_file_view does."""
+    return media.serve(request, media.StoredFile(path), media.THUMBNAIL_MAX_AGE)
+
+
+@login_required
+@query_budget(10)
 def edit_abstract_view(request, pk):
     """Allows the uploader to edit the paper's article content."""
     paper = get_object_or_404(Paper, pk=pk)
@@ -159,6 +311,7 @@ def edit_abstract_view(request, pk):
 
 
 @login_required
+@query_budget(40)
 def delete_paper(request, pk):
     """Handles the deletion of a paper."""
     paper = get_object_or_404(Paper, pk=pk)
@@ -171,24 +324,89 @@ def delete_paper(request, pk):
 
 
 @login_required
+@query_budget(6)
 def bookmarked_papers_view(request):
     """Displays a list of papers the user has bookmarked."""
-    papers = request.user.bookmarked_papers.all().order_by('-uploaded_at')
+    page = paginate(request, paper_cards(request.user.bookmarked_papers.all()))
+    for paper in page.items:
+        paper.is_bookmarked = True
+    if is_fragment_request(request):
+        return render(request, PAGE_FRAGMENT_TEMPLATE, {'page': page})
     context = {
-        'papers': papers,
+        'page': page,
         'view_title': 'My Bookmarks',
-        'all_tags': Tag.objects.all().order_by('name'),
+        'tag_cloud': tag_cloud(),
     }
     return render(request, 'papers/paper_list.html', context)
 
 
 @login_required
+@query_budget(12)
 def toggle_bookmark_view(request, pk):
-    """Adds or removes a paper from the user's bookmarks."""
-    paper = get_object_or_404(Paper, pk=pk)
-    if paper in request.user.bookmarked_papers.all():
-        request.user.bookmarked_papers.remove(paper)
-    else:
-        request.user.bookmarked_papers.add(paper)
+    """
+    Adds or removes a paper from the user's bookmarks. POST requests (from the
+    bookmark buttons' script) get the new state as JSON; plain links are redirected back.
+    """
+    paper = get_object_or_404(Paper.objects.only('pk'), pk=pk)
+    bookmarked, bookmark_count = toggle_bookmark(request.user, paper)
+    if request.method == 'POST':
+        return JsonResponse({'bookmarked': bookmarked, 'bookmark_count': bookmark_count})
     return redirect(request.META.get('HTTP_REFERER', 'papers:paper_list'))
 
+
+@login_required
+@query_budget(2)
+def bookmark_state_view(request):
+    """Returns which of the paper ids in ?ids=1,2,3 the user has bookmarked."""
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk][:MAX_STATE_IDS]
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of integers.'}, status=400)
+    return JsonResponse({'bookmarked': sorted(bookmarked_ids(request.user, ids))})
+
+
+@login_required
+@query_budget(2)
+def typeahead_view(request, kind):
+    """Returns up to ?limit= users, authors or tags whose names start with ?q=, as {"results": [{"id", "label"}]}."""
+    if kind not in typeahead.SOURCES:
+        raise Http404
+    try:
+        limit = int(request.GET.get('limit', typeahead.TYPEAHEAD_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer.'}, status=400)
+    return JsonResponse({'results': typeahead.lookup(kind, request.GET.get('q', ''), limit)})
+
+
+@login_required
+@query_budget(3)
+def paper_progress_view(request, pk):
+    """Returns the state of the paper's latest article and thumbnail jobs, for the detail page to poll."""
+    paper = get_object_or_404(Paper.objects.only('pk', 'uploader_id'), pk=pk)
+    return JsonResponse(jobs.progress(paper, request.user))
+
+
+@login_required
+@query_budget(6)
+def regenerate_article_view(request, pk):
+    """
+    Lets the uploader retry the AI article (POST only). A run that is already queued
+    or running is reused rather than doubled; the response is the paper's progress.
+    """
+    paper = get_object_or_404(Paper.objects.only('pk', 'uploader_id'), pk=pk)
+    if paper.uploader_id != request.user.pk:
+        return HttpResponseForbidden("You are not allowed to regenerate this article.")
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required.'}, status=405)
+    job, created = jobs.submit(generate_article_task, paper, ProcessingJob.ARTICLE, (paper.pk,))
+    return JsonResponse({'created': created, **jobs.progress(paper, request.user)}, status=202 if created else 200)
+
+
+@user_passes_test(lambda user: user.is_staff)
+@query_budget(4)
+def processing_stats_view(request):
+    """
+    Staff only: p50/p95 stage latencies and failure rates of the last day's processing jobs,
+    and each queue's depth and wait times.
+    """
+    return JsonResponse({'pipelines': jobs.stage_stats(), 'queues': jobs.queue_stats()})
@@ -0,0 +1,84 @@
+"""
+Denormalized social counters on UserProfile.
+
+following_count, follower_count, paper_count and bookmark_count are adjusted
+with F() updates inside the transaction that changes the underlying rows (see
+the receivers in profiles/models.py and papers/models.py), so profile pages never
+COUNT over follows, papers or bookmarks. The profile header built from them is
+cached per user and dropped once a change commits. reconcile_counters repairs drift.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import UserProfile
+
+COUNTER_FIELDS = ("following_count", "follower_count", "paper_count", "bookmark_count")
+
+PROFILE_HEADER_TTL = getattr(settings, "PROFILE_HEADER_TTL", 60 * 60)
+
+VERSION_KEY = "profiles:header:version"
+
+
+def header_cache_key(user_id):
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    return f"profiles:header:{version}:{user_id}"
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def invalidate(user_ids):
+    """Drops the cached headers of these users once the current transaction commits."""
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: cache.delete_many([header_cache_key(user_id) for user_id in user_ids]))
+
+
+def adjust(user_ids, field, delta):
+    """Adds `delta` to one counter of each of the given users."""
+    user_ids = list(user_ids)
+    if user_ids and delta:
+        UserProfile.objects.filter(user_id__in=user_ids).update(**{field: F(field) + delta})
+        invalidate(user_ids)
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(queryset.order_by().values(field).annotate(n=Count("pk")).values("n")), 0)
+
+
+def recount(user_ids=None):
+    """Recomputes every counter from the source tables, for the given users or all of them."""
+    from papers.models import Paper
+
+    follows = UserProfile.following.through.objects
+    bookmarks = Paper.bookmarks.through.objects
+    profiles = UserProfile.objects.all() if user_ids is None else UserProfile.objects.filter(user_id__in=user_ids)
+    updated = profiles.update(
+        following_count=_count(follows.filter(userprofile_id=OuterRef("pk")), "userprofile_id"),
+        follower_count=_count(follows.filter(user_id=OuterRef("user_id")), "user_id"),
+        paper_count=_count(Paper.objects.filter(uploader_id=OuterRef("user_id")), "uploader_id"),
+        bookmark_count=_count(bookmarks.filter(user_id=OuterRef("user_id")), "user_id"),
+    )
+    if user_ids is None:
+        transaction.on_commit(_bump_version)
+    else:
+        invalidate(user_ids)
+    return updated
+
+
+def profile_header(user):
+    """The counters shown in a user's profile header, as a dict (cached)."""
+    key = header_cache_key(user.pk)
+    header = cache.get(key)
+    if header is None:
+        header = UserProfile.objects.filter(user_id=user.pk).values(*COUNTER_FIELDS).first()
+        header = header or dict.fromkeys(COUNTER_FIELDS, 0)
+        cache.set(key, header, PROFILE_HEADER_TTL)
+    return header
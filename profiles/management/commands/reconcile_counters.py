@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from profiles.counters import COUNTER_FIELDS, recount
+from profiles.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Recomputes every profile's following, follower, paper and bookmark counters from the source tables."
+
+    def handle(self, *args, **options):
+        before = {row["pk"]: row for row in UserProfile.objects.values("pk", *COUNTER_FIELDS)}
+        updated = recount()
+        drifted = sum(1 for row in UserProfile.objects.values("pk", *COUNTER_FIELDS) if before.get(row["pk"]) != row)
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {updated} profiles; {drifted} had drifted."))
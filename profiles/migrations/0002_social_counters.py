@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(queryset.order_by().values(field).annotate(n=Count("pk")).values("n")), 0)
+
+
+def count_everything(apps, schema_editor):
+    UserProfile = apps.get_model("profiles", "UserProfile")
+    Paper = apps.get_model("papers", "Paper")
+    follows = UserProfile.following.through.objects
+    bookmarks = Paper.bookmarks.through.objects
+    UserProfile.objects.update(
+        following_count=_count(follows.filter(userprofile_id=OuterRef("pk")), "userprofile_id"),
+        follower_count=_count(follows.filter(user_id=OuterRef("user_id")), "user_id"),
+        paper_count=_count(Paper.objects.filter(uploader_id=OuterRef("user_id")), "uploader_id"),
+        bookmark_count=_count(bookmarks.filter(user_id=OuterRef("user_id")), "user_id"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0012_paper_bookmark_count'),
+        ('profiles', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='bookmark_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='paper_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_everything, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_feed_entries(apps, schema_editor):
+    UserProfile = apps.get_model("profiles", "UserProfile")
+    FeedEntry = apps.get_model("papers", "FeedEntry")
+    entries = FeedEntry.objects.filter(user_id=OuterRef("user_id")).order_by().values("user_id")
+    UserProfile.objects.update(feed_length=Coalesce(Subquery(entries.annotate(n=Count("pk")).values("n")), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0010_feed_entry'),
+        ('profiles', '0002_social_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='feed_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_feed_entries, migrations.RunPython.noop),
+    ]
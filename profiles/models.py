@@ -1,13 +1,20 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, m2m_changed
 from django.dispatch import receiver
 
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     following = models.ManyToManyField(User, related_name="folowers", blank=True)
-    
+    # Denormalized counters, maintained by the receivers below and in papers.models (see counters.py)
+    following_count = models.PositiveIntegerField(default=0)
+    follower_count = models.PositiveIntegerField(default=0)
+    paper_count = models.PositiveIntegerField(default=0)
+    bookmark_count = models.PositiveIntegerField(default=0)
+    # Entries in the user's materialized following timeline, maintained by papers.feed
+    feed_length = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return f'{self.user.username} Profile'
 
@@ -23,4 +30,37 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+    instance.profile.save()
+
+
+"""
+Keep following_count and follower_count in step with the follow table. Follows
+are counted exactly (pk_set only holds the new rows); unfollows recount the
+users involved since pk_set may name users that were never followed.
+"""
+@receiver(m2m_changed, sender=UserProfile.following.through)
+def count_follows(sender, instance, action, reverse, pk_set, **kwargs):
+    from . import counters
+    if action == "pre_clear":
+        if reverse:
+            instance._cleared_follow_ids = list(instance.folowers.values_list("user_id", flat=True))
+        else:
+            instance._cleared_follow_ids = list(instance.following.values_list("id", flat=True))
+    elif action == "post_add" and pk_set:
+        if reverse:
+            # user.folowers.add(*profiles): pk_set holds profile ids
+            follower_ids = UserProfile.objects.filter(pk__in=pk_set).values_list("user_id", flat=True)
+            counters.adjust(follower_ids, "following_count", 1)
+            counters.adjust([instance.pk], "follower_count", len(pk_set))
+        else:
+            counters.adjust([instance.user_id], "following_count", len(pk_set))
+            counters.adjust(pk_set, "follower_count", 1)
+    elif action in ("post_remove", "post_clear"):
+        if action == "post_clear":
+            others = getattr(instance, "_cleared_follow_ids", [])
+        elif reverse:
+            others = UserProfile.objects.filter(pk__in=pk_set).values_list("user_id", flat=True)
+        else:
+            others = pk_set
+        counters.recount([instance.pk if reverse else instance.user_id, *others])
+
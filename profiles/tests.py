@@ -1,3 +1,80 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from papers.models import Paper
+from papers.tests import QueryBudgetTestCase, queue_tasks_in_memory
+from . import counters
+from .models import UserProfile
+
+
+class ProfileViewBudgetTests(QueryBudgetTestCase):
+
+    def test_profile_view(self):
+        busiest = self.corpus["busiest_uploader"]
+        for username, params in (
+            (busiest, {}), (busiest, {"partial": "1"}),
+            (self.viewer.username, {}), (self.viewer.username, {"tab": "bookmarked"}),
+            (self.viewer.username, {"tab": "bookmarked", "partial": "1"}),
+        ):
+            with self.subTest(username=username, **params):
+                response = self.client.get(reverse("profiles:profile_view", args=[username]), params)
+                self.assertStatus(response, 200)
+
+    def test_follow_and_unfollow(self):
+        other = User.objects.exclude(pk=self.viewer.pk).exclude(folowers__user=self.viewer).first()
+        self.assertStatus(self.client.post(reverse("profiles:follow_user", args=[other.username])), 302)
+        self.assertTrue(self.viewer.profile.following.filter(pk=other.pk).exists())
+        self.assertStatus(self.client.post(reverse("profiles:unfollow_user", args=[other.username])), 302)
+        self.assertFalse(self.viewer.profile.following.filter(pk=other.pk).exists())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CounterTests(TestCase):
+    """Follows adjust both users' counters, unfollows recount them, and recount() repairs drift."""
+
+    def setUp(self):
+        queue_tasks_in_memory(self)
+        cache.clear()
+        self.ada, self.bob, self.cy = (User.objects.create(username=name) for name in ("ada", "bob", "cy"))
+
+    def counts(self, user, *fields):
+        return tuple(UserProfile.objects.filter(user=user).values_list(*fields).get())
+
+    def test_follow(self):
+        self.ada.profile.following.add(self.bob, self.cy)
+        self.ada.profile.following.add(self.bob)  # already followed: not counted again
+        self.assertEqual(self.counts(self.ada, "following_count", "follower_count"), (2, 0))
+        self.assertEqual(self.counts(self.bob, "following_count", "follower_count"), (0, 1))
+        # from the followed user's side
+        self.bob.folowers.add(self.cy.profile)
+        self.assertEqual(self.counts(self.cy, "following_count", "follower_count"), (1, 1))
+        self.assertEqual(self.counts(self.bob, "following_count", "follower_count"), (0, 2))
+
+    def test_unfollow(self):
+        self.ada.profile.following.add(self.bob, self.cy)
+        self.ada.profile.following.remove(self.bob)
+        self.ada.profile.following.remove(self.bob)  # no longer followed: nothing to take off
+        self.assertEqual(self.counts(self.ada, "following_count"), (1,))
+        self.assertEqual(self.counts(self.bob, "follower_count"), (0,))
+        self.ada.profile.following.clear()
+        self.assertEqual(self.counts(self.ada, "following_count"), (0,))
+        self.assertEqual(self.counts(self.cy, "follower_count"), (0,))
+
+    def test_recount(self):
+        self.ada.profile.following.add(self.bob)
+        paper = Paper.objects.create(uploader=self.bob, title="A paper", pdf_file="papers/a.pdf")
+        paper.bookmarks.add(self.ada)
+        UserProfile.objects.update(following_count=7, follower_count=7, paper_count=7, bookmark_count=7)
+        counters.recount()
+        fields = ("following_count", "follower_count", "paper_count", "bookmark_count")
+        self.assertEqual(self.counts(self.ada, *fields), (1, 0, 0, 1))
+        self.assertEqual(self.counts(self.bob, *fields), (0, 1, 1, 0))
+        self.assertEqual(self.counts(self.cy, *fields), (0, 0, 0, 0))
+
+    def test_header_cache_dropped_on_commit(self):
+        self.assertEqual(counters.profile_header(self.bob)["follower_count"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ada.profile.following.add(self.bob)
+        self.assertEqual(counters.profile_header(self.bob)["follower_count"], 1)
@@ -1,9 +1,20 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.db import transaction
+from papers import feed
+from papers.bookmarks import annotate_bookmarks
 from papers.models import Paper, Tag
+from papers.pagination import PAGE_FRAGMENT_TEMPLATE, is_fragment_request, paginate, paper_cards
+from papers.profiling import query_budget
+from .counters import profile_header
+from .models import UserProfile
+
+# How many followed users the owner's profile sidebar lists.
+FOLLOWING_PREVIEW_SIZE = 12
 
 @login_required
+@query_budget(12)
 def profile_view(request, username):
     """
     Handles displaying a user's profile page, including their stats,
@@ -13,43 +24,54 @@ def profile_view(request, username):
     profile_user = get_object_or_404(User, username=username)
     
     tab = request.GET.get("tab", "uploaded")
-    uploaded_papers = None
-    bookmarked_papers = None
+    page = None
 
     if tab == "uploaded":
-        uploaded_papers = Paper.objects.filter(uploader=profile_user).order_by("-uploaded_at")
+        page = paginate(request, paper_cards(Paper.objects.filter(uploader=profile_user)))
 
     elif tab == "bookmarked" and request.user == profile_user:
-        bookmarked_papers = request.user.bookmarked_papers.all().order_by("-uploaded_at")
+        page = paginate(request, paper_cards(request.user.bookmarked_papers.all()))
+
+    if page is not None:
+        annotate_bookmarks(request.user, page.items)
 
-    following_count = profile_user.profile.following.count()
-    paper_count = (
-        Paper.objects.filter(uploader=profile_user).count()
-    )
+    if is_fragment_request(request):
+        return render(request, PAGE_FRAGMENT_TEMPLATE, {"page": page})
 
     context = {
         "tab": tab,
-        "papers": uploaded_papers,
-        "bookmarked_papers": bookmarked_papers,
+        "page": page,
         "profile_user": profile_user,
-        "following_count": following_count,
-        "paper_count": paper_count
+        "header": profile_header(profile_user),
+        "is_following": UserProfile.following.through.objects.filter(
+            userprofile__user=request.user, user=profile_user
+        ).exists(),
     }
+    if request.user == profile_user:
+        context["following_preview"] = User.objects.filter(folowers__user=profile_user).order_by("username")[
+            :FOLLOWING_PREVIEW_SIZE
+        ]
 
     return render(request, "papers/paper_list.html", context)
 
 
 @login_required
+@query_budget(15)
 def follow_user(request, username):
     """Handles the logic for following a user."""
     user_to_follow = get_object_or_404(User, username=username)
-    request.user.profile.following.add(user_to_follow)
+    with transaction.atomic():
+        request.user.profile.following.add(user_to_follow)
+        feed.follow(request.user, user_to_follow)
     return redirect("profiles:profile_view", username=username)
 
 
 @login_required
+@query_budget(10)
 def unfollow_user(request, username):
     """Handles the logic for unfollowing a user."""
     user_to_unfollow = get_object_or_404(User, username=username)
-    request.user.profile.following.remove(user_to_unfollow)
+    with transaction.atomic():
+        request.user.profile.following.remove(user_to_unfollow)
+        feed.unfollow(request.user, user_to_unfollow)
     return redirect("profiles:profile_view", username=username)